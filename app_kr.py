@@ -1,23 +1,91 @@
 import sys
 import os
+import multiprocessing
+from dataclasses import replace
+# First, so that the startup report counts every import below
+from heif2png.startup import load_codecs, report_target, startup_timer
 from PyQt6.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QComboBox,
-    QCheckBox, QPushButton, QListWidget, QStackedWidget, QSizePolicy,
-    QMessageBox, QFrame, QSplitter, QProgressBar, QGridLayout
+    QCheckBox, QPushButton, QListWidget, QListWidgetItem, QStackedWidget, QSizePolicy,
+    QMessageBox, QFrame, QSplitter, QProgressBar, QGridLayout, QLineEdit, QFileDialog,
+    QColorDialog, QTableView, QHeaderView, QAbstractItemView, QSpinBox
 )
-from PyQt6.QtCore import Qt, QMimeData, QUrl, QSettings
-from PyQt6.QtGui import QDragEnterEvent, QDropEvent, QPixmap, QImage, QPalette, QColor
-
-
-try:
-    from pillow_heif import register_heif_opener
-    register_heif_opener()
-except ImportError:
-    QMessageBox.critical(
-        None, "라이브러리 오류", "pillow-heif 라이브러리를 찾을 수 없습니다. 설치해주세요.")
-    sys.exit(1)
+from PyQt6.QtCore import (
+    Qt, QMimeData, QUrl, QSettings, QSize, QTimer, QAbstractListModel, QModelIndex
+)
+from PyQt6.QtGui import QDragEnterEvent, QDropEvent, QPixmap, QImage, QPalette, QColor, QIcon
 
-from PIL import Image
+from heif2png.archives import (
+    archive_outputs, archive_sources, is_archive, is_member_path, split_member_path
+)
+from heif2png.cache import decoded_images
+from heif2png.color import SRGB
+from heif2png.conversion import (
+    ConversionOptions, Rendition, check_renditions, output_directory, parse_renditions
+)
+from heif2png.fileindex import SORT_KEYS, FileIndex
+from heif2png.governor import BACKGROUND, LOAD, ResourceLimits
+from heif2png.jobs import CANCELLED, DONE, PAUSED, QUEUED, RUNNING, JobQueue, JobScheduler
+from heif2png.jobs import default_path as default_jobs_path
+from heif2png.prefetch import PreviewPrefetcher
+from heif2png.profiling import ProfileSession
+from heif2png.progress import PROGRESS_INTERVAL, ProgressTracker, file_bytes, format_duration
+from heif2png.scanindex import scan_index
+from heif2png.session import CONVERTED, FAILED, SAVE_INTERVAL as SESSION_SAVE_INTERVAL
+from heif2png.session import Session, SessionStore
+from heif2png.staging import NETWORK, NEVER
+from heif2png.tuning import workload_profile
+from heif2png.thumbnails import SIZES as THUMBNAIL_SIZES, thumbnail_cache
+from heif2png.verify import VerificationError
+from heif2png.workers import Concurrency, cpu_count
+
+startup_timer.mark("import")
+
+
+def pil_to_pixmap(pil_image):
+    if pil_image.mode == "RGBA":
+        data = pil_image.tobytes("raw", "RGBA")
+        q_image = QImage(data, pil_image.width, pil_image.height,
+                         pil_image.width * 4, QImage.Format.Format_RGBA8888)
+    elif pil_image.mode == "RGB":
+        data = pil_image.tobytes("raw", "RGB")
+        q_image = QImage(data, pil_image.width, pil_image.height,
+                         pil_image.width * 3, QImage.Format.Format_RGB888)
+    else:
+        pil_image = pil_image.convert("RGB")  # Default conversion
+        data = pil_image.tobytes("raw", "RGB")
+        q_image = QImage(data, pil_image.width, pil_image.height,
+                         pil_image.width * 3, QImage.Format.Format_RGB888)
+    return QPixmap.fromImage(q_image)  # Copies, so data may go out of scope
+
+
+def describe_file(path, info, status=None):
+    lines = [path]
+    if status == CONVERTED:
+        lines.append("변환됨")
+    elif status == FAILED:
+        lines.append("변환 실패")
+    if info is None:
+        lines.append("세부 정보를 읽는 중...")
+        return "\n".join(lines)
+    if info.size is not None:
+        lines.append(f"크기: {info.size / 2**20:.1f} MB")
+    if info.capture_date:
+        lines.append(f"촬영 일시: {info.capture_date}")
+    if info.width is not None:
+        lines.append(f"해상도: {info.width} x {info.height}")
+    return "\n".join(lines)
+
+
+def describe_pressure(pressure):
+    # What a job waits for, from a governor.Pressure
+    if pressure.reason == LOAD:
+        return f"시스템 부하 코어당 {pressure.value:.1f}"
+    return f"사용 가능한 메모리 {pressure.value:.0f}%"
+
+
+def describe_concurrency(concurrency):
+    return f"프로세스 {concurrency.processes}개 x 디코딩 스레드 {concurrency.decode_threads}개"
 
 
 class HoverLabel(QLabel):
@@ -31,7 +99,7 @@ class HoverLabel(QLabel):
         self.setStyleSheet(
             "QLabel { border: 2px dashed #aaa; padding: 20px; background-color: #f0f0f0; }")
         self.setText(
-            "HEIC/HEIF 파일이나 폴더를 여기로 드래그하세요.\n\n"
+            "HEIC/HEIF 파일, 폴더 또는 ZIP/TAR 압축 파일을 여기로 드래그하세요.\n\n"
             "옵션을 확인한 후, 아래의 '변환 시작' 버튼을 클릭하세요.")
 
     def set_hover_style(self):
@@ -60,20 +128,37 @@ class HoverLabel(QLabel):
                 main_window.process_dropped_urls(event.mimeData().urls())
 
 
-class FileListWidget(QListWidget):
+class FileListView(QTableView):
+    # A one-column table without headers or grid, which looks like a list.
+    # Its rows all have the header's default height, so nothing is laid out
+    # per row; a QListView asks the model about every row whenever the list
+    # is reset, which takes most of a second with 200k files.
+    ROW_HEIGHT = 36
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setAcceptDrops(True)
-        self.setDragDropMode(QListWidget.DragDropMode.DropOnly)
+        self.setDragDropMode(QAbstractItemView.DragDropMode.DropOnly)
         self.setAlternatingRowColors(True)
+        self.setIconSize(QSize(32, 32))
+        self.setShowGrid(False)
+        self.setWordWrap(False)
+        self.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
+        self.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.horizontalHeader().hide()
+        self.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.verticalHeader().hide()
+        self.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        self.verticalHeader().setDefaultSectionSize(self.ROW_HEIGHT)
         self.set_normal_style()
 
     def set_normal_style(self):
-        self.setStyleSheet("QListWidget { border: 1px solid #ccc; }")
+        self.setStyleSheet("QTableView { border: 1px solid #ccc; }")
 
     def set_hover_style(self):
         self.setStyleSheet(
-            "QListWidget { border: 2px solid #0078d7; background-color: #f5faff; }")
+            "QTableView { border: 2px solid #0078d7; background-color: #f5faff; }")
 
     def dragEnterEvent(self, event: QDragEnterEvent):
         if event.mimeData().hasUrls():
@@ -107,19 +192,215 @@ class FileListWidget(QListWidget):
             event.ignore()
 
 
+class ShownPaths:
+    # The paths of the shown rows, as a sequence, without copying them
+    def __init__(self, paths, rows):
+        self._paths = paths
+        self._rows = rows
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __getitem__(self, row):
+        return self._paths[self._rows[row]]
+
+
+class FileListModel(QAbstractListModel):
+    # The file list as shown: rows are indexes into paths in the current sort
+    # and filter order, so sorting or filtering only swaps a list of ints.
+    # Names, icons and tooltips are produced when a row is painted.
+
+    def __init__(self, file_index, parent=None):
+        super().__init__(parent)
+        self.file_index = file_index
+        self.paths = []
+        self.rows = []
+        # Built on the first row_of() after the list or its rows change, so
+        # icons arriving one by one never scan the list
+        self._positions = None  # path -> index into paths
+        self._shown_rows = None  # index into paths -> row, -1 if not shown
+        self.icons = {}  # path -> QIcon from the thumbnail cache
+        self.statuses = {}  # path -> session.CONVERTED or FAILED
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        position = self.rows[index.row()]
+        path = self.paths[position]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return os.path.basename(path)
+        if role == Qt.ItemDataRole.UserRole:
+            return path
+        if role == Qt.ItemDataRole.DecorationRole:
+            return self.icons.get(path)
+        if role == Qt.ItemDataRole.ToolTipRole:
+            return describe_file(path, self.file_index.info(position), self.statuses.get(path))
+        return None
+
+    def set_rows(self, paths, rows):
+        # paths must be replaced, not changed in place, when the list changes
+        self.beginResetModel()
+        if paths is not self.paths:
+            self._positions = None
+        self.paths = paths
+        self.rows = rows
+        self._shown_rows = None
+        self.endResetModel()
+
+    def row_of(self, path):
+        # -1 when path is not shown
+        if self._positions is None:
+            self._positions = {path: position for position, path in enumerate(self.paths)}
+        if self._shown_rows is None:
+            self._shown_rows = [-1] * len(self.paths)
+            for row, position in enumerate(self.rows):
+                self._shown_rows[position] = row
+        position = self._positions.get(path)
+        return -1 if position is None else self._shown_rows[position]
+
+    def shown_paths(self):
+        return ShownPaths(self.paths, self.rows)
+
+    def set_icon(self, path, icon):
+        self.icons[path] = icon
+        row = self.row_of(path)
+        if row >= 0:
+            self.dataChanged.emit(self.index(row), self.index(row),
+                                  [Qt.ItemDataRole.DecorationRole])
+
+    def icons_changed(self):
+        # Only the rows on screen are repainted
+        if self.rows:
+            self.dataChanged.emit(self.index(0), self.index(len(self.rows) - 1),
+                                  [Qt.ItemDataRole.DecorationRole])
+
+
 class HEICConverterApp(QWidget):
     MIN_WIDTH_FOR_PREVIEW = 750
     PREVIEW_PLACEHOLDER_COLOR = QColor(220, 220, 220)
     SETTINGS_REPLACE_ORIGINAL = "replaceOriginal"
     SETTINGS_MAINTAIN_METADATA = "maintainMetadata"
-
-    def __init__(self):
+    SETTINGS_EXTRA_RENDITIONS = "extraRenditions"
+    SETTINGS_COLOR_TARGET = "colorTarget"
+    SETTINGS_MATTE_COLOR = "matteColor"
+    SETTINGS_ANIMATE_SEQUENCES = "animateSequences"
+    SETTINGS_ARCHIVE_OUTPUT = "archiveOutput"
+    SETTINGS_VERIFY_OUTPUTS = "verifyOutputs"
+    SETTINGS_RUN_IN_BACKGROUND = "runInBackground"
+    SETTINGS_MAX_CORES = "maxCores"
+    SETTINGS_WRITE_LIMIT = "writeLimit"  # MB per second
+    SETTINGS_STAGE_OUTPUTS = "stageNetworkOutputs"
+    SETTINGS_CONCURRENCY = "concurrency"  # Group of best concurrency per workload profile
+    ICON_BATCH_SIZE = 32  # List icons loaded from the thumbnail cache per timer tick
+    JOB_POLL_INTERVAL = 50  # Milliseconds between checks for finished files
+    CODEC_POLL_INTERVAL = 20  # Milliseconds between checks for the background codec load
+    INDEX_REFRESH_INTERVAL = 1000  # Milliseconds between re-sorts while headers are read
+    JOB_STATE_LABELS = {
+        QUEUED: "대기 중", RUNNING: "진행 중", PAUSED: "일시 정지",
+        CANCELLED: "취소됨", DONE: "완료",
+    }
+
+    def __init__(self, startup_report=(False, None)):
         super().__init__()
+        # pillow_heif and Pillow's plugins load in the background once the
+        # window has been painted; whatever decodes waits for them
+        self.startup_report = startup_report  # startup.report_target()
+        self.painted = False
+        self.codec_timer = QTimer(self)
+        self.codec_timer.setInterval(self.CODEC_POLL_INTERVAL)
+        self.codec_timer.timeout.connect(self.check_codecs)
         self.file_paths = []
         self.current_preview_path = None
+        # Sorting and filtering run on an index of the list, filled in the
+        # background from the file headers
+        self.file_index = FileIndex()
+        self.file_model = FileListModel(self.file_index, self)
+        self._indexed_shown = 0
+        self._refiltering = False
+        self.index_timer = QTimer(self)
+        self.index_timer.setInterval(self.INDEX_REFRESH_INTERVAL)
+        self.index_timer.timeout.connect(self.refresh_file_index)
+        self._pending_icon_paths = []
+        self.icon_timer = QTimer(self)
+        self.icon_timer.setInterval(0)
+        self.icon_timer.timeout.connect(self.load_pending_icons)
+        self.prefetcher = PreviewPrefetcher()
         # Use your company/app name
         self.settings = QSettings("DevJaewonE", "HEICConverterApp")
+        # Batches wait in a persistent queue and run on one shared worker pool
+        self.job_queue = JobQueue(default_jobs_path())
+        self.job_queue.load()
+        self.scheduler = JobScheduler(
+            self.job_queue, self.remembered_concurrency, self.store_concurrency)
+        self.calibrations = {}  # Profile key -> (Concurrency, trials) for the next summary
+        self.job_timer = QTimer(self)
+        self.job_timer.setInterval(self.JOB_POLL_INTERVAL)
+        self.job_timer.timeout.connect(self.poll_jobs)
+        self._polling_jobs = False
+        # Finished files only update counters; the display catches up at a
+        # fixed rate however many files finish in between
+        self.progress_trackers = {}  # job id -> ProgressTracker of the current run
+        self._jobs_changed = False
+        self.progress_timer = QTimer(self)
+        self.progress_timer.setInterval(int(PROGRESS_INTERVAL * 1000))
+        self.progress_timer.timeout.connect(self.refresh_progress)
+        self.profile_session = None  # Records the job with id profiled_job_id
+        self.profiled_job_id = None
+        # The file list comes back from the last run, and is saved on close
+        # and periodically in case the app does not get to close
+        self.session_store = SessionStore()
+        self._session_version = 0  # Bumped when the list or a file's status changes
+        self._saved_session = None  # What the last save was of, to skip unchanged ones
+        self._session_restored = False  # Until then, saving would overwrite the last session
+        self.session_timer = QTimer(self)
+        self.session_timer.setInterval(int(SESSION_SAVE_INTERVAL * 1000))
+        self.session_timer.timeout.connect(self.save_session)
         self.init_ui()
+        self.update_job_list()
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if not self.painted:
+            self.painted = True
+            startup_timer.mark("first paint")
+            load_codecs()
+            self.codec_timer.start()
+
+    def check_codecs(self):
+        if not load_codecs().done():
+            return
+        self.codec_timer.stop()
+        if not self.wait_for_codecs():
+            return
+        self.restore_session()
+        enabled, report_path = self.startup_report
+        if enabled:
+            print(startup_timer.report(), file=sys.stderr)
+            if report_path:
+                try:
+                    startup_timer.save(report_path)
+                except OSError as e:
+                    print(f"경고: 시작 시간 보고서를 {report_path}에 저장할 수 없습니다: {e}")
+
+    def wait_for_codecs(self):
+        # False, after telling the user and quitting, if pillow_heif is missing
+        # or the codecs fail to load
+        try:
+            load_codecs().result()
+        except ImportError:
+            QMessageBox.critical(
+                self, "라이브러리 오류", "pillow-heif 라이브러리를 찾을 수 없습니다. 설치해주세요.")
+            QApplication.exit(1)
+            return False
+        except Exception as e:
+            QMessageBox.critical(
+                self, "라이브러리 오류", f"HEIF 코덱을 불러올 수 없습니다: {type(e).__name__}: {e}")
+            QApplication.exit(1)
+            return False
+        return True
 
     def init_ui(self):
         self.setWindowTitle('HEIC 변환기')
@@ -157,6 +438,102 @@ class HEICConverterApp(QWidget):
         self.metadata_checkbox.setChecked(self.settings.value(
             self.SETTINGS_MAINTAIN_METADATA, True, type=bool))
 
+        self.animate_checkbox = QCheckBox("연속 이미지 애니메이션")
+        self.animate_checkbox.setToolTip(
+            "선택하면 HEIF 이미지 시퀀스와 연속 촬영 사진을 움직이는\n"
+            "WEBP 또는 PNG(APNG)로 저장합니다. JPEG는 대표 이미지만 저장합니다.")
+        self.animate_checkbox.setChecked(self.settings.value(
+            self.SETTINGS_ANIMATE_SEQUENCES, False, type=bool))
+
+        self.archive_checkbox = QCheckBox("압축 파일은 ZIP으로 저장")
+        self.archive_checkbox.setToolTip(
+            "선택하면 드래그한 ZIP 또는 TAR 압축 파일의 이미지를 'Converted Files' 폴더 대신\n"
+            "새 '<압축 파일> (converted).zip'에 저장합니다.")
+        self.archive_checkbox.setChecked(self.settings.value(
+            self.SETTINGS_ARCHIVE_OUTPUT, False, type=bool))
+
+        self.verify_checkbox = QCheckBox("출력 파일 검증")
+        self.verify_checkbox.setToolTip(
+            "선택하면 변환된 파일을 다시 열어 변환된 이미지와 비교합니다.\n"
+            "원본 파일은 출력 파일이 검증을 통과한 뒤에만 덮어쓰거나 삭제합니다.")
+        self.verify_checkbox.setChecked(self.settings.value(
+            self.SETTINGS_VERIFY_OUTPUTS, False, type=bool))
+
+        self.background_checkbox = QCheckBox("백그라운드에서 실행")
+        self.background_checkbox.setToolTip(
+            "선택하면 새 작업을 낮은 CPU·디스크 우선순위로 변환하고, 컴퓨터가 바쁘거나 메모리가\n"
+            "부족한 동안에는 새 파일을 시작하지 않아 컴퓨터를 계속 사용할 수 있습니다.")
+        self.background_checkbox.setChecked(self.settings.value(
+            self.SETTINGS_RUN_IN_BACKGROUND, False, type=bool))
+
+        self.cores_spinbox = QSpinBox()
+        self.cores_spinbox.setRange(0, cpu_count())
+        self.cores_spinbox.setPrefix("최대 코어: ")
+        self.cores_spinbox.setSpecialValueText("모든 코어")
+        self.cores_spinbox.setToolTip(
+            "새 작업이 사용할 수 있는 최대 프로세서 코어 수입니다.")
+        self.cores_spinbox.setValue(min(self.settings.value(
+            self.SETTINGS_MAX_CORES, 0, type=int), cpu_count()))
+
+        self.write_limit_spinbox = QSpinBox()
+        self.write_limit_spinbox.setRange(0, 10000)
+        self.write_limit_spinbox.setPrefix("쓰기 제한: ")
+        self.write_limit_spinbox.setSuffix(" MB/s")
+        self.write_limit_spinbox.setSpecialValueText("쓰기 제한 없음")
+        self.write_limit_spinbox.setToolTip(
+            "새 작업이 초당 쓸 수 있는 최대 데이터 양입니다. 공유 디스크나 네트워크 드라이브를\n"
+            "다른 사람도 사용할 수 있도록 남겨 둘 때 설정하세요.")
+        self.write_limit_spinbox.setValue(self.settings.value(
+            self.SETTINGS_WRITE_LIMIT, 0, type=int))
+
+        self.stage_checkbox = QCheckBox("네트워크 출력을 로컬에 임시 저장")
+        self.stage_checkbox.setToolTip(
+            "선택하면 네트워크 공유 폴더로 가는 출력을 먼저 로컬 폴더에 쓰고, 네트워크로 작은\n"
+            "쓰기를 여러 번 하는 대신 묶음으로 옮깁니다.")
+        self.stage_checkbox.setChecked(self.settings.value(
+            self.SETTINGS_STAGE_OUTPUTS, True, type=bool))
+
+        self.profile_checkbox = QCheckBox("다음 작업 프로파일링")
+        self.profile_checkbox.setToolTip(
+            "선택하면 다음 작업에서 변환이 시간과 메모리를 어디에 쓰는지 작업 프로세스를 포함해\n"
+            "기록하여, 나중에 분석할 수 있도록 시간이 표시된 폴더에 저장합니다.")
+
+        self.renditions_label = QLabel("추가 크기:")
+        self.renditions_edit = QLineEdit()
+        self.renditions_edit.setPlaceholderText("예: jpeg:2048:85, jpeg:512:80")
+        self.renditions_edit.setToolTip(
+            "한 번의 디코딩으로 함께 저장할 추가 출력물입니다. 형식:최대 크기:품질로 입력하세요.\n"
+            "비워 두면 선택한 출력 형식의 원본 크기 파일만 저장합니다.")
+        self.renditions_edit.setText(self.settings.value(
+            self.SETTINGS_EXTRA_RENDITIONS, "", type=str))
+
+        self.color_dropdown = QComboBox()
+        self.color_dropdown.addItems(
+            ["색상 프로필 유지", "sRGB로 색상 변환", "사용자 지정 프로필로 변환..."])
+        self.color_dropdown.setToolTip(
+            "픽셀을 대상 색상 프로필로 변환하여 내장 프로필을 무시하는\n"
+            "뷰어(대부분의 웹 페이지)에서도 의도한 색상이 표시되도록 합니다.")
+        self.color_target = self.settings.value(self.SETTINGS_COLOR_TARGET, "", type=str)
+        if self.color_target == SRGB:
+            self.color_dropdown.setCurrentIndex(1)
+        elif self.color_target and os.path.isfile(self.color_target):
+            self.color_dropdown.setCurrentIndex(2)
+            self.color_dropdown.setItemText(
+                2, f"{os.path.basename(self.color_target)}(으)로 변환")
+        else:
+            self.color_target = ""
+        self.color_dropdown.activated.connect(self.select_color_target)
+
+        self.matte_color = QColor(self.settings.value(
+            self.SETTINGS_MATTE_COLOR, "#ffffff", type=str))
+        if not self.matte_color.isValid():
+            self.matte_color = QColor(255, 255, 255)
+        self.matte_button = QPushButton("JPEG 배경색")
+        self.matte_button.setToolTip(
+            "JPEG로 저장할 때 투명한 영역을 채울 배경색입니다.")
+        self.matte_button.clicked.connect(self.select_matte_color)
+        self._update_matte_button()
+
         self.clear_button = QPushButton("목록 지우기")
         self.clear_button.setToolTip("현재 파일 목록을 지웁니다.")
         self.clear_button.setStyleSheet(
@@ -174,7 +551,7 @@ class HEICConverterApp(QWidget):
         main_layout.addWidget(self.body_stack, 1)
 
         self.no_files_view = HoverLabel(
-            "HEIC/HEIF 파일이나 폴더를 여기로 드래그하세요.")
+            "HEIC/HEIF 파일, 폴더 또는 ZIP/TAR 압축 파일을 여기로 드래그하세요.")
         self.body_stack.addWidget(self.no_files_view)
 
         self.files_selected_view = QWidget()
@@ -183,11 +560,45 @@ class HEICConverterApp(QWidget):
 
         self.splitter = QSplitter(Qt.Orientation.Horizontal)
 
-        self.file_list_widget = FileListWidget()
-        self.file_list_widget.currentItemChanged.connect(self.update_preview)
-        self.file_list_widget.setSizePolicy(
+        self.file_list_panel = QWidget()
+        file_list_layout = QVBoxLayout(self.file_list_panel)
+        file_list_layout.setContentsMargins(0, 0, 0, 0)
+        filter_layout = QHBoxLayout()
+        self.filter_edit = QLineEdit()
+        self.filter_edit.setPlaceholderText("이름으로 필터")
+        self.filter_edit.setClearButtonEnabled(True)
+        self.filter_edit.textChanged.connect(self.apply_file_filter)
+        filter_layout.addWidget(self.filter_edit, 1)
+        self.sort_dropdown = QComboBox()
+        self.sort_dropdown.addItems(["이름", "크기", "촬영 일시", "해상도"])
+        self.sort_dropdown.setToolTip(
+            "목록의 정렬 기준입니다. 크기, 촬영 일시, 해상도는 백그라운드에서 파일 헤더를 읽어\n"
+            "가져오며, 아직 읽지 않은 파일은 맨 뒤에 표시됩니다.")
+        self.sort_dropdown.currentIndexChanged.connect(self.apply_file_filter)
+        filter_layout.addWidget(self.sort_dropdown)
+        self.descending_checkbox = QCheckBox("내림차순")
+        self.descending_checkbox.toggled.connect(self.apply_file_filter)
+        filter_layout.addWidget(self.descending_checkbox)
+        file_list_layout.addLayout(filter_layout)
+
+        self.file_list_view = FileListView()
+        self.file_list_view.setModel(self.file_model)
+        self.file_list_view.selectionModel().currentChanged.connect(self.current_file_changed)
+        self.file_list_view.setSizePolicy(
             QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
-        self.splitter.addWidget(self.file_list_widget)
+        file_list_layout.addWidget(self.file_list_view, 1)
+
+        file_status_layout = QHBoxLayout()
+        self.file_count_label = QLabel()
+        file_status_layout.addWidget(self.file_count_label, 1)
+        self.shown_only_checkbox = QCheckBox("표시된 파일만 변환")
+        self.shown_only_checkbox.setToolTip(
+            "필터가 설정된 상태에서 선택하면, 변환 시작 시 필터와 일치하는 파일만\n"
+            "변환합니다.")
+        self.shown_only_checkbox.setEnabled(False)
+        file_status_layout.addWidget(self.shown_only_checkbox)
+        file_list_layout.addLayout(file_status_layout)
+        self.splitter.addWidget(self.file_list_panel)
 
         self.preview_label = QLabel("이미지 미리보기")
         self.preview_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
@@ -204,6 +615,35 @@ class HEICConverterApp(QWidget):
         files_selected_layout.addWidget(self.splitter)
         self.body_stack.addWidget(self.files_selected_view)
 
+        # --- Job Queue ---
+        self.jobs_widget = QWidget()
+        jobs_layout = QHBoxLayout(self.jobs_widget)
+        jobs_layout.setContentsMargins(0, 0, 0, 0)
+        self.job_list_widget = QListWidget()
+        self.job_list_widget.setMaximumHeight(110)
+        self.job_list_widget.currentRowChanged.connect(self.update_job_buttons)
+        jobs_layout.addWidget(self.job_list_widget, 1)
+
+        job_buttons_layout = QGridLayout()
+        self.pause_job_button = QPushButton("일시 정지")
+        self.pause_job_button.clicked.connect(self.toggle_pause_job)
+        self.cancel_job_button = QPushButton("취소")
+        self.cancel_job_button.clicked.connect(self.cancel_job)
+        self.raise_job_button = QPushButton("우선순위 올리기")
+        self.raise_job_button.clicked.connect(lambda: self.change_job_priority(1))
+        self.lower_job_button = QPushButton("우선순위 내리기")
+        self.lower_job_button.clicked.connect(lambda: self.change_job_priority(-1))
+        self.clear_jobs_button = QPushButton("완료된 작업 지우기")
+        self.clear_jobs_button.clicked.connect(self.clear_finished_jobs)
+        job_buttons_layout.addWidget(self.pause_job_button, 0, 0)
+        job_buttons_layout.addWidget(self.cancel_job_button, 0, 1)
+        job_buttons_layout.addWidget(self.raise_job_button, 1, 0)
+        job_buttons_layout.addWidget(self.lower_job_button, 1, 1)
+        job_buttons_layout.addWidget(self.clear_jobs_button, 2, 0, 1, 2)
+        jobs_layout.addLayout(job_buttons_layout)
+        main_layout.addWidget(self.jobs_widget)
+        self.jobs_widget.setVisible(False)
+
         # --- Progress Bar and Label ---
         # Use a widget to better manage layout and visibility
         progress_layout_widget = QWidget()
@@ -253,11 +693,24 @@ class HEICConverterApp(QWidget):
             self.top_section_layout.addWidget(self.format_label, 0, 0)
             self.top_section_layout.addWidget(self.format_dropdown, 0, 1)
             self.top_section_layout.addWidget(self.replace_checkbox, 0, 2)
+            self.top_section_layout.addWidget(self.verify_checkbox, 0, 3)
             self.top_section_layout.setColumnStretch(
-                3, 1)  # Stretch after items in row 0
+                4, 1)  # Stretch after items in row 0
 
             self.top_section_layout.addWidget(self.metadata_checkbox, 1, 0)
             self.top_section_layout.addWidget(self.clear_button, 1, 1)
+            self.top_section_layout.addWidget(self.color_dropdown, 1, 2)
+            self.top_section_layout.addWidget(self.matte_button, 1, 3)
+
+            self.top_section_layout.addWidget(self.renditions_label, 2, 0)
+            self.top_section_layout.addWidget(self.renditions_edit, 2, 1, 1, 2)
+            self.top_section_layout.addWidget(self.animate_checkbox, 2, 3)
+            self.top_section_layout.addWidget(self.archive_checkbox, 3, 0, 1, 2)
+            self.top_section_layout.addWidget(self.profile_checkbox, 3, 2, 1, 2)
+            self.top_section_layout.addWidget(self.background_checkbox, 4, 0, 1, 2)
+            self.top_section_layout.addWidget(self.cores_spinbox, 4, 2)
+            self.top_section_layout.addWidget(self.write_limit_spinbox, 4, 3)
+            self.top_section_layout.addWidget(self.stage_checkbox, 5, 0, 1, 2)
         else:
             # Wide layout: 1 row
             self.top_section_layout.addWidget(self.format_label, 0, 0)
@@ -265,11 +718,55 @@ class HEICConverterApp(QWidget):
             self.top_section_layout.addWidget(self.replace_checkbox, 0, 2)
             self.top_section_layout.addWidget(self.metadata_checkbox, 0, 3)
             self.top_section_layout.addWidget(self.clear_button, 0, 4)
+            self.top_section_layout.addWidget(self.archive_checkbox, 0, 5)
+            self.top_section_layout.addWidget(self.verify_checkbox, 0, 6)
             self.top_section_layout.setColumnStretch(
-                5, 1)  # Stretch after last item
+                7, 1)  # Stretch after last item
+
+            self.top_section_layout.addWidget(self.renditions_label, 1, 0)
+            self.top_section_layout.addWidget(self.renditions_edit, 1, 1, 1, 2)
+            self.top_section_layout.addWidget(self.color_dropdown, 1, 3)
+            self.top_section_layout.addWidget(self.matte_button, 1, 4)
+            self.top_section_layout.addWidget(self.animate_checkbox, 1, 5)
+            self.top_section_layout.addWidget(self.profile_checkbox, 1, 6)
+
+            self.top_section_layout.addWidget(self.background_checkbox, 2, 0, 1, 2)
+            self.top_section_layout.addWidget(self.cores_spinbox, 2, 2)
+            self.top_section_layout.addWidget(self.write_limit_spinbox, 2, 3)
+            self.top_section_layout.addWidget(self.stage_checkbox, 2, 4, 1, 2)
 
         self.top_section_layout.activate()
 
+    def select_color_target(self, index):
+        if index == 0:
+            self.color_target = ""
+        elif index == 1:
+            self.color_target = SRGB
+        else:
+            profile_path, _ = QFileDialog.getOpenFileName(
+                self, "대상 색상 프로필 선택", "", "ICC 프로필 (*.icc *.icm)")
+            if not profile_path:
+                # Dialog cancelled: fall back to the previous choice
+                previous_index = 1 if self.color_target == SRGB else (
+                    2 if self.color_target else 0)
+                self.color_dropdown.setCurrentIndex(previous_index)
+                return
+            self.color_target = profile_path
+            self.color_dropdown.setItemText(
+                2, f"{os.path.basename(profile_path)}(으)로 변환")
+
+    def select_matte_color(self):
+        color = QColorDialog.getColor(
+            self.matte_color, self, "JPEG 배경색 선택")
+        if color.isValid():
+            self.matte_color = color
+            self._update_matte_button()
+
+    def _update_matte_button(self):
+        swatch = QPixmap(14, 14)
+        swatch.fill(self.matte_color)
+        self.matte_button.setIcon(QIcon(swatch))
+
     def _set_preview_placeholder(self):
         self.preview_label.setText("선택된 파일이 없거나 미리보기를 사용할 수 없습니다.")
         palette = self.preview_label.palette()
@@ -322,26 +819,37 @@ class HEICConverterApp(QWidget):
             if url.isLocalFile():
                 path = url.toLocalFile()
                 if os.path.isdir(path):
-                    for root, _, files in os.walk(path):
-                        for file in files:
-                            full_path = os.path.join(root, file)
-                            if file.lower().endswith(('.heic', '.heif')):
-                                if full_path not in current_file_paths_set:
-                                    self.file_paths.append(full_path)
-                                    current_file_paths_set.add(full_path)
-                                    new_heic_files_found = True
-                            else:
-                                # Ignore system files
-                                if file.startswith(".DS_Store") or file.startswith("Thumbs.db"):
-                                    continue
-                                unsupported_files_basenames.append(
-                                    os.path.basename(full_path))
+                    # Directories unchanged since an earlier drop come from the scan index
+                    for _, heic_paths, other_files in scan_index.walk(path, ('.heic', '.heif')):
+                        for full_path in heic_paths:
+                            if full_path not in current_file_paths_set:
+                                self.file_paths.append(full_path)
+                                current_file_paths_set.add(full_path)
+                                new_heic_files_found = True
+                        for file in other_files:
+                            # Ignore system files
+                            if file.startswith(".DS_Store") or file.startswith("Thumbs.db"):
+                                continue
+                            unsupported_files_basenames.append(file)
                 elif os.path.isfile(path):
                     if path.lower().endswith(('.heic', '.heif')):
                         if path not in current_file_paths_set:
                             self.file_paths.append(path)
                             current_file_paths_set.add(path)
                             new_heic_files_found = True
+                    elif is_archive(path):
+                        # Members are read from the archive when needed, never extracted
+                        try:
+                            members = archive_sources.list_members(path, ('.heic', '.heif'))
+                        except OSError:
+                            members = None
+                        if not members:
+                            unsupported_files_basenames.append(os.path.basename(path))
+                        for member in members or []:
+                            if member not in current_file_paths_set:
+                                self.file_paths.append(member)
+                                current_file_paths_set.add(member)
+                                new_heic_files_found = True
                     else:
                         # Ignore system files
                         file = os.path.basename(path)
@@ -371,30 +879,167 @@ class HEICConverterApp(QWidget):
                     self, "지원되지 않는 파일 무시됨", message)
 
         if self.file_paths:
-            self.update_file_list_widget()
+            self.update_file_list()
             self.body_stack.setCurrentWidget(self.files_selected_view)
             self.convert_button.setEnabled(True)
-            if self.file_list_widget.count() > 0 and not append:  # Select first item only on new drop, not append
-                self.file_list_widget.setCurrentRow(0)
+            if self.file_model.rowCount() > 0 and not append:  # Select first item only on new drop, not append
+                self.file_list_view.setCurrentIndex(self.file_model.index(0))
             self.update_preview_visibility()
         elif not new_heic_files_found and not unsupported_files_basenames:  # Dropped empty folder or nothing useful
             if self.body_stack.currentWidget() == self.files_selected_view:  # If it was showing files, but now empty
                 self.clear_file_list()  # Use clear to reset properly
         # If only unsupported files were dropped and list was already empty, msg shown above, state remains no_files_view
 
-    def update_file_list_widget(self):
-        self.file_list_widget.clear()
-        for i, path in enumerate(self.file_paths):
-            # item = QListWidgetItem(os.path.basename(path)) # PyQt6 style for creating item
-            # item.setData(Qt.ItemDataRole.UserRole, path)
-            # self.file_list_widget.addItem(item)
-            self.file_list_widget.addItem(os.path.basename(path))
-            self.file_list_widget.item(i).setData(
-                Qt.ItemDataRole.UserRole, path)
+    def restore_session(self):
+        # Only the session file is read; the listed files are not touched
+        # until they are previewed or converted. A drop while the codecs
+        # loaded wins over the last session.
+        self._session_restored = True
+        self.session_timer.start()
+        session = self.session_store.load()
+        if session is None or not session.paths or self.file_paths:
+            return
+        view = session.view
+        self.filter_edit.setText(view.get("filter", ""))
+        if view.get("sort") in SORT_KEYS:
+            self.sort_dropdown.setCurrentIndex(SORT_KEYS.index(view["sort"]))
+        self.descending_checkbox.setChecked(view.get("descending", False))
+        self.shown_only_checkbox.setChecked(view.get("shown_only", False))
+        self.file_index.restore(session.paths, session.infos)
+        self.file_model.statuses = session.statuses
+        self.file_paths = session.paths
+        self.current_preview_path = view.get("preview")
+        self.body_stack.setCurrentWidget(self.files_selected_view)
+        self.update_file_list()
+        self.convert_button.setEnabled(True)
+        # The scroll range is only known once the list has been laid out
+        QTimer.singleShot(0, lambda: self.file_list_view.verticalScrollBar().setValue(
+            view.get("scroll", 0)))
+        self.update_preview_visibility()
+        self.update_preview(self.file_list_view.currentIndex(), None)
+        self._saved_session = self.session_key()
+
+    def session_view(self):
+        return {
+            "filter": self.filter_edit.text(),
+            "sort": SORT_KEYS[self.sort_dropdown.currentIndex()],
+            "descending": self.descending_checkbox.isChecked(),
+            "shown_only": self.shown_only_checkbox.isChecked(),
+            "preview": self.current_preview_path,
+            "scroll": self.file_list_view.verticalScrollBar().value(),
+        }
+
+    def session_key(self):
+        return self._session_version, self.file_index.indexed, self.session_view()
+
+    def save_session(self, wait=False):
+        # Written on a background thread; with wait, before returning
+        self.save_settings()
+        key = self.session_key()
+        if not self._session_restored or key == self._saved_session:
+            return
+        self._saved_session = key
+        paths, infos = self.file_index.snapshot()
+        self.session_store.save(
+            Session(paths, infos, dict(self.file_model.statuses), key[2]), wait=wait)
+
+    def update_file_list(self):
+        self._session_version += 1
+        if self.file_paths:
+            self.wait_for_codecs()  # The index reads HEIF headers
+        self.file_index.set_paths(self.file_paths)
+        if self.file_index.complete:
+            self.index_timer.stop()
+        else:
+            self.index_timer.start()
+        icons = self.file_model.icons
+        if icons:
+            listed = set(self.file_paths)
+            for path in [path for path in icons if path not in listed]:
+                del icons[path]
+        self.apply_file_filter()
+        # Icons come only from already cached thumbnails, a few rows per event
+        # loop pass, so populating a long list never waits on the disk
+        self._pending_icon_paths = list(map(self.file_paths.__getitem__,
+                                            reversed(self.file_model.rows)))
+        if self._pending_icon_paths:
+            self.icon_timer.start()
+        else:
+            self.icon_timer.stop()
+
+    def load_pending_icons(self):
+        loaded = False
+        for _ in range(self.ICON_BATCH_SIZE):
+            if not self._pending_icon_paths:
+                self.icon_timer.stop()
+                break
+            path = self._pending_icon_paths.pop()
+            if path in self.file_model.icons:
+                continue
+            thumbnail = thumbnail_cache.load(path, THUMBNAIL_SIZES["normal"])
+            if thumbnail is not None:
+                self.file_model.icons[path] = QIcon(pil_to_pixmap(thumbnail))
+                loaded = True
+        if loaded:
+            self.file_model.icons_changed()
+
+    def apply_file_filter(self):
+        # Sorts and filters the list again, keeping the selected file selected
+        # without reloading its preview
+        query = self.filter_edit.text()
+        rows = self.file_index.rows(query, SORT_KEYS[self.sort_dropdown.currentIndex()],
+                                    self.descending_checkbox.isChecked())
+        current = self.current_preview_path
+        self._refiltering = True
+        try:
+            # The index's own copy of the list, which never changes in place
+            self.file_model.set_rows(self.file_index.paths, rows)
+            row = self.file_model.row_of(current) if current is not None else -1
+            if row >= 0:
+                self.file_list_view.setCurrentIndex(self.file_model.index(row))
+                self.file_list_view.scrollTo(self.file_model.index(row))
+        finally:
+            self._refiltering = False
+        if current is not None and row < 0:
+            self.update_preview(QModelIndex(), None)
+        self.shown_only_checkbox.setEnabled(bool(query.strip()))
+        self.update_file_count()
+
+    def update_file_count(self):
+        self._indexed_shown = self.file_index.indexed
+        text = f"{len(self.file_paths)}개 중 {len(self.file_model.rows)}개 파일"
+        if not self.file_index.complete:
+            text += f"  |  세부 정보 읽는 중 {self.file_index.indexed}/{len(self.file_paths)}"
+        self.file_count_label.setText(text)
+
+    def refresh_file_index(self):
+        # Re-sorts as headers are read, if the order depends on them. Only
+        # this timer sorts again; filtering keeps the order last sorted.
+        if self.file_index.indexed != self._indexed_shown:
+            self.file_index.resort()
+            if SORT_KEYS[self.sort_dropdown.currentIndex()] != SORT_KEYS[0]:
+                self.apply_file_filter()
+            else:
+                self.update_file_count()
+        if self.file_index.complete:
+            self.index_timer.stop()
+
+    def shown_file_paths(self):
+        return [self.file_paths[position] for position in self.file_model.rows]
+
+    def current_file_changed(self, current, previous):
+        if not self._refiltering:
+            self.update_preview(current, previous)
 
     def clear_file_list(self):
+        self.icon_timer.stop()
+        self.prefetcher.cancel()
+        if not self.scheduler.busy:  # Queued jobs may still read from open archives
+            archive_sources.close()
         self.file_paths = []
-        self.update_file_list_widget()  # Clears QListWidget items
+        decoded_images.clear()
+        self.file_model.icons.clear()
+        self.update_file_list()  # Clears the list view
         self.body_stack.setCurrentWidget(self.no_files_view)
         self.convert_button.setEnabled(False)
         self._set_preview_placeholder()
@@ -404,7 +1049,7 @@ class HEICConverterApp(QWidget):
         self.progress_label.setText("0/0")
 
     def update_preview(self, current_item, previous_item):
-        if not current_item:
+        if current_item is None or not current_item.isValid():
             self._set_preview_placeholder()
             self.current_preview_path = None
             return
@@ -412,23 +1057,22 @@ class HEICConverterApp(QWidget):
         self.current_preview_path = current_item.data(Qt.ItemDataRole.UserRole)
 
         if self.current_preview_path and self.preview_label.isVisible():
+            if not self.wait_for_codecs():
+                return
             try:
-                pil_image = Image.open(self.current_preview_path)
-                if pil_image.mode == "RGBA":
-                    data = pil_image.tobytes("raw", "RGBA")
-                    q_image = QImage(data, pil_image.width, pil_image.height,
-                                     pil_image.width * 4, QImage.Format.Format_RGBA8888)
-                elif pil_image.mode == "RGB":
-                    data = pil_image.tobytes("raw", "RGB")
-                    q_image = QImage(data, pil_image.width, pil_image.height,
-                                     pil_image.width * 3, QImage.Format.Format_RGB888)
-                else:
-                    pil_image = pil_image.convert("RGB")  # Default conversion
-                    data = pil_image.tobytes("raw", "RGB")
-                    q_image = QImage(data, pil_image.width, pil_image.height,
-                                     pil_image.width * 3, QImage.Format.Format_RGB888)
-
-                pixmap = QPixmap.fromImage(q_image)
+                preview_size = max(self.preview_label.width(), self.preview_label.height())
+                pil_image = self.prefetcher.get(self.current_preview_path, preview_size) or \
+                    thumbnail_cache.load(self.current_preview_path, preview_size)
+                if pil_image is None:
+                    decoded = decoded_images.get_or_decode(self.current_preview_path)
+                    pil_image = thumbnail_cache.store(
+                        self.current_preview_path, decoded, preview_size) or decoded
+                    icon = thumbnail_cache.store(
+                        self.current_preview_path, pil_image, THUMBNAIL_SIZES["normal"])
+                    if icon is not None:
+                        self.file_model.set_icon(self.current_preview_path, QIcon(pil_to_pixmap(icon)))
+
+                pixmap = pil_to_pixmap(pil_image)
                 self.preview_label.setAutoFillBackground(False)
                 scaled_pixmap = pixmap.scaled(
                     self.preview_label.size(),
@@ -436,6 +1080,8 @@ class HEICConverterApp(QWidget):
                     Qt.TransformationMode.SmoothTransformation
                 )
                 self.preview_label.setPixmap(scaled_pixmap)
+                self.prefetcher.navigate(
+                    self.file_model.shown_paths(), current_item.row(), preview_size)
             except Exception as e:
                 self._set_preview_placeholder()
                 self.preview_label.setText(
@@ -451,8 +1097,8 @@ class HEICConverterApp(QWidget):
         self.update_top_controls_layout()  # Update top controls based on new width
         self.update_preview_visibility()
         if self.current_preview_path and self.preview_label.isVisible():
-            current_list_item = self.file_list_widget.currentItem()
-            if current_list_item:
+            current_list_item = self.file_list_view.currentIndex()
+            if current_list_item.isValid():
                 self.update_preview(current_list_item, None)
 
     def update_preview_visibility(self):
@@ -461,9 +1107,9 @@ class HEICConverterApp(QWidget):
             if should_show != self.preview_label.isVisible():
                 self.preview_label.setVisible(should_show)
                 if should_show:
-                    if self.file_list_widget.currentItem():
+                    if self.file_list_view.currentIndex().isValid():
                         self.update_preview(
-                            self.file_list_widget.currentItem(), None)
+                            self.file_list_view.currentIndex(), None)
                 else:
                     self.preview_label.setPixmap(QPixmap())
                     self.preview_label.setText("미리보기 숨김.")
@@ -473,149 +1119,379 @@ class HEICConverterApp(QWidget):
             QMessageBox.information(
                 self, "알림", "변환할 파일이 없습니다.")
             return
+        if not self.wait_for_codecs():
+            return
 
         output_format_str = self.format_dropdown.currentText().lower()
         replace_original = self.replace_checkbox.isChecked()
+        archive_output = self.archive_checkbox.isChecked()
         maintain_metadata = self.metadata_checkbox.isChecked()
 
-        converted_count = 0
-        error_count = 0
-        output_folders = set()
-
-        total_files = len(self.file_paths)
-        self.progress_bar.setMaximum(total_files)
-        self.progress_bar.setValue(0)
-        self.progress_label.setText(f"0/{total_files}")
-        # Ensure the initial 0/n state is rendered before heavy work starts
-        QApplication.processEvents()
-        self.progress_bar_widget.setVisible(True)
-
-        self.convert_button.setEnabled(False)
-        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
-
-        for i, file_path in enumerate(self.file_paths):
-            base_name = os.path.basename(file_path)
-            dir_name = os.path.dirname(file_path)
-            file_root, _ = os.path.splitext(base_name)
-            output_path = ""
+        try:
+            renditions = [Rendition(output_format_str)] + \
+                parse_renditions(self.renditions_edit.text())
+            check_renditions(renditions)
+        except ValueError as e:
+            QMessageBox.warning(self, "잘못된 추가 크기", str(e))
+            return
+        options = ConversionOptions(
+            renditions=tuple(renditions),
+            replace_original=replace_original,
+            maintain_metadata=maintain_metadata,
+            color_target=self.color_target or None,
+            matte_color=self.matte_color.getRgb()[:3],
+            animate_sequences=self.animate_checkbox.isChecked(),
+            verify_outputs=self.verify_checkbox.isChecked())
+        limits = replace(
+            BACKGROUND if self.background_checkbox.isChecked() else ResourceLimits(),
+            max_cores=self.cores_spinbox.value(),
+            write_limit=self.write_limit_spinbox.value() * 2**20)
+
+        file_paths = self.file_paths
+        if self.shown_only_checkbox.isEnabled() and self.shown_only_checkbox.isChecked():
+            file_paths = self.shown_file_paths()
+            if not file_paths:
+                QMessageBox.information(
+                    self, "알림", "필터와 일치하는 파일이 없습니다.")
+                return
 
-            if replace_original:
-                output_path = os.path.join(
-                    dir_name, f"{file_root}.{output_format_str}")
-            else:
+        files = []
+        folder_errors = {}
+        output_folders = set()
+        # Each folder is checked (or created) once; on a network share every
+        # check is a round trip
+        failed_folders = {}
+        for file_path in file_paths:
+            output_dir = output_directory(file_path, replace_original, archive_output)
+
+            if is_member_path(output_dir):
+                output_folders.add(split_member_path(output_dir)[0])
+            elif not replace_original or is_member_path(file_path):
                 # 사용자가 원하면 이 폴더명도 바꿀 수 있습니다.
-                converted_files_dir = os.path.join(dir_name, "Converted Files")
-                if not os.path.exists(converted_files_dir):
+                converted_files_dir = output_dir
+                if converted_files_dir not in output_folders and \
+                        converted_files_dir not in failed_folders and \
+                        not os.path.exists(converted_files_dir):
                     try:
                         os.makedirs(converted_files_dir)
                     except OSError as e:
                         QMessageBox.critical(
                             self, "폴더 생성 오류", f"'{converted_files_dir}' 폴더 생성 중 오류 발생: {e}")
-                        error_count += 1
-                        self.progress_bar.setValue(i + 1)
-                        self.progress_label.setText(f"{i + 1}/{total_files}")
-                        QApplication.processEvents()
-                        continue
-                output_path = os.path.join(
-                    converted_files_dir, f"{file_root}.{output_format_str}")
+                        failed_folders[converted_files_dir] = f"{type(e).__name__}: {e}"
+                if converted_files_dir in failed_folders:
+                    folder_errors[len(files)] = failed_folders[converted_files_dir]
+                    files.append((file_path, output_dir))
+                    continue
                 output_folders.add(converted_files_dir)
-
+            files.append((file_path, output_dir))
+
+        # The best mix of worker processes and decode threads is remembered per
+        # workload profile; a job with a new profile calibrates itself
+        profile = workload_profile(
+            [file_path for index, (file_path, _) in enumerate(files) if index not in folder_errors],
+            options)
+        job = self.job_queue.add(
+            f"{len(files)}개 파일 → {output_format_str.upper()}", files, options,
+            profile=profile.key, output_folders=output_folders, limits=limits,
+            staging=NETWORK if self.stage_checkbox.isChecked() else NEVER)
+        job.results.update(folder_errors)
+        self.progress_trackers[job.id] = ProgressTracker(len(files), len(folder_errors))
+        if self.profile_checkbox.isChecked() and self.profile_session is None:
             try:
-                pil_image = Image.open(file_path)
-
-                save_options = {}
-                if maintain_metadata:
-                    exif_data = pil_image.info.get('exif')
-                    icc_profile = pil_image.info.get('icc_profile')
-                    if exif_data:
-                        save_options['exif'] = exif_data
-                    if icc_profile:
-                        save_options['icc_profile'] = icc_profile
-
-                # Format-specific handling
-                if output_format_str == "jpeg":
-                    if pil_image.mode in ('RGBA', 'P', 'LA'):
-                        # Create a new image with a white background if image has alpha
-                        if pil_image.mode == 'RGBA' or (pil_image.mode == 'P' and 'transparency' in pil_image.info):
-                            alpha = pil_image.split(
-                            )[-1] if pil_image.mode == 'RGBA' or pil_image.mode == 'LA' else pil_image.convert("RGBA").split()[-1]
-                            background = Image.new(
-                                'RGB', pil_image.size, (255, 255, 255))
-                            background.paste(pil_image, mask=alpha)
-                            pil_image = background
-                        else:  # For LA or P without explicit alpha, just convert
-                            pil_image = pil_image.convert('RGB')
-                    elif pil_image.mode != 'RGB':
-                        pil_image = pil_image.convert('RGB')
-                    save_options['quality'] = 95
-                elif output_format_str == "webp":
-                    save_options['quality'] = 90  # Good default for lossy WebP
-                    # Preserve alpha for WebP if present, otherwise convert to RGB
-                    if pil_image.mode not in ('RGB', 'RGBA'):
-                        if 'A' in pil_image.mode or 'transparency' in pil_image.info:  # L"A", P with transparency
-                            pil_image = pil_image.convert('RGBA')
-                        else:
-                            pil_image = pil_image.convert('RGB')
-                elif output_format_str == "png":
-                    # PNG supports transparency by default. If metadata includes icc_profile, it will be used.
-                    # No specific quality option for PNG like JPEG/WebP in basic save.
-                    # Forcing RGBA if image has alpha but is in P mode might be good for PNG.
-                    if pil_image.mode == 'P' and 'transparency' in pil_image.info:
-                        pil_image = pil_image.convert('RGBA')
-
-                pil_image.save(
-                    output_path, output_format_str.upper(), **save_options)
-
-                if replace_original and output_path.lower() != file_path.lower():
-                    try:
-                        os.remove(file_path)
-                    except OSError as e:
-                        print(
-                            f"경고: 원본 파일 {file_path}을(를) 삭제할 수 없습니다: {e}")
-                converted_count += 1
-
-            except Exception as e:
-                error_count += 1
-                QMessageBox.critical(
-                    self, "변환 오류", f"'{base_name}' 변환 중 오류 발생: {type(e).__name__}: {e}")
-
-            # Update text first so label and bar advance together
-            self.progress_label.setText(f"{i + 1}/{total_files}")
-            self.progress_bar.setValue(i + 1)
-            # Force a repaint so the user sees each step immediately
-            QApplication.processEvents()
+                self.profile_session = ProfileSession(
+                    os.path.join(os.path.dirname(default_jobs_path()), "profiles")).start()
+                self.profiled_job_id = job.id
+            except OSError as e:
+                QMessageBox.warning(self, "프로파일링 오류", f"프로파일링을 시작할 수 없습니다: {e}")
+            self.profile_checkbox.setChecked(False)
+
+        self.update_job_list()
+        self.update_progress()
+        self.job_timer.start()
+        self.progress_timer.start()
+
+    def remembered_concurrency(self, profile_key):
+        return Concurrency.from_setting(
+            self.settings.value(f"{self.SETTINGS_CONCURRENCY}/{profile_key}", "", type=str))
+
+    def store_concurrency(self, profile_key, concurrency, trials):
+        self.settings.setValue(
+            f"{self.SETTINGS_CONCURRENCY}/{profile_key}", concurrency.to_setting())
+        self.calibrations[profile_key] = (concurrency, trials)
 
-        QApplication.restoreOverrideCursor()
-        self.convert_button.setEnabled(True)  # Re-enable after loop
+    def poll_jobs(self):
+        # Message boxes opened below run a nested event loop, in which this
+        # timer keeps firing
+        if self._polling_jobs:
+            return
+        self._polling_jobs = True
+        try:
+            events = self.scheduler.poll()
+            for event in events:
+                self._jobs_changed = True
+                if event.index is None:
+                    self.finish_job(event.job)
+                else:
+                    self.handle_job_result(event.job, event.index, event.result)
+            if not self.scheduler.busy:
+                self.job_timer.stop()
+                self.progress_timer.stop()
+                self.refresh_progress()
+        finally:
+            self._polling_jobs = False
+
+    def handle_job_result(self, job, index, result):
+        file_path, _ = job.files[index]
+        base_name = os.path.basename(file_path)
+        tracker = self.progress_trackers.get(job.id)
+        if tracker is None:
+            tracker = self.progress_trackers[job.id] = ProgressTracker(
+                len(job.files), len(job.results) - 1)
+        self._session_version += 1
+        self.file_model.statuses[file_path] = FAILED if isinstance(result, Exception) else CONVERTED
+        if isinstance(result, VerificationError):
+            tracker.advance(failed=1)
+            QMessageBox.critical(
+                self, "검증 오류",
+                f"'{base_name}'의 출력 파일이 검증을 통과하지 못해 원본 파일을 유지했습니다: {result}")
+            return
+        if isinstance(result, Exception):
+            tracker.advance(failed=1)
+            QMessageBox.critical(
+                self, "변환 오류", f"'{base_name}' 변환 중 오류 발생: {type(result).__name__}: {result}")
+            return
+        output_paths = result
+        tracker.advance(nbytes=file_bytes(file_path))  # Before the original may be removed
+        if job.options.replace_original and not is_member_path(file_path) and all(
+                path.lower() != file_path.lower() for path in output_paths):
+            decoded_images.discard(file_path)
+            try:
+                os.remove(file_path)
+            except OSError as e:
+                print(
+                    f"경고: 원본 파일 {file_path}을(를) 삭제할 수 없습니다: {e}")
+
+    def finish_job(self, job):
+        self.show_job_progress(job)  # Final counts, not the last periodic update
+        self.progress_trackers.pop(job.id, None)
+        total_files = len(job.files)
+        converted_count = job.converted
+        error_count = job.errors
+        try:
+            archive_outputs.close(job.output_folders)
+        except OSError as e:
+            error_count += 1
+            QMessageBox.critical(self, "압축 파일 오류", f"ZIP 출력 파일을 완료하는 중 오류 발생: {e}")
 
         summary_message = f"변환 작업이 완료되었습니다.\n총 처리 파일 수: {total_files}\n성공: {converted_count}\n실패: {error_count}\n"
-        if not replace_original and output_folders:
+        if job.state == CANCELLED:
+            summary_message += f"취소됨: {len(job.remaining)}개 파일은 변환되지 않았습니다.\n"
+        if job.output_folders:
             summary_message += "\n변환된 파일은 다음 폴더에 저장되었습니다:\n" + "\n".join(  # 사용자가 원하면 이 폴더명도 바꿀 수 있습니다.
-                sorted(list(output_folders)))
-
-        QMessageBox.information(self, "변환 완료", summary_message)
-
-        if replace_original and converted_count > 0:
-            self.clear_file_list()
+                sorted(list(job.output_folders)))
+        transfer = self.scheduler.transfer_stats(job)
+        if transfer.files:
+            summary_message += (
+                f"\n\n로컬 임시 폴더에서 파일 {transfer.files}개({transfer.bytes / 2**20:.1f} MB)를 "
+                f"{transfer.bytes_per_second / 2**20:.1f} MB/s로 옮겼습니다.")
+        cache = decoded_images.stats()
+        if cache.hits:
+            summary_message += (
+                f"\n\n이미지 {cache.hits + cache.misses}개 중 {cache.hits}개는 다시 디코딩하지 않고 "
+                f"디코딩된 이미지 캐시에서 재사용했습니다.")
+        calibration = self.calibrations.pop(job.profile, None)
+        if calibration is not None:
+            concurrency, trials = calibration
+            summary_message += "\n\n측정한 변환 속도:\n" + "\n".join(
+                f"  {describe_concurrency(trial.concurrency)}: {trial.throughput:.1f} MP/s"
+                for trial in trials)
+            summary_message += ("\n이런 파일은 이제 "
+                                f"{describe_concurrency(concurrency)}(으)로 변환합니다.")
+        if job.id == self.profiled_job_id:
+            summary_message += f"\n\n프로파일 저장 위치:\n{self.stop_profile()}"
+
+        if job.state == CANCELLED:
+            QMessageBox.information(self, "변환 취소됨", summary_message)
         else:
-            if error_count > 0:
-                self.progress_bar_widget.setVisible(True)
+            QMessageBox.information(self, "변환 완료", summary_message)
+
+        if job.options.replace_original and converted_count > 0:
+            # Originals that were replaced leave the list
+            self.file_paths = [path for path in self.file_paths
+                               if is_member_path(path) or os.path.exists(path)]
+            if not self.file_paths:
+                self.clear_file_list()
             else:
-                self.progress_bar_widget.setVisible(False)
+                self.update_file_list()
+        elif not self.scheduler.busy:
+            self.progress_bar_widget.setVisible(error_count > 0)
+
+    def stop_profile(self):
+        # Returns the folder the profile was written to
+        session, self.profile_session = self.profile_session, None
+        self.profiled_job_id = None
+        try:
+            session.stop()
+        except OSError as e:
+            print(f"경고: 프로파일을 {session.directory}에 저장할 수 없습니다: {e}")
+        return session.directory
+
+    def refresh_progress(self):
+        if self._jobs_changed:
+            self._jobs_changed = False
+            self.update_job_list()
+        self.update_progress()
+
+    def update_progress(self):
+        # Shows the job whose files are being converted now
+        runnable = self.job_queue.runnable()
+        if runnable:
+            self.show_job_progress(runnable[0])
+
+    def show_job_progress(self, job):
+        total_files = len(job.files)
+        self.progress_bar.setMaximum(total_files)
+        self.progress_bar.setValue(len(job.results))
+        tracker = self.progress_trackers.get(job.id)
+        if tracker is None:
+            text = f"{len(job.results)}/{total_files}"
+        else:
+            snapshot = tracker.snapshot()
+            eta = snapshot.eta
+            text = (f"{len(job.results)}/{total_files}  |  {snapshot.files_per_second:.1f}개/초  |  "
+                    f"{snapshot.bytes_per_second / 2**20:.1f} MB/s  |  "
+                    f"경과 {format_duration(snapshot.elapsed)}  |  "
+                    f"남은 시간 {format_duration(eta) if eta is not None else '--:--'}")
+        if self.scheduler.backing_off:
+            # New files wait until the system has room again
+            text += f"  |  대기 중: {describe_pressure(self.scheduler.backing_off)}"
+        self.progress_label.setText(text)
+        self.progress_bar_widget.setVisible(True)
 
-    def closeEvent(self, event):
+    def _job_text(self, job):
+        text = f"{job.name} - {self.JOB_STATE_LABELS[job.state]} - {len(job.results)}/{len(job.files)}"
+        if job.errors:
+            text += f", {job.errors}개 실패"
+        if job.priority:
+            text += f" (우선순위 {job.priority:+d})"
+        return text
+
+    def update_job_list(self):
+        jobs = self.job_queue.jobs
+        ids = [self.job_list_widget.item(row).data(Qt.ItemDataRole.UserRole)
+               for row in range(self.job_list_widget.count())]
+        if ids != [job.id for job in jobs]:
+            selected = self.selected_job()
+            self.job_list_widget.clear()
+            for job in jobs:
+                item = QListWidgetItem()
+                item.setData(Qt.ItemDataRole.UserRole, job.id)
+                self.job_list_widget.addItem(item)
+                if job is selected:
+                    self.job_list_widget.setCurrentItem(item)
+        for row, job in enumerate(jobs):
+            self.job_list_widget.item(row).setText(self._job_text(job))
+        self.jobs_widget.setVisible(bool(jobs))
+        self.convert_button.setText("대기열에 추가" if self.scheduler.busy else "변환 시작")
+        self.update_job_buttons()
+
+    def selected_job(self):
+        item = self.job_list_widget.currentItem()
+        return self.job_queue.get(item.data(Qt.ItemDataRole.UserRole)) if item else None
+
+    def update_job_buttons(self):
+        job = self.selected_job()
+        active = job is not None and not job.finished
+        self.pause_job_button.setText("재개" if active and job.state == PAUSED else "일시 정지")
+        for button in (self.pause_job_button, self.cancel_job_button,
+                       self.raise_job_button, self.lower_job_button):
+            button.setEnabled(active)
+        self.clear_jobs_button.setEnabled(any(job.finished for job in self.job_queue.jobs))
+
+    def toggle_pause_job(self):
+        job = self.selected_job()
+        if job is None:
+            return
+        if job.state == PAUSED:
+            if not self.wait_for_codecs():
+                return
+            self.scheduler.resume(job)
+            # Speed and ETA start over for the resumed run
+            self.progress_trackers[job.id] = ProgressTracker(len(job.files), len(job.results))
+            self.job_timer.start()
+            self.progress_timer.start()
+        else:
+            self.scheduler.pause(job)
+        self.update_job_list()
+        self.update_progress()
+
+    def cancel_job(self):
+        job = self.selected_job()
+        if job is not None:
+            self.scheduler.cancel(job)
+            self.job_timer.start()  # Reports the job once its running files finish
+            self.progress_timer.start()
+            self.update_job_list()
+
+    def change_job_priority(self, change):
+        job = self.selected_job()
+        if job is not None:
+            self.scheduler.set_priority(job, job.priority + change)
+            self.update_job_list()
+            self.update_progress()
+
+    def clear_finished_jobs(self):
+        self.job_queue.remove_finished()
+        self.update_job_list()
+
+    def save_settings(self):
         self.settings.setValue(
             self.SETTINGS_REPLACE_ORIGINAL, self.replace_checkbox.isChecked())
         self.settings.setValue(
             self.SETTINGS_MAINTAIN_METADATA, self.metadata_checkbox.isChecked())
+        self.settings.setValue(
+            self.SETTINGS_EXTRA_RENDITIONS, self.renditions_edit.text())
+        self.settings.setValue(self.SETTINGS_COLOR_TARGET, self.color_target)
+        self.settings.setValue(self.SETTINGS_MATTE_COLOR, self.matte_color.name())
+        self.settings.setValue(
+            self.SETTINGS_ANIMATE_SEQUENCES, self.animate_checkbox.isChecked())
+        self.settings.setValue(
+            self.SETTINGS_ARCHIVE_OUTPUT, self.archive_checkbox.isChecked())
+        self.settings.setValue(
+            self.SETTINGS_VERIFY_OUTPUTS, self.verify_checkbox.isChecked())
+        self.settings.setValue(
+            self.SETTINGS_RUN_IN_BACKGROUND, self.background_checkbox.isChecked())
+        self.settings.setValue(self.SETTINGS_MAX_CORES, self.cores_spinbox.value())
+        self.settings.setValue(self.SETTINGS_WRITE_LIMIT, self.write_limit_spinbox.value())
+        self.settings.setValue(self.SETTINGS_STAGE_OUTPUTS, self.stage_checkbox.isChecked())
+
+    def closeEvent(self, event):
+        self.session_timer.stop()
+        self.save_session(wait=True)
+        self.session_store.close()
+        self.prefetcher.shutdown()
+        self.index_timer.stop()
+        self.file_index.shutdown()
+        self.job_timer.stop()
+        self.progress_timer.stop()
+        self.scheduler.shutdown()  # Unfinished jobs resume from the queue file
+        if self.profile_session is not None:
+            self.stop_profile()
+        try:
+            archive_outputs.close()
+        except OSError as e:
+            print(f"경고: ZIP 출력 파일을 완료할 수 없습니다: {e}")
         super().closeEvent(event)
 
 
 def main():
+    multiprocessing.freeze_support()  # Conversion workers in PyInstaller builds
     app = QApplication(sys.argv)
+    startup_timer.mark("qapplication")
     app.setStyle("Fusion")
-    converter_app = HEICConverterApp()
+    converter_app = HEICConverterApp(report_target(sys.argv))
     converter_app.show()
+    startup_timer.mark("window")
     sys.exit(app.exec())
 
 
@@ -0,0 +1,69 @@
+"""Time sorting and filtering a long file list through the file index.
+
+Usage: python benchmarks/file_filter.py [--files 200000] [--runs 5]
+
+Builds a FileIndex over --files made-up paths with made-up header details,
+so nothing is read from disk, and times building each sort order and then
+typing a filter one keystroke at a time, as the filter box does. The first
+keystroke of a query scans every name; each further keystroke only scans
+the previous matches. Every keystroke should stay well under 50 ms.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from heif2png import fileindex  # noqa: E402
+from heif2png.fileindex import SORT_KEYS, FileIndex, FileInfo  # noqa: E402
+
+QUERIES = ("img_1", "20", "heic")
+
+
+def made_up_info(path):
+    number = int(os.path.basename(path)[4:10])
+    rng = random.Random(number)
+    return FileInfo(rng.randrange(1 << 20, 1 << 24),
+                    f"2024:{rng.randrange(1, 13):02d}:{rng.randrange(1, 29):02d} 12:00:00",
+                    rng.choice((4032, 3024, 1920)), rng.choice((3024, 4032, 1080)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=200000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    fileindex.read_info = made_up_info
+    paths = [f"/photos/{number // 500:04d}/IMG_{number:06d}.HEIC" for number in range(args.files)]
+    random.Random(0).shuffle(paths)
+    index = FileIndex()
+    index.set_paths(paths)
+    while not index.complete:
+        time.sleep(0.05)
+    print(f"{args.files} files")
+
+    for key in SORT_KEYS:
+        start = time.perf_counter()
+        index.order(key)
+        print(f"  sort by {key:<13} {(time.perf_counter() - start) * 1000:8.1f} ms")
+    for query in QUERIES:
+        times = [[] for _ in query]
+        for _ in range(args.runs):
+            index.rows("")
+            for length in range(1, len(query) + 1):
+                start = time.perf_counter()
+                index.rows(query[:length])
+                times[length - 1].append(time.perf_counter() - start)
+        slowest = max(statistics.median(values) for values in times)
+        print(f"  typing {query!r:<8} first keystroke {statistics.median(times[0]) * 1000:6.1f} ms  "
+              f"slowest {slowest * 1000:6.1f} ms  "
+              f"({len(index.rows(query))} matches)")
+    index.shutdown()
+
+
+if __name__ == "__main__":
+    main()
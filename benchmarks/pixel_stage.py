@@ -0,0 +1,96 @@
+"""Compare heif2png.pixels.prepare_pixels with the per-format code it replaced.
+
+Usage: python benchmarks/pixel_stage.py [--size 4000x3000] [--repeat 5]
+
+For each source mode and output format this reports the time per megapixel
+and the number of Pillow image allocations (Image.core.get_stats()
+"new_count") per call, for the original start_conversion code and for the
+single pixel-transform stage.
+"""
+import argparse
+import os
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image  # noqa: E402
+
+from heif2png.pixels import prepare_pixels  # noqa: E402
+
+
+def legacy_prepare(pil_image, output_format_str):
+    # The format-specific handling start_conversion used before the pixel stage
+    if output_format_str == "jpeg":
+        if pil_image.mode in ('RGBA', 'P', 'LA'):
+            if pil_image.mode == 'RGBA' or (pil_image.mode == 'P' and 'transparency' in pil_image.info):
+                alpha = pil_image.split(
+                )[-1] if pil_image.mode == 'RGBA' or pil_image.mode == 'LA' else pil_image.convert("RGBA").split()[-1]
+                background = Image.new(
+                    'RGB', pil_image.size, (255, 255, 255))
+                background.paste(pil_image, mask=alpha)
+                pil_image = background
+            else:
+                pil_image = pil_image.convert('RGB')
+        elif pil_image.mode != 'RGB':
+            pil_image = pil_image.convert('RGB')
+    elif output_format_str == "webp":
+        if pil_image.mode not in ('RGB', 'RGBA'):
+            if 'A' in pil_image.mode or 'transparency' in pil_image.info:
+                pil_image = pil_image.convert('RGBA')
+            else:
+                pil_image = pil_image.convert('RGB')
+    elif output_format_str == "png":
+        if pil_image.mode == 'P' and 'transparency' in pil_image.info:
+            pil_image = pil_image.convert('RGBA')
+    return pil_image
+
+
+def sources(size):
+    gradient = Image.linear_gradient("L").resize(size)
+    rgba = Image.merge("RGBA", [
+        gradient, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT),
+        gradient.transpose(Image.Transpose.FLIP_TOP_BOTTOM), gradient.rotate(180)])
+    palette = rgba.convert("RGB").quantize(256)
+    palette.info["transparency"] = bytes(range(256))
+    return {
+        "RGB": rgba.convert("RGB"),
+        "RGBA": rgba,
+        "LA": rgba.convert("LA"),
+        "P+tRNS": palette,
+    }
+
+
+def measure(function, image, output_format, repeat):
+    Image.core.reset_stats()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function(image, output_format)
+    elapsed = time.perf_counter() - start
+    allocations = Image.core.get_stats()["new_count"] / repeat
+    megapixels = image.width * image.height / 1e6
+    return elapsed / repeat / megapixels * 1000, allocations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", default="4000x3000")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    size = tuple(int(value) for value in args.size.lower().split("x"))
+    # Pillow warns about byte-string tRNS on every palette conversion
+    warnings.simplefilter("ignore", UserWarning)
+
+    print(f"{'source':<8} {'format':<6} {'legacy ms/MP':>13} {'allocs':>7}"
+          f" {'stage ms/MP':>12} {'allocs':>7}")
+    for name, image in sources(size).items():
+        for output_format in ("jpeg", "webp", "png"):
+            legacy_time, legacy_allocs = measure(legacy_prepare, image, output_format, args.repeat)
+            stage_time, stage_allocs = measure(prepare_pixels, image, output_format, args.repeat)
+            print(f"{name:<8} {output_format:<6} {legacy_time:13.2f} {legacy_allocs:7.1f}"
+                  f" {stage_time:12.2f} {stage_allocs:7.1f}")
+
+
+if __name__ == "__main__":
+    main()
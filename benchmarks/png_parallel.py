@@ -0,0 +1,88 @@
+"""Compare heif2png's parallel PNG writer with Pillow's encoder.
+
+Usage: python benchmarks/png_parallel.py IMAGE [IMAGE ...] [--threads 1 4 8] [--chunk-size 1048576]
+
+For every image and configuration this checks that the output decodes to
+exactly the source pixels and that the zlib stream (including the combined
+Adler-32) is valid, then prints encode time and file size next to Pillow's.
+"""
+import argparse
+import io
+import os
+import struct
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pillow_heif import register_heif_opener  # noqa: E402
+from PIL import Image  # noqa: E402
+
+from heif2png.png import DEFAULT_CHUNK_SIZE, png_mode, save_png_parallel  # noqa: E402
+
+
+def idat_stream(data: bytes) -> bytes:
+    offset = 8
+    stream = bytearray()
+    while offset < len(data):
+        length, tag = struct.unpack(">I4s", data[offset:offset + 8])
+        if tag == b"IDAT":
+            stream += data[offset + 8:offset + 8 + length]
+        offset += length + 12
+    return bytes(stream)
+
+
+def encode_pillow(image):
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def encode_parallel(image, threads, chunk_size):
+    buffer = io.BytesIO()
+    save_png_parallel(image, buffer, threads=threads, chunk_size=chunk_size)
+    return buffer.getvalue()
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, os.cpu_count() or 1])
+    parser.add_argument("--chunk-size", type=int, nargs="+", default=[DEFAULT_CHUNK_SIZE])
+    args = parser.parse_args()
+
+    register_heif_opener()
+    failures = 0
+    for path in args.images:
+        image = Image.open(path)
+        image = image.convert(png_mode(image.mode))
+        megapixels = image.width * image.height / 1e6
+        print(f"{os.path.basename(path)}: {image.width}x{image.height} {image.mode} ({megapixels:.1f} MP)")
+
+        reference, seconds = timed(encode_pillow, image)
+        print(f"  {'Pillow':<24} {seconds:7.2f} s  {len(reference):>12,} bytes")
+
+        for threads in args.threads:
+            for chunk_size in args.chunk_size:
+                data, seconds = timed(encode_parallel, image, threads, chunk_size)
+                zlib.decompress(idat_stream(data))  # Raises on a bad stream or checksum
+                decoded = Image.open(io.BytesIO(data))
+                identical = decoded.mode == image.mode and decoded.tobytes() == image.tobytes()
+                failures += not identical
+                ratio = len(data) / len(reference)
+                label = f"parallel t={threads} c={chunk_size // 1024}K"
+                print(f"  {label:<24} {seconds:7.2f} s  {len(data):>12,} bytes"
+                      f"  ({ratio:.3f}x Pillow)  {'identical' if identical else 'PIXEL MISMATCH'}")
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Time saving and loading a large file list session.
+
+Usage: python benchmarks/session_restore.py [--files 200000] [--runs 5]
+
+Builds a Session of --files made-up paths with made-up header details and
+statuses, so nothing is read from disk, and times writing it to an SQLite
+session file in a temporary directory and loading it again, as the app does
+on close and on start. Loading only reads the session file and should stay
+well under a second.
+Empty, one-file and small sessions are round-tripped first as a check.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from heif2png.fileindex import FileInfo  # noqa: E402
+from heif2png.session import CONVERTED, FAILED, Session, SessionStore  # noqa: E402
+
+
+def made_up_session(files):
+    rng = random.Random(files)
+    paths = [f"/photos/{number // 500:04d}/IMG_{number:06d}.HEIC" for number in range(files)]
+    infos = [None if rng.random() < 0.1 else
+             FileInfo(rng.randrange(1 << 20, 1 << 24),
+                      f"2024:{rng.randrange(1, 13):02d}:{rng.randrange(1, 29):02d} 12:00:00",
+                      rng.choice((4032, 3024)), rng.choice((3024, 4032)))
+             for _ in paths]
+    statuses = {path: rng.choice((CONVERTED, FAILED)) for path in rng.sample(paths, files // 10)}
+    return Session(paths, infos, statuses, {"filter": "", "preview": paths[files // 2]})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=200000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    session = made_up_session(args.files)
+    with tempfile.TemporaryDirectory() as directory:
+        store = SessionStore(os.path.join(directory, "session.sqlite3"))
+        # Round trips of the edge cases first: no file, and one file without
+        # details or with details but no capture date
+        for small in (Session(), Session(["/x/a.heic"], [None], {}, {}),
+                      Session(["/x/a.heic"], [FileInfo(1)], {"/x/a.heic": FAILED}, {}),
+                      made_up_session(3)):
+            store.save(small, wait=True)
+            assert store.load() == small, small
+        saves, loads = [], []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            store.save(session, wait=True)
+            saves.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            loaded = store.load()
+            loads.append(time.perf_counter() - start)
+            assert loaded == session
+        size = os.path.getsize(store.path)
+        store.close()
+    print(f"{args.files} files, session file {size / 2**20:.1f} MB")
+    print(f"  save  {statistics.median(saves) * 1000:8.1f} ms (median of {args.runs})")
+    print(f"  load  {statistics.median(loads) * 1000:8.1f} ms (median of {args.runs})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Measure how long the app takes to show its window.
+
+Usage: python benchmarks/startup_time.py [--runs 5] [--app app.py] [--offscreen]
+
+Starts the app --runs times with --startup-report=FILE and stops it once the
+report is written, which happens when the codecs have loaded after the first
+paint. For each milestone (import, qapplication, window, first paint, codecs)
+this prints the median and the best time since the app's first import, and
+"interpreter" for the time from spawning the process to that first import.
+Run it on each release, frozen or from source, to track time-to-first-window.
+--offscreen renders without a display (Qt's offscreen platform).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TIMEOUT = 60.0  # Seconds to wait for one report
+
+
+def run_once(command, report_path, env) -> dict:
+    spawned = time.time()
+    process = subprocess.Popen(command + [f"--startup-report={report_path}"], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while not os.path.exists(report_path) or not os.path.getsize(report_path):
+            if process.poll() is not None:
+                raise RuntimeError(f"{command} exited with {process.returncode} before reporting")
+            if time.time() - spawned > TIMEOUT:
+                raise RuntimeError(f"No startup report after {TIMEOUT:.0f} s")
+            time.sleep(0.01)
+        time.sleep(0.05)  # Lets the line be written completely
+    finally:
+        process.kill()
+        process.wait()
+    with open(report_path, encoding="utf-8") as f:
+        report = json.loads(f.readline())
+    os.remove(report_path)
+    marks = report["marks"]
+    # The report is saved right after the last milestone
+    marks["interpreter"] = report["time"] - spawned - max(marks.values())
+    return marks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--app", default=os.path.join(ROOT, "app.py"),
+                        help="app.py, or a frozen executable to run directly.")
+    parser.add_argument("--offscreen", action="store_true")
+    args = parser.parse_args()
+
+    command = [sys.executable, args.app] if args.app.endswith(".py") else [args.app]
+    env = dict(os.environ)
+    if args.offscreen:
+        env["QT_QPA_PLATFORM"] = "offscreen"
+    runs = []
+    with tempfile.TemporaryDirectory() as directory:
+        for number in range(args.runs):
+            runs.append(run_once(command, os.path.join(directory, f"{number}.jsonl"), env))
+
+    print(f"{len(runs)} run(s) of {' '.join(command)}")
+    for name in ("interpreter", "import", "qapplication", "window", "first paint", "codecs"):
+        values = [marks[name] * 1000 for marks in runs if name in marks]
+        if values:
+            print(f"  {name:<14} median {statistics.median(values):8.1f} ms  "
+                  f"best {min(values):8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Measure the resident memory of conversion worker processes over a batch.
+
+Usage: python benchmarks/worker_memory.py IMAGE [IMAGE ...] [--repeat 4] [--processes 2] [--formats jpeg png webp]
+
+The images (repeated --repeat times, so a small set makes a large batch) are
+converted by --processes worker processes, once calling convert_file directly
+as the workers did before and once through workers.convert_and_release, which
+returns freed memory to the system after every file. For each run this
+reports the peak RSS of the busiest worker (VmHWM), the largest RSS a worker
+kept between two files, and the RSS of all workers together at the end of the
+batch. Linux only, since it reads /proc/self/status.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pillow_heif import register_heif_opener  # noqa: E402
+
+from heif2png.conversion import ConversionOptions, Rendition, convert_file  # noqa: E402
+from heif2png.workers import convert_and_release  # noqa: E402
+
+
+def memory_status() -> dict:
+    status = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            key, value = line.split(":", 1)
+            if key in ("VmRSS", "VmHWM"):
+                status[key] = int(value.split()[0]) * 1024
+    return status
+
+
+def convert(release, file_path, output_dir, options):
+    if release:
+        convert_and_release(file_path, output_dir, options)
+    else:
+        convert_file(file_path, output_dir, options)
+    return os.getpid(), memory_status()
+
+
+def run(release, images, processes, options):
+    workers = {}  # pid -> list of memory status after each file
+    with tempfile.TemporaryDirectory() as output_dir, ProcessPoolExecutor(
+            processes, initializer=register_heif_opener) as pool:
+        start = time.perf_counter()
+        futures = [pool.submit(convert, release, path, output_dir, options) for path in images]
+        for future in futures:
+            pid, status = future.result()
+            workers.setdefault(pid, []).append(status)
+        seconds = time.perf_counter() - start
+    peak = max(status["VmHWM"] for history in workers.values() for status in history)
+    between = max(status["VmRSS"] for history in workers.values() for status in history)
+    final = sum(history[-1]["VmRSS"] for history in workers.values())
+    return peak, between, final, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("--repeat", type=int, default=4)
+    parser.add_argument("--processes", type=int, default=2)
+    parser.add_argument("--formats", nargs="+", default=["jpeg", "png", "webp"])
+    args = parser.parse_args()
+
+    images = args.images * args.repeat
+    mb = 2 ** 20
+    print(f"{len(images)} files, {args.processes} worker processes")
+    for output_format in args.formats:
+        options = ConversionOptions(
+            renditions=(Rendition(output_format),), replace_original=False)
+        for label, release in (("convert_file", False), ("convert_and_release", True)):
+            peak, between, final, seconds = run(release, images, args.processes, options)
+            print(f"  {output_format:<5} {label:<20} peak {peak / mb:7.1f} MB  "
+                  f"between files {between / mb:7.1f} MB  all workers at end {final / mb:7.1f} MB  "
+                  f"{seconds:6.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+"""Conversion engine shared by the English (app.py) and Korean (app_kr.py) front ends."""
@@ -0,0 +1,6 @@
+import sys
+
+from heif2png.cli import main
+
+
+sys.exit(main())
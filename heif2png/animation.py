@@ -0,0 +1,213 @@
+import os
+import struct
+
+from PIL import Image
+
+from heif2png import archives, metrics, pixels, png
+
+
+# Formats written as animations; PNG output becomes an APNG
+ANIMATED_FORMATS = ("png", "webp")
+DEFAULT_FRAME_DURATION = 100  # Milliseconds per frame when the file carries no timing
+# libheif keeps per-image state in the decoding context until the whole file
+# is closed, so long sequences are read through a fresh context this often
+REOPEN_FRAMES = 8
+_MAX_MOOV_BYTES = 64 * 1024 * 1024
+_PICTURE_HANDLERS = (b"pict", b"vide")
+
+
+def _boxes(data: bytes, start: int = 0, end: int | None = None):
+    # Yields (type, payload start, payload end) for the ISOBMFF boxes in data[start:end]
+    end = len(data) if end is None else end
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", data, offset)
+        header = 8
+        if size == 1:
+            if offset + 16 > end:
+                return
+            size = struct.unpack_from(">Q", data, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header or offset + size > end:
+            return
+        yield box_type, offset + header, offset + size
+        offset += size
+
+
+def _find_box(data: bytes, start: int, end: int, *path: bytes):
+    for box_type in path:
+        for child_type, child_start, child_end in _boxes(data, start, end):
+            if child_type == box_type:
+                start, end = child_start, child_end
+                break
+        else:
+            return None
+    return start, end
+
+
+def _read_moov(file_path: str) -> bytes | None:
+    # Walks the top-level boxes by seeking, so the media data is never read
+    source = archives.open_source(file_path)
+    with open(source, "rb") if isinstance(source, str) else source as f:
+        file_size = f.seek(0, os.SEEK_END)
+        offset = 0
+        while offset + 8 <= file_size:
+            f.seek(offset)
+            size, box_type = struct.unpack(">I4s", f.read(8))
+            header = 8
+            if size == 1:
+                size = struct.unpack(">Q", f.read(8))[0]
+                header = 16
+            elif size == 0:
+                size = file_size - offset
+            if size < header:
+                return None
+            if box_type == b"moov":
+                if size > _MAX_MOOV_BYTES:
+                    return None
+                return f.read(size - header)
+            offset += size
+    return None
+
+
+def track_durations(file_path: str) -> list[int] | None:
+    # Frame durations in milliseconds from the first picture track of a HEIF
+    # image sequence (the mdhd timescale and the stts sample deltas), or None
+    # when the file has no such track.
+    try:
+        moov = _read_moov(file_path)
+    except (OSError, struct.error):
+        return None
+    if not moov:
+        return None
+    for box_type, start, end in _boxes(moov):
+        if box_type != b"trak":
+            continue
+        hdlr = _find_box(moov, start, end, b"mdia", b"hdlr")
+        mdhd = _find_box(moov, start, end, b"mdia", b"mdhd")
+        stts = _find_box(moov, start, end, b"mdia", b"minf", b"stbl", b"stts")
+        if not (hdlr and mdhd and stts) or moov[hdlr[0] + 8:hdlr[0] + 12] not in _PICTURE_HANDLERS:
+            continue
+        try:
+            version = moov[mdhd[0]]
+            timescale = struct.unpack_from(">I", moov, mdhd[0] + (20 if version == 1 else 12))[0]
+            entry_count = struct.unpack_from(">I", moov, stts[0] + 4)[0]
+            durations = []
+            for index in range(entry_count):
+                sample_count, delta = struct.unpack_from(">II", moov, stts[0] + 8 + index * 8)
+                durations += [round(delta * 1000 / timescale)] * sample_count
+        except (struct.error, IndexError, ZeroDivisionError):
+            continue
+        return durations
+    return None
+
+
+class HeifFrames:
+    # The top-level images of a HEIF file (burst shots, or the frames of a
+    # sequence stored as items), decoded one at a time while iterating. Each
+    # image is removed from the container once its frame has been handed out
+    # and the container is reopened every REOPEN_FRAMES frames, so memory does
+    # not grow with the length of the sequence.
+
+    def __init__(self, file_path: str, default_duration: int = DEFAULT_FRAME_DURATION):
+        import pillow_heif
+
+        self.file_path = file_path
+        self._heif_file = pillow_heif.open_heif(
+            archives.open_source(file_path), convert_hdr_to_8bit=True)
+        primary = self._heif_file[self._heif_file.primary_index]
+        self.size = primary.size
+        self.mode = primary.mode
+        self.info = dict(primary.info)
+        pillow_heif.set_orientation(self.info)  # libheif already applied the rotation
+        self.count = len(self._heif_file)
+
+        track = track_durations(file_path)
+        if track is not None and len(track) != self.count:
+            track = None
+        self.durations = [
+            heif_image.info.get("duration") or (track[index] if track else default_duration)
+            for index, heif_image in enumerate(self._heif_file)]
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self):
+        import pillow_heif
+
+        heif_file, self._heif_file = self._heif_file, None
+        for index in range(self.count):
+            if heif_file is None:
+                heif_file = pillow_heif.open_heif(
+                    archives.open_source(self.file_path), convert_hdr_to_8bit=True)
+                for _ in range(index):
+                    del heif_file[0]  # Not decoded yet, so this only drops the handle
+            heif_image = heif_file[0]
+            with metrics.stage("decode"):
+                frame = heif_image.to_pillow()
+            del heif_file[0]
+            del heif_image
+            if (index + 1) % REOPEN_FRAMES == 0:
+                heif_file = None
+            yield frame
+
+
+class _FrameSequence(Image.Image):
+    # A forward-only multi-frame image over an iterator of frames, for Pillow's
+    # save_all writers: they step through append_images with seek(), so each
+    # frame is produced on demand and released when the next one replaces it.
+
+    def __init__(self, frames, n_frames: int):
+        super().__init__()
+        self._frames = iter(frames)
+        self.n_frames = n_frames
+        self._frame_index = -1
+
+    def seek(self, frame: int) -> None:
+        if frame == self._frame_index:
+            return
+        if frame != self._frame_index + 1 or frame >= self.n_frames:
+            raise EOFError("Frames can only be read in order")
+        current = next(self._frames)
+        self.im = current.im
+        self._mode = current.mode
+        self._size = current.size
+        self._frame_index = frame
+
+    def tell(self) -> int:
+        return self._frame_index
+
+
+def _prepared_frames(frames, size, output_format, matte, pixel_transform):
+    for frame in frames:
+        if frame.size != size:
+            frame = frame.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+        if pixel_transform:
+            frame = pixel_transform(frame)
+        yield pixels.prepare_pixels(frame, output_format, matte)
+
+
+def write_animation(frames: HeifFrames, output_path: str, output_format: str, size,
+                    save_options: dict, matte=pixels.DEFAULT_MATTE,
+                    pixel_transform=None) -> None:
+    # Streams frames into an animated WEBP or APNG at size. save_options holds
+    # quality, icc_profile and exif as for a still image.
+    prepared = _prepared_frames(frames, size, output_format, matte, pixel_transform)
+    if output_format == "png":
+        with archives.open_output(output_path) as fp:
+            writer = png.APNGStreamWriter(
+                fp, size, frames.mode, len(frames),
+                icc_profile=save_options.get("icc_profile"), exif=save_options.get("exif"))
+            for frame, duration in zip(prepared, frames.durations):
+                writer.write_frame(frame, duration)
+            writer.close()
+        return
+
+    first = next(prepared)
+    with archives.open_output(output_path) as fp:
+        first.save(
+            fp, output_format.upper(), save_all=True,
+            append_images=[_FrameSequence(prepared, len(frames) - 1)],
+            duration=frames.durations, loop=0, **save_options)
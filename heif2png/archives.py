@@ -0,0 +1,260 @@
+import io
+import os
+import posixpath
+import tarfile
+import threading
+import zipfile
+
+from heif2png.metrics import MeteredWriter
+
+
+# Members of an archive are addressed as "<archive path>!/<member name>"
+MEMBER_SEPARATOR = "!/"
+ZIP_EXTENSIONS = (".zip",)
+TAR_EXTENSIONS = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+ARCHIVE_EXTENSIONS = ZIP_EXTENSIONS + TAR_EXTENSIONS
+CONVERTED_ARCHIVE_SUFFIX = " (converted).zip"
+
+
+def is_archive(path: str) -> bool:
+    return path.lower().endswith(ARCHIVE_EXTENSIONS) and os.path.isfile(path)
+
+
+def member_path(archive_path: str, member: str) -> str:
+    return f"{archive_path}{MEMBER_SEPARATOR}{member.lstrip('/')}"
+
+
+def split_member_path(path: str) -> tuple[str, str] | None:
+    # Returns (archive path, member name) for a member path, None for a plain path
+    lowered = path.lower()
+    for extension in ARCHIVE_EXTENSIONS:
+        index = lowered.find(extension + MEMBER_SEPARATOR)
+        if index != -1:
+            split = index + len(extension)
+            return path[:split], path[split + len(MEMBER_SEPARATOR):].replace("\\", "/")
+    return None
+
+
+def is_member_path(path: str) -> bool:
+    return split_member_path(path) is not None
+
+
+def archive_stem(archive_path: str) -> str:
+    name = os.path.basename(archive_path)
+    lowered = name.lower()
+    for extension in sorted(ARCHIVE_EXTENSIONS, key=len, reverse=True):
+        if lowered.endswith(extension):
+            return name[:-len(extension)]
+    return name
+
+
+def output_archive_path(archive_path: str) -> str:
+    return os.path.join(os.path.dirname(archive_path),
+                        archive_stem(archive_path) + CONVERTED_ARCHIVE_SUFFIX)
+
+
+def source_stat(path: str) -> os.stat_result:
+    # Members carry the modification time and size of their archive
+    member = split_member_path(path)
+    return os.stat(member[0] if member else path)
+
+
+def _skip_member(name: str) -> bool:
+    # macOS resource forks in archives made by Finder
+    return name.startswith("__MACOSX/") or posixpath.basename(name).startswith("._")
+
+
+class _ArchiveReader:
+    def __init__(self, archive_path: str):
+        self.lock = threading.Lock()
+        self._zip = None
+        self._tar = None
+        try:
+            if archive_path.lower().endswith(ZIP_EXTENSIONS):
+                self._zip = zipfile.ZipFile(archive_path)
+            else:
+                self._tar = tarfile.open(archive_path)
+        except (zipfile.BadZipFile, tarfile.TarError) as e:
+            raise OSError(f"Cannot read archive '{archive_path}': {e}") from e
+
+    def names(self) -> list[str]:
+        if self._zip is not None:
+            return [info.filename for info in self._zip.infolist() if not info.is_dir()]
+        return [info.name for info in self._tar.getmembers() if info.isfile()]
+
+    def size(self, name: str) -> int:
+        with self.lock:
+            if self._zip is not None:
+                return self._zip.getinfo(name).file_size
+            return self._tar.getmember(name).size
+
+    def read(self, name: str) -> bytes:
+        # HEIF decoding needs the whole file in memory anyway, so a member is
+        # read straight into bytes and never extracted to disk. Compressed tar
+        # archives can only be read forwards; converting members in listing
+        # order keeps that a single pass.
+        with self.lock:
+            if self._zip is not None:
+                return self._zip.read(name)
+            member = self._tar.extractfile(name)
+            if member is None:
+                raise KeyError(f"'{name}' is not a regular file")
+            return member.read()
+
+    def close(self) -> None:
+        (self._zip or self._tar).close()
+
+
+class ArchiveSources:
+    # Open archives that members are read from, kept open between reads so a
+    # multi-gigabyte export's central directory is parsed only once. A changed
+    # archive is reopened.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._readers = {}  # archive path -> (mtime_ns, size, reader)
+
+    def reader(self, archive_path: str) -> _ArchiveReader:
+        stat = os.stat(archive_path)
+        with self._lock:
+            entry = self._readers.get(archive_path)
+            if entry is not None and entry[:2] == (stat.st_mtime_ns, stat.st_size):
+                return entry[2]
+            if entry is not None:
+                entry[2].close()
+            reader = _ArchiveReader(archive_path)
+            self._readers[archive_path] = (stat.st_mtime_ns, stat.st_size, reader)
+            return reader
+
+    def list_members(self, archive_path: str, extensions) -> list[str]:
+        return [
+            member_path(archive_path, name)
+            for name in self.reader(archive_path).names()
+            if name.lower().endswith(extensions) and not _skip_member(name)]
+
+    def read(self, path: str) -> bytes:
+        archive_path, name = split_member_path(path)
+        return self.reader(archive_path).read(name)
+
+    def size(self, path: str) -> int:
+        archive_path, name = split_member_path(path)
+        return self.reader(archive_path).size(name)
+
+    def close(self) -> None:
+        with self._lock:
+            for _, _, reader in self._readers.values():
+                reader.close()
+            self._readers.clear()
+
+
+archive_sources = ArchiveSources()
+
+
+def open_source(path: str):
+    # What Image.open and pillow_heif.open_heif should be given for path: the
+    # path itself, or the bytes of an archive member in memory.
+    if split_member_path(path) is None:
+        return path
+    return io.BytesIO(archive_sources.read(path))
+
+
+def source_size(path: str) -> int:
+    # Uncompressed size of a member, or the size of a plain file
+    if split_member_path(path) is None:
+        return os.path.getsize(path)
+    return archive_sources.size(path)
+
+
+class _LockedMember(io.RawIOBase):
+    # A member being written; holds the archive's lock because a ZipFile
+    # accepts only one open member at a time.
+
+    def __init__(self, stream, lock):
+        super().__init__()
+        self._stream = stream
+        self._lock = lock
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        return self._stream.write(data)
+
+    def close(self) -> None:
+        if not self.closed:
+            try:
+                self._stream.close()
+            finally:
+                self._lock.release()
+        super().close()
+
+
+class ArchiveOutputs:
+    # ZIP files that converted images are written into, created on first use
+    # during a batch and finished by close(). Members are stored, not
+    # deflated: PNG, JPEG and WEBP data is already compressed.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._archives = {}  # archive path -> (ZipFile, lock)
+        self._continued = set()  # Archives appended to instead of replaced when opened
+
+    def continue_archive(self, archive_path: str) -> None:
+        # For a batch that resumes after its ZIP was closed, e.g. by a restart
+        with self._lock:
+            if archive_path not in self._archives and os.path.isfile(archive_path):
+                self._continued.add(archive_path)
+
+    def _create(self, archive_path: str) -> zipfile.ZipFile:
+        if archive_path in self._continued:
+            self._continued.discard(archive_path)
+            try:
+                return zipfile.ZipFile(archive_path, "a", zipfile.ZIP_STORED)
+            except zipfile.BadZipFile:
+                pass  # Never finished, so nothing in it can be read anyway
+        return zipfile.ZipFile(archive_path, "w", zipfile.ZIP_STORED)
+
+    def open(self, archive_path: str, name: str):
+        with self._lock:
+            entry = self._archives.get(archive_path)
+            if entry is None:
+                entry = (self._create(archive_path), threading.Lock())
+                self._archives[archive_path] = entry
+        archive, lock = entry
+        lock.acquire()
+        try:
+            stream = archive.open(name, "w", force_zip64=True)
+        except BaseException:
+            lock.release()
+            raise
+        return _LockedMember(stream, lock)
+
+    def close(self, archive_paths=None) -> list[str]:
+        # Finishes the given archives, or all of them; paths that are not open
+        # are ignored
+        with self._lock:
+            closed = sorted(self._archives if archive_paths is None
+                            else set(archive_paths) & set(self._archives))
+            error = None
+            for archive_path in closed:
+                try:
+                    self._archives.pop(archive_path)[0].close()
+                except OSError as e:
+                    error = error or e
+        if error is not None:
+            raise error
+        return closed
+
+
+archive_outputs = ArchiveOutputs()
+
+
+def open_output(path: str):
+    # Opens path for writing in binary mode; a member path is written into
+    # the ZIP file it names. Writes are measured for heif2png.metrics.
+    member = split_member_path(path)
+    if member is None:
+        raw = io.FileIO(path, "wb")
+    else:
+        raw = archive_outputs.open(*member)
+    return io.BufferedWriter(MeteredWriter(raw))
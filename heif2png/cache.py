@@ -0,0 +1,121 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from PIL import Image
+
+from heif2png import archives
+
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+
+@dataclass(frozen=True)
+class CacheStats:
+    hits: int
+    misses: int
+    evictions: int
+    entries: int
+    bytes_used: int
+    max_bytes: int
+
+    def __str__(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups * 100 if lookups else 0.0
+        return (f"{self.hits} hits, {self.misses} misses ({hit_rate:.0f}% hit rate), "
+                f"{self.evictions} evictions, {self.entries} images, "
+                f"{self.bytes_used / 2**20:.0f}/{self.max_bytes / 2**20:.0f} MB")
+
+
+def image_bytes(pil_image: Image.Image) -> int:
+    # Pillow stores every multi-band 8-bit mode with four bytes per pixel
+    if len(pil_image.getbands()) > 1 or pil_image.mode in ("I", "F"):
+        bytes_per_pixel = 4
+    elif pil_image.mode.startswith("I;16"):
+        bytes_per_pixel = 2
+    else:
+        bytes_per_pixel = 1
+    return pil_image.width * pil_image.height * bytes_per_pixel
+
+
+class DecodedImageCache:
+    # Process-wide LRU cache of fully decoded images, so a file that was just
+    # previewed is not decoded again when it is converted. Entries are keyed by
+    # path, mtime and size; a changed file simply misses. Cached images are
+    # shared, so callers must not modify them in place.
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (image, size in bytes)
+        self._bytes_used = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @staticmethod
+    def key(path: str):
+        stat = archives.source_stat(path)
+        return path, stat.st_mtime_ns, stat.st_size
+
+    def get(self, path: str) -> Image.Image | None:
+        try:
+            key = self.key(path)
+        except OSError:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[0]
+
+    def put(self, path: str, pil_image: Image.Image) -> None:
+        try:
+            key = self.key(path)
+        except OSError:
+            return
+        size = image_bytes(pil_image)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._discard_path(path)
+            self._entries[key] = (pil_image, size)
+            self._bytes_used += size
+            while self._bytes_used > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes_used -= evicted_size
+                self._evictions += 1
+
+    def get_or_decode(self, path: str) -> Image.Image:
+        pil_image = self.get(path)
+        if pil_image is None:
+            pil_image = Image.open(archives.open_source(path))
+            pil_image.load()
+            self.put(path, pil_image)
+        return pil_image
+
+    def discard(self, path: str) -> None:
+        with self._lock:
+            self._discard_path(path)
+
+    def _discard_path(self, path: str) -> None:
+        # Older versions of a file are dropped as soon as a new one is cached
+        for key in [key for key in self._entries if key[0] == path]:
+            _, size = self._entries.pop(key)
+            self._bytes_used -= size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes_used = 0
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(self._hits, self._misses, self._evictions,
+                              len(self._entries), self._bytes_used, self.max_bytes)
+
+
+decoded_images = DecodedImageCache()
@@ -0,0 +1,499 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from dataclasses import replace
+
+import pillow_heif
+
+from heif2png.archives import archive_outputs, archive_sources, is_archive, is_member_path
+from heif2png.cache import decoded_images
+from heif2png.color import SRGB
+from heif2png.conversion import (
+    OUTPUT_FORMATS, ConversionOptions, Rendition, check_renditions, output_directory,
+    parse_renditions
+)
+from heif2png.distributed import (
+    DEFAULT_LEASE_SECONDS, DEFAULT_PORT, DEFAULT_UNIT_SIZE, Coordinator, Worker
+)
+from heif2png.governor import (
+    BACKGROUND, DEFAULT_MAX_LOAD, DEFAULT_MIN_FREE_MEMORY, IO_PRIORITIES, ResourceLimits,
+    parse_rate
+)
+from heif2png.metrics import DEFAULT_PORT as DEFAULT_METRICS_PORT, MetricsServer, conversion_metrics
+from heif2png.profiling import ProfileSession
+from heif2png.progress import ProgressTracker, StatusPrinter, file_bytes
+from heif2png.scanindex import scan_index
+from heif2png.staging import (
+    ALWAYS, NETWORK, NEVER, STAGING_MODES, BulkMover, default_root, is_network_path,
+    staging_directory
+)
+from heif2png.thumbnails import DEFAULT_MAX_BYTES, ThumbnailCache
+from heif2png.tuning import BatchRunner, TRIAL_FILES, candidates, trial_sizes, workload_profile
+from heif2png.verify import verify_outputs
+from heif2png.workers import Concurrency
+
+
+HEIF_EXTENSIONS = (".heic", ".heif")
+
+
+def _prune_thumbnails(args) -> int:
+    cache = ThumbnailCache(args.cache_dir, args.max_size * 1024 * 1024)
+    result = cache.prune(remove_stale=not args.keep_stale)
+    print(f"Removed {result.removed} thumbnail(s), freed {result.freed_bytes / 2**20:.1f} MB; "
+          f"{result.kept} remaining ({result.kept_bytes / 2**20:.1f} MB) in {cache.root}")
+    return 0
+
+
+def _collect_inputs(inputs) -> list[str]:
+    file_paths = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for _, heif_paths, _ in scan_index.walk(path, HEIF_EXTENSIONS):
+                file_paths += sorted(heif_paths)
+        elif is_archive(path):
+            file_paths += archive_sources.list_members(path, HEIF_EXTENSIONS)
+        elif os.path.isfile(path):
+            file_paths.append(path)
+        else:
+            print(f"Skipping '{path}': not a file, folder or archive", file=sys.stderr)
+    return file_paths
+
+
+def _options(args) -> ConversionOptions | None:
+    try:
+        renditions = [Rendition(args.format)] + parse_renditions(args.sizes)
+        check_renditions(renditions)
+    except ValueError as e:
+        print(f"Invalid --sizes: {e}", file=sys.stderr)
+        return None
+    return ConversionOptions(
+        renditions=tuple(renditions),
+        replace_original=False,
+        maintain_metadata=not args.strip_metadata,
+        color_target=args.color,
+        animate_sequences=args.animate)
+
+
+def _limits(args) -> ResourceLimits | None:
+    # --background sets the defaults that the other resource options override
+    limits = BACKGROUND if getattr(args, "background", False) else ResourceLimits()
+    changes = {name: getattr(args, name) for name in
+               ("niceness", "io_priority", "max_cores", "max_load", "min_free_memory")
+               if getattr(args, name, None) is not None}
+    if args.write_limit is not None:
+        try:
+            changes["write_limit"] = parse_rate(args.write_limit)
+        except ValueError as e:
+            print(f"Invalid --write-limit: {e}", file=sys.stderr)
+            return None
+    return replace(limits, **changes)
+
+
+def _start_metrics(args) -> MetricsServer | None:
+    if args.metrics is None:
+        return None
+    conversion_metrics.cache_bytes.set_function(lambda: decoded_images.stats().bytes_used)
+    conversion_metrics.cache_hits.set_function(lambda: decoded_images.stats().hits)
+    conversion_metrics.cache_misses.set_function(lambda: decoded_images.stats().misses)
+    server = MetricsServer()
+    try:
+        host, port = server.serve(args.metrics_host, args.metrics)
+    except OSError as e:
+        print(f"Could not serve metrics on port {args.metrics}: {e}", file=sys.stderr)
+        return None
+    print(f"Serving metrics on http://{host}:{port}/metrics", file=sys.stderr)
+    return server
+
+
+def _stop_metrics(server: MetricsServer | None) -> None:
+    if server is not None:
+        server.shutdown()
+
+
+def _report_trials(runner: BatchRunner) -> None:
+    for trial in runner.trials:
+        print(f"  {trial.concurrency}: {trial.throughput:.1f} MP/s "
+              f"({trial.files} file(s) in {trial.seconds:.2f} s)", file=sys.stderr)
+    print(f"Using {runner.concurrency}", file=sys.stderr)
+
+
+def _stages(mode: str, output_dir: str, network: dict) -> bool:
+    if mode == NEVER or is_member_path(output_dir):
+        return False
+    if mode == ALWAYS:
+        return True
+    if output_dir not in network:
+        network[output_dir] = is_network_path(output_dir)
+    return network[output_dir]
+
+
+def _convert(args) -> int:
+    options = _options(args)
+    if options is None:
+        return 2
+    options = replace(options, verify_outputs=args.verify)
+    limits = _limits(args)
+    if limits is None:
+        return 2
+    concurrency = None
+    if args.processes or args.decode_threads:
+        concurrency = Concurrency(args.processes or 1,
+                                  args.decode_threads or Concurrency().decode_threads)
+
+    errors = 0
+    jobs = []
+    created = set()  # Folders made or checked, once each however many files they get
+    network = {}
+    destinations = {}  # index of a staged file -> its output folder
+    staging_root = None
+    staging_key = f"cli-{os.getpid()}"
+    mover = BulkMover()
+    moving = {}  # move future -> index
+    metrics_server = _start_metrics(args)
+    profile = ProfileSession(args.profile).start() if args.profile is not None else None
+    try:
+        for file_path in _collect_inputs(args.inputs):
+            output_dir = output_directory(file_path, args.in_place, args.zip)
+            target_dir = output_dir
+            if _stages(args.stage, output_dir, network):
+                destinations[len(jobs)] = output_dir
+                staging_root = staging_root or default_root()
+                target_dir = staging_directory(staging_root, staging_key, output_dir)
+            if target_dir not in created:
+                try:
+                    if not is_member_path(target_dir):
+                        os.makedirs(target_dir, exist_ok=True)
+                except OSError as e:
+                    errors += 1
+                    print(f"Error creating folder '{target_dir}': {e}", file=sys.stderr)
+                    destinations.pop(len(jobs), None)
+                    continue
+                created.add(target_dir)
+            jobs.append((file_path, target_dir))
+
+        def report_moves(finished=False):
+            nonlocal errors
+            for future in [future for future in moving if finished or future.done()]:
+                index = moving.pop(future)
+                try:
+                    for output_path in future.result():
+                        print(output_path)
+                except Exception as e:
+                    errors += 1
+                    print(f"Error moving outputs of '{jobs[index][0]}' to "
+                          f"'{destinations[index]}': {type(e).__name__}: {e}", file=sys.stderr)
+
+        runner = BatchRunner(jobs, options, concurrency, limits=limits)
+        backing_off = None
+
+        def report_backoff():
+            nonlocal backing_off
+            if runner.backing_off != backing_off:
+                backing_off = runner.backing_off
+                print(f"Holding new files: {backing_off}" if backing_off else "Resuming",
+                      file=sys.stderr)
+
+        runner.idle = report_backoff
+        tracker = ProgressTracker(len(jobs))
+        with StatusPrinter(tracker, args.progress):
+            for index, result in runner:
+                if args.verify and not isinstance(result, Exception):
+                    # Workers go on with the next files meanwhile
+                    try:
+                        verify_outputs(result)
+                    except Exception as e:
+                        result = e
+                if isinstance(result, Exception):
+                    errors += 1
+                    tracker.advance(failed=1)
+                    print(f"Error converting '{jobs[index][0]}': {type(result).__name__}: {result}",
+                          file=sys.stderr)
+                else:
+                    tracker.advance(nbytes=file_bytes(jobs[index][0]))
+                    if index in destinations:
+                        moving[mover.move(result, destinations[index])] = index
+                    else:
+                        for output_path in result:
+                            print(output_path)
+                report_moves()
+        if runner.trials:
+            _report_trials(runner)
+        mover.shutdown(wait=True)
+        report_moves(finished=True)
+        if destinations:
+            print(mover.stats().summary(), file=sys.stderr)
+    finally:
+        mover.shutdown(wait=False)
+        if staging_root is not None:
+            shutil.rmtree(os.path.join(staging_root, staging_key), ignore_errors=True)
+        archive_outputs.close()
+        archive_sources.close()
+        _stop_metrics(metrics_server)
+        if profile is not None:
+            print(f"Profile written to {profile.directory}; see {profile.stop()}",
+                  file=sys.stderr)
+    return 1 if errors else 0
+
+
+def _tune(args) -> int:
+    # Calibrates on the given files without keeping any output
+    options = _options(args)
+    if options is None:
+        return 2
+    file_paths = _collect_inputs(args.inputs)
+    if not file_paths:
+        print("No HEIC/HEIF files found.", file=sys.stderr)
+        return 1
+    configs = candidates()
+    if len(configs) < 2:
+        print(f"Nothing to calibrate: {configs[0]} is the only option on this machine.",
+              file=sys.stderr)
+        return 0
+    print(f"Workload profile: {workload_profile(file_paths, options).key}", file=sys.stderr)
+    with tempfile.TemporaryDirectory() as output_dir:
+        # Files are repeated until every candidate gets its share of a batch
+        # large enough to calibrate; only the trials themselves are run.
+        needed = 2 * sum(trial_sizes(configs, args.trial_files))
+        jobs = [(file_paths[i % len(file_paths)], output_dir) for i in range(needed)]
+        runner = BatchRunner(jobs, options, candidate_configs=configs,
+                             trial_files=args.trial_files)
+        for _ in runner:
+            if len(runner.trials) == len(configs):
+                break
+    _report_trials(runner)
+    return 0
+
+
+def _serve(args) -> int:
+    options = _options(args)
+    if options is None:
+        return 2
+    errors = 0
+    jobs = []
+    for file_path in _collect_inputs(args.inputs):
+        output_dir = output_directory(file_path, args.in_place)
+        try:
+            os.makedirs(output_dir, exist_ok=True)
+        except OSError as e:
+            errors += 1
+            print(f"Error creating folder '{output_dir}': {e}", file=sys.stderr)
+            continue
+        jobs.append((file_path, output_dir))
+
+    coordinator = Coordinator(jobs, options, args.unit_size, args.lease)
+    conversion_metrics.queue_depth.set_function(coordinator.waiting_files)
+    metrics_server = _start_metrics(args)
+    host, port = coordinator.serve(args.host, args.port)
+    print(f"Serving {len(jobs)} file(s) in {len(coordinator.units)} unit(s) "
+          f"on http://{host}:{port}/", file=sys.stderr)
+    try:
+        while not coordinator.wait(args.progress or None):
+            status = coordinator.status()
+            print(f"{coordinator.progress.snapshot().status_line()}, "
+                  f"{status['leased_units']} unit(s) leased, {status['reissued']} re-issued",
+                  file=sys.stderr)
+        # Lets polling workers hear that the batch is done before the port closes
+        time.sleep(args.linger)
+    except KeyboardInterrupt:
+        print("Interrupted; unfinished units were not converted.", file=sys.stderr)
+        errors += 1
+    finally:
+        coordinator.shutdown()
+        _stop_metrics(metrics_server)
+
+    for file_path, output_paths, error in coordinator.results():
+        if error:
+            errors += 1
+            print(f"Error converting '{file_path}': {error}", file=sys.stderr)
+        else:
+            for output_path in output_paths:
+                print(output_path)
+    status = coordinator.status()
+    for name, node in sorted(status["nodes"].items()):
+        print(f"  {name}: {node['files']} file(s), {node['units']} unit(s), "
+              f"{node['errors']} error(s), {node['files_per_minute']:.1f} files/min",
+              file=sys.stderr)
+    return 1 if errors else 0
+
+
+def _work(args) -> int:
+    limits = _limits(args)
+    if limits is None:
+        return 2
+    concurrency = Concurrency(args.processes or 1,
+                              args.decode_threads or Concurrency().decode_threads)
+    worker = Worker(args.url, args.name, concurrency, limits)
+    metrics_server = _start_metrics(args)
+    try:
+        files = worker.run()
+    except OSError as e:
+        print(f"Lost the coordinator at {args.url}: {e}", file=sys.stderr)
+        return 1
+    finally:
+        _stop_metrics(metrics_server)
+    print(f"{worker.name}: converted {files} file(s) in {worker.units} unit(s)", file=sys.stderr)
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="heif2png", description="Command line tools for the HEIC Converter.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    # Options shared by convert, tune and serve
+    conversion_options = argparse.ArgumentParser(add_help=False)
+    conversion_options.add_argument("--format", choices=OUTPUT_FORMATS, default="png")
+    conversion_options.add_argument(
+        "--sizes", default="", metavar="SPEC",
+        help="Extra renditions as format:max size:quality, e.g. 'jpeg:2048:85, jpeg:512:80'.")
+    conversion_options.add_argument("--strip-metadata", action="store_true",
+                                    help="Do not copy EXIF and ICC metadata.")
+    conversion_options.add_argument(
+        "--color", default=None, metavar="sRGB|ICC",
+        help=f"Convert pixels to '{SRGB}' or to the ICC profile at this path.")
+    conversion_options.add_argument(
+        "--animate", action="store_true",
+        help="Write image sequences and bursts as animated WEBP or APNG.")
+
+    # Options of the commands that can run unattended
+    metrics_options = argparse.ArgumentParser(add_help=False)
+    metrics_options.add_argument(
+        "--metrics", type=int, default=None, metavar="PORT",
+        help=f"Serve OpenMetrics (Prometheus) metrics on http://HOST:PORT/metrics, "
+             f"e.g. {DEFAULT_METRICS_PORT}.")
+    metrics_options.add_argument("--metrics-host", default="127.0.0.1", metavar="HOST",
+                                 help="Address for --metrics (default: %(default)s).")
+
+    # Options of the commands that convert on this machine
+    resource_options = argparse.ArgumentParser(add_help=False)
+    resource_options.add_argument(
+        "--nice", dest="niceness", type=int, default=None, metavar="N",
+        help="Raise the niceness of the conversion workers by N (lower CPU priority).")
+    resource_options.add_argument(
+        "--io-priority", choices=IO_PRIORITIES, default=None,
+        help="Disk priority of the conversion workers (default: normal).")
+    resource_options.add_argument(
+        "--max-cores", type=int, default=None, metavar="N",
+        help="Use at most N cores: caps worker processes and threads, and pins the workers "
+             "to N cores on Linux.")
+    resource_options.add_argument(
+        "--write-limit", default=None, metavar="RATE",
+        help="Write outputs at most this fast across all workers, in bytes per second "
+             "with an optional K, M or G suffix, e.g. 20M.")
+
+    convert = commands.add_parser(
+        "convert", parents=[conversion_options, metrics_options, resource_options],
+        help="Convert HEIC/HEIF files, folders, or zip and tar archives.")
+    convert.add_argument("inputs", nargs="+", metavar="INPUT")
+    convert.add_argument(
+        "--in-place", action="store_true",
+        help="Write outputs next to the source files instead of a 'Converted Files' folder. "
+             "Originals are never deleted.")
+    convert.add_argument(
+        "--zip", action="store_true",
+        help="Write images from an archive into '<archive> (converted).zip' "
+             "instead of extracting them to a folder.")
+    convert.add_argument(
+        "--processes", type=int, default=None, metavar="N",
+        help="Worker processes. Without this or --decode-threads, large batches calibrate "
+             "the best mix on their first files.")
+    convert.add_argument("--decode-threads", type=int, default=None, metavar="N",
+                         help="libheif decode threads per process.")
+    convert.add_argument(
+        "--verify", action="store_true",
+        help="Open every output again and check it against the converted image; an output "
+             "that does not check out counts as an error.")
+    convert.add_argument(
+        "--profile", nargs="?", const=".", default=None, metavar="DIR",
+        help="Record cProfile stats and tracemalloc allocation sites of the batch, including "
+             "worker processes, into a timestamped folder under DIR (default: the current "
+             "folder).")
+    convert.add_argument(
+        "--progress", type=float, default=5.0, metavar="SECONDS",
+        help="Print progress, throughput and ETA to stderr this often; 0 turns it off "
+             "(default: %(default)s).")
+    convert.add_argument(
+        "--max-load", type=float, default=None, metavar="LOAD",
+        help="Start no new files while the one-minute load average per core, not counting "
+             "this batch, is above LOAD.")
+    convert.add_argument(
+        "--min-free-memory", type=float, default=None, metavar="PERCENT",
+        help="Start no new files while less than PERCENT of memory is available.")
+    convert.add_argument(
+        "--background", action="store_true",
+        help=f"Run as a background batch: --nice {BACKGROUND.niceness} --io-priority "
+             f"{BACKGROUND.io_priority} --max-load {DEFAULT_MAX_LOAD:g} --min-free-memory "
+             f"{DEFAULT_MIN_FREE_MEMORY:g}, unless given otherwise.")
+    convert.add_argument(
+        "--stage", choices=STAGING_MODES, default=NETWORK,
+        help="Write outputs to a local staging folder first and move them to their folder in "
+             "batches: 'network' for output folders on NFS or SMB shares (default: "
+             "%(default)s).")
+    convert.set_defaults(handler=_convert)
+
+    tune = commands.add_parser(
+        "tune", parents=[conversion_options],
+        help="Measure throughput of process and decode thread mixes on sample files.")
+    tune.add_argument("inputs", nargs="+", metavar="INPUT")
+    tune.add_argument("--trial-files", type=int, default=TRIAL_FILES, metavar="N",
+                      help="Files converted per configuration, and at least two per process "
+                           "of the configuration (default: %(default)s).")
+    tune.set_defaults(handler=_tune)
+
+    serve = commands.add_parser(
+        "serve", parents=[conversion_options, metrics_options],
+        help="Coordinate a conversion across worker nodes that share the file system.")
+    serve.add_argument("inputs", nargs="+", metavar="INPUT")
+    serve.add_argument(
+        "--in-place", action="store_true",
+        help="Write outputs next to the source files instead of a 'Converted Files' folder.")
+    serve.add_argument("--host", default="127.0.0.1",
+                       help="Address to listen on; use 0.0.0.0 for remote workers.")
+    serve.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serve.add_argument("--unit-size", type=int, default=DEFAULT_UNIT_SIZE, metavar="N",
+                       help="Files per work unit (default: %(default)s).")
+    serve.add_argument(
+        "--lease", type=float, default=DEFAULT_LEASE_SECONDS, metavar="SECONDS",
+        help="Re-issue a unit whose worker has not renewed it in this time (default: %(default)s).")
+    serve.add_argument("--linger", type=float, default=3.0, help=argparse.SUPPRESS)
+    serve.add_argument(
+        "--progress", type=float, default=10.0, metavar="SECONDS",
+        help="Print progress, throughput and ETA to stderr this often; 0 turns it off "
+             "(default: %(default)s).")
+    serve.set_defaults(handler=_serve)
+
+    work = commands.add_parser("work", parents=[metrics_options, resource_options],
+                               help="Convert work units leased from a coordinator.")
+    work.add_argument("url", help=f"Coordinator address, e.g. http://host:{DEFAULT_PORT}/")
+    work.add_argument("--name", default=None, help="Worker name in throughput reports.")
+    work.add_argument("--processes", type=int, default=None, metavar="N",
+                      help="Worker processes on this node.")
+    work.add_argument("--decode-threads", type=int, default=None, metavar="N",
+                      help="libheif decode threads per process.")
+    work.set_defaults(handler=_work)
+
+    thumbnails = commands.add_parser(
+        "thumbnails", help="Manage the persistent preview thumbnail cache.")
+    thumbnail_commands = thumbnails.add_subparsers(dest="thumbnail_command", required=True)
+    prune = thumbnail_commands.add_parser(
+        "prune", help="Remove thumbnails of missing or modified files and enforce the size limit.")
+    prune.add_argument(
+        "--max-size", type=int, default=DEFAULT_MAX_BYTES // 2**20, metavar="MB",
+        help="Evict least recently used thumbnails above this total size (default: %(default)s).")
+    prune.add_argument(
+        "--keep-stale", action="store_true",
+        help="Only enforce the size limit; keep thumbnails of missing or modified files.")
+    prune.add_argument(
+        "--cache-dir", default=None,
+        help="Thumbnail root directory (default: the freedesktop.org location).")
+    prune.set_defaults(handler=_prune_thumbnails)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    pillow_heif.register_heif_opener()
+    return args.handler(args)
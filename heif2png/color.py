@@ -0,0 +1,92 @@
+import hashlib
+import io
+import threading
+
+from PIL import Image, ImageCms
+
+
+SRGB = "sRGB"
+_TRANSFORM_MODES = ("RGB", "RGBA")
+
+
+def _profile_bytes(target: str) -> bytes:
+    if target == SRGB:
+        return ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes()
+    with open(target, "rb") as f:
+        return f.read()
+
+
+class TransformCache:
+    # Building a littleCMS transform costs far more than applying it to a photo,
+    # and a batch from one camera nearly always shares a single embedded profile
+    # (Display P3 for iPhones). Transforms are therefore built once per distinct
+    # source profile, keyed by a hash of its bytes, and reused for every file.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._transforms = {}
+        self._targets = {}
+        self.builds = 0
+        self.hits = 0
+
+    def target_profile(self, target: str) -> bytes:
+        with self._lock:
+            if target not in self._targets:
+                self._targets[target] = _profile_bytes(target)
+            return self._targets[target]
+
+    def get(self, source_profile: bytes, target: str, mode: str):
+        key = (hashlib.sha256(source_profile).digest(), target, mode)
+        with self._lock:
+            transform = self._transforms.get(key)
+            if transform is not None:
+                self.hits += 1
+                return transform
+        target_profile = self.target_profile(target)
+        transform = ImageCms.buildTransform(
+            ImageCms.ImageCmsProfile(io.BytesIO(source_profile)),
+            ImageCms.ImageCmsProfile(io.BytesIO(target_profile)),
+            mode, mode, ImageCms.Intent.PERCEPTUAL)
+        with self._lock:
+            self._transforms.setdefault(key, transform)
+            self.builds += 1
+        return transform
+
+    def clear(self) -> None:
+        with self._lock:
+            self._transforms.clear()
+            self._targets.clear()
+
+
+transform_cache = TransformCache()
+
+
+def profile_converter(source_profile: bytes | None, target: str):
+    # Returns a function converting images tagged with source_profile to the
+    # target profile in place, or None when no conversion is needed. Images
+    # without an embedded profile are treated as sRGB already.
+    if not source_profile:
+        return None
+    if source_profile == transform_cache.target_profile(target):
+        return None
+
+    def convert(pil_image: Image.Image) -> Image.Image:
+        if pil_image.mode not in _TRANSFORM_MODES:
+            return pil_image  # Grayscale sources carry gray profiles; leave them alone
+        transform = transform_cache.get(source_profile, target, pil_image.mode)
+        ImageCms.applyTransform(pil_image, transform, inPlace=True)
+        return pil_image
+
+    return convert
+
+
+def convert_to_profile(pil_image: Image.Image, target: str) -> Image.Image:
+    # Returns a converted copy; the source may be shared through the decoded
+    # image cache and is never modified.
+    source_profile = pil_image.info.get("icc_profile")
+    if profile_converter(source_profile, target) is None or pil_image.mode not in _TRANSFORM_MODES:
+        return pil_image
+    transform = transform_cache.get(source_profile, target, pil_image.mode)
+    converted = ImageCms.applyTransform(pil_image, transform)
+    converted.info = dict(pil_image.info, icc_profile=transform_cache.target_profile(target))
+    return converted
@@ -0,0 +1,350 @@
+import os
+import posixpath
+from dataclasses import asdict, dataclass, field
+
+from PIL import Image
+
+from heif2png import animation, archives, color, metrics, pixels, png, streaming, verify
+from heif2png.cache import decoded_images
+
+
+OUTPUT_FORMATS = ("png", "jpeg", "webp")
+DEFAULT_QUALITY = {"jpeg": 95, "webp": 90}
+CONVERTED_FOLDER_NAME = "Converted Files"
+# Sources at least this large (e.g. stitched panoramas stored as HEIF grids)
+# are written through heif2png.streaming instead of a full Pillow decode.
+STREAMING_MIN_PIXELS = 100_000_000
+# Full-size PNGs at least this large are deflated on several threads
+PARALLEL_PNG_MIN_PIXELS = 16_000_000
+
+
+@dataclass(frozen=True)
+class Rendition:
+    format: str  # "png", "jpeg" or "webp"
+    max_dimension: int | None = None  # Longest edge in pixels, None keeps the source size
+    quality: int | None = None  # None uses DEFAULT_QUALITY for the format
+
+    def output_name(self, file_root: str) -> str:
+        if self.max_dimension is None:
+            return f"{file_root}.{self.format}"
+        return f"{file_root}_{self.max_dimension}.{self.format}"
+
+
+@dataclass(frozen=True)
+class ConversionOptions:
+    renditions: tuple[Rendition, ...] = field(
+        default_factory=lambda: (Rendition("png"),))
+    replace_original: bool = True
+    maintain_metadata: bool = True
+    streaming_min_pixels: int | None = STREAMING_MIN_PIXELS  # None disables streaming
+    parallel_png_min_pixels: int | None = PARALLEL_PNG_MIN_PIXELS  # None disables it
+    png_threads: int | None = None  # None uses every core
+    png_chunk_size: int = png.DEFAULT_CHUNK_SIZE
+    color_target: str | None = None  # color.SRGB or an ICC file path; None keeps the source profile
+    matte_color: tuple[int, int, int] = pixels.DEFAULT_MATTE  # Background for alpha in JPEG
+    animate_sequences: bool = False  # Multi-image files become animated WEBP/APNG
+    verify_outputs: bool = False  # Results carry fingerprints for heif2png.verify
+
+
+def options_to_json(options: ConversionOptions) -> dict:
+    # For options that cross a process or machine boundary, or are saved
+    return asdict(options)
+
+
+def options_from_json(data: dict) -> ConversionOptions:
+    data = dict(data)
+    data["renditions"] = tuple(Rendition(**rendition) for rendition in data["renditions"])
+    data["matte_color"] = tuple(data["matte_color"])
+    return ConversionOptions(**data)
+
+
+def parse_renditions(spec: str) -> list[Rendition]:
+    # Comma separated "format[:max_dimension[:quality]]" entries, e.g. "jpeg:2048:85, webp:512".
+    # An empty or "full" dimension keeps the source size.
+    renditions = []
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        parts = [part.strip() for part in entry.split(":")]
+        if len(parts) > 3:
+            raise ValueError(f"Too many fields in rendition '{entry}'")
+
+        output_format = parts[0].lower()
+        if output_format == "jpg":
+            output_format = "jpeg"
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported format '{parts[0]}' in rendition '{entry}'")
+
+        max_dimension = None
+        if len(parts) > 1 and parts[1] and parts[1].lower() != "full":
+            if not parts[1].isdigit() or int(parts[1]) <= 0:
+                raise ValueError(f"Invalid size '{parts[1]}' in rendition '{entry}'")
+            max_dimension = int(parts[1])
+
+        quality = None
+        if len(parts) > 2 and parts[2]:
+            if not parts[2].isdigit() or not 1 <= int(parts[2]) <= 100:
+                raise ValueError(f"Invalid quality '{parts[2]}' in rendition '{entry}'")
+            quality = int(parts[2])
+
+        renditions.append(Rendition(output_format, max_dimension, quality))
+    return renditions
+
+
+def check_renditions(renditions) -> None:
+    # Two renditions writing the same file name would silently overwrite each other
+    names = set()
+    for rendition in renditions:
+        name = rendition.output_name("")
+        if name in names:
+            raise ValueError(
+                f"Duplicate rendition: {rendition.format} at "
+                f"{rendition.max_dimension or 'full size'}")
+        names.add(name)
+
+
+def output_directory(file_path: str, replace_original: bool, archive_output: bool = False) -> str:
+    # Archive members cannot be replaced in place. Their outputs go into a new
+    # ZIP next to the archive when archive_output is set, otherwise into
+    # "Converted Files/<archive name>" beside it, keeping the member folders.
+    member = archives.split_member_path(file_path)
+    if member is not None:
+        archive_path, name = member
+        member_dir = posixpath.dirname(name)
+        if archive_output:
+            return archives.member_path(archives.output_archive_path(archive_path), member_dir)
+        return os.path.join(os.path.dirname(archive_path), CONVERTED_FOLDER_NAME,
+                            archives.archive_stem(archive_path), *member_dir.split("/"))
+    dir_name = os.path.dirname(file_path)
+    if replace_original:
+        return dir_name
+    return os.path.join(dir_name, CONVERTED_FOLDER_NAME)
+
+
+def _target_size(size, max_dimension):
+    width, height = size
+    longest = max(width, height)
+    if max_dimension is None or longest <= max_dimension:
+        return size
+    scale = max_dimension / longest
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _metadata_options(info, maintain_metadata):
+    metadata_options = {}
+    if maintain_metadata:
+        exif_data = info.get('exif')
+        icc_profile = info.get('icc_profile')
+        if exif_data:
+            metadata_options['exif'] = exif_data
+        if icc_profile:
+            metadata_options['icc_profile'] = icc_profile
+    return metadata_options
+
+
+def _largest_first(renditions):
+    return sorted(
+        renditions,
+        key=lambda r: -(r.max_dimension if r.max_dimension is not None else float("inf")))
+
+
+def _use_parallel_png(size, options):
+    return options.parallel_png_min_pixels is not None and options.png_threads != 1 \
+        and size[0] * size[1] >= options.parallel_png_min_pixels
+
+
+def _write_renditions(pil_image, renditions, output_dir, file_root, metadata_options,
+                      options, fingerprints):
+    output_paths = []
+    current = pil_image
+    for rendition in _largest_first(renditions):
+        size = _target_size(current.size, rendition.max_dimension)
+        if size != current.size:
+            current = current.resize(
+                size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+        save_options = dict(metadata_options)
+        quality = rendition.quality or DEFAULT_QUALITY.get(rendition.format)
+        if quality is not None:
+            save_options['quality'] = quality
+
+        output_path = os.path.join(output_dir, rendition.output_name(file_root))
+        prepared = pixels.prepare_pixels(current, rendition.format, options.matte_color)
+        with archives.open_output(output_path) as fp:
+            if rendition.format == "png" and _use_parallel_png(prepared.size, options):
+                png.save_png_parallel(
+                    prepared, fp, threads=options.png_threads,
+                    chunk_size=options.png_chunk_size,
+                    icc_profile=save_options.get('icc_profile'),
+                    exif=save_options.get('exif'))
+            else:
+                prepared.save(fp, rendition.format.upper(), **save_options)
+        output_paths.append(output_path)
+        if fingerprints is not None:
+            fingerprints.append(verify.fingerprint(prepared, rendition.format))
+    return output_paths
+
+
+def _convert_streamed(file_path, renditions, output_dir, file_root, options, fingerprints):
+    # Full-size PNG is encoded strip by strip straight from libheif's buffer and
+    # full-size JPEG is flattened strip by strip, so neither holds a second
+    # decoded copy next to the canvas. Any other rendition needs a whole Pillow
+    # image, which is built once after the streamed outputs are written.
+    with metrics.stage("decode"):
+        canvas = streaming.DecodedCanvas(file_path)
+    if options.color_target and canvas.mode in ("RGB", "RGBA"):
+        canvas.pixel_transform = color.profile_converter(
+            canvas.info.get('icc_profile'), options.color_target)
+        if canvas.pixel_transform:
+            canvas.info['icc_profile'] = color.transform_cache.target_profile(
+                options.color_target)
+    metadata_options = _metadata_options(canvas.info, options.maintain_metadata)
+
+    streamed = [rendition for rendition in renditions if rendition.format in ("png", "jpeg")
+                and _target_size(canvas.size, rendition.max_dimension) == canvas.size]
+    remaining = [rendition for rendition in renditions if rendition not in streamed]
+    # JPEGs last: flattening makes a full-size copy, and the last one lets
+    # the canvas go before it is encoded
+    streamed.sort(key=lambda rendition: rendition.format == "jpeg")
+    output_paths = []
+    pil_image = None
+    for number, rendition in enumerate(streamed):
+        output_path = os.path.join(output_dir, rendition.output_name(file_root))
+        if rendition.format == "png":
+            # Only the strips ever exist, so the thumbnail is built from them
+            thumbnail = None
+            if fingerprints is not None:
+                thumbnail = verify.StripThumbnail(canvas.size, png.png_mode(canvas.mode))
+            streaming.write_png(
+                canvas, output_path,
+                metadata_options.get('icc_profile'), metadata_options.get('exif'),
+                threads=options.png_threads if _use_parallel_png(canvas.size, options) else 1,
+                chunk_size=options.png_chunk_size,
+                on_strip=thumbnail.add if thumbnail is not None else None)
+            if thumbnail is not None:
+                fingerprints.append(thumbnail.fingerprint("png"))
+        else:
+            quality = rendition.quality or DEFAULT_QUALITY["jpeg"]
+            flattened = streaming.flatten_for_jpeg(canvas, options.matte_color)
+            if number == len(streamed) - 1:
+                if remaining and canvas.mode == "RGB":
+                    pil_image = flattened  # The very image to_pillow() would make
+                if not remaining or pil_image is not None:
+                    canvas.release()
+                    canvas = None
+            with archives.open_output(output_path) as fp:
+                flattened.save(fp, "JPEG", quality=quality, **metadata_options)
+            if fingerprints is not None:
+                fingerprints.append(verify.fingerprint(flattened, "jpeg"))
+            flattened = None
+        output_paths.append(output_path)
+
+    if remaining and pil_image is None:
+        pil_image = canvas.to_pillow()
+    if canvas is not None:
+        canvas.release()
+    if remaining:
+        output_paths += _write_renditions(
+            pil_image, remaining, output_dir, file_root, metadata_options, options,
+            fingerprints)
+    return output_paths
+
+
+def _write_animations(file_path, renditions, output_dir, file_root, options, fingerprints):
+    # Each rendition makes its own pass over the frames, decoding one frame at
+    # a time, so memory does not grow with the length of the sequence.
+    output_paths = []
+    for rendition in renditions:
+        frames = animation.HeifFrames(file_path)
+        pixel_transform = None
+        if options.color_target and frames.mode in ("RGB", "RGBA"):
+            pixel_transform = color.profile_converter(
+                frames.info.get('icc_profile'), options.color_target)
+            if pixel_transform:
+                frames.info['icc_profile'] = color.transform_cache.target_profile(
+                    options.color_target)
+        save_options = _metadata_options(frames.info, options.maintain_metadata)
+        quality = rendition.quality or DEFAULT_QUALITY.get(rendition.format)
+        if quality is not None:
+            save_options['quality'] = quality
+
+        output_path = os.path.join(output_dir, rendition.output_name(file_root))
+        animation.write_animation(
+            frames, output_path, rendition.format,
+            _target_size(frames.size, rendition.max_dimension), save_options,
+            options.matte_color, pixel_transform)
+        output_paths.append(output_path)
+        if fingerprints is not None:
+            fingerprints.append(verify.Fingerprint(
+                rendition.format, _target_size(frames.size, rendition.max_dimension),
+                frames=len(frames)))
+    return output_paths
+
+
+class OutputPaths(list):
+    # The paths convert_file wrote, with the metrics.Measurement of the
+    # conversion and, with verify_outputs, a verify.Fingerprint per path
+    # attached; otherwise an ordinary list
+    def __init__(self, paths=(), measurement: metrics.Measurement | None = None,
+                 fingerprints: list | None = None):
+        super().__init__(paths)
+        self.measurement = measurement
+        self.fingerprints = fingerprints
+
+
+def convert_file(file_path: str, output_dir: str, options: ConversionOptions) -> OutputPaths:
+    # Decodes the source once and writes every rendition from it. Renditions are
+    # produced largest first so each downscale starts from the previous, smaller
+    # image instead of the full-resolution decode.
+    fingerprints = [] if options.verify_outputs else None
+    with metrics.measure() as measurement:
+        output_paths = _convert(file_path, output_dir, options, fingerprints)
+    try:
+        measurement.bytes_read = archives.source_size(file_path)
+    except (OSError, KeyError):
+        pass  # Removed while converting; the outputs are still good
+    return OutputPaths(output_paths, measurement, fingerprints)
+
+
+def _convert(file_path, output_dir, options, fingerprints):
+    file_root, _ = os.path.splitext(os.path.basename(file_path))
+    # A file that was just previewed is already decoded; the cached image is
+    # shared with the preview, so everything below leaves it unmodified.
+    pil_image = decoded_images.get(file_path)
+    cached = pil_image is not None
+    if not cached:
+        with metrics.stage("decode"):
+            pil_image = Image.open(archives.open_source(file_path))
+
+    renditions = options.renditions
+    output_paths = []
+    if options.animate_sequences and getattr(pil_image, "n_frames", 1) > 1:
+        animated = [r for r in renditions if r.format in animation.ANIMATED_FORMATS]
+        renditions = [r for r in renditions if r.format not in animation.ANIMATED_FORMATS]
+        if not cached:
+            # The plugin holds the whole file; reopen for the still renditions
+            pil_image.close()
+            pil_image = None
+        output_paths += _write_animations(
+            file_path, animated, output_dir, file_root, options, fingerprints)
+        if not renditions:
+            return output_paths
+        if not cached:
+            with metrics.stage("decode"):
+                pil_image = Image.open(archives.open_source(file_path))
+
+    if not cached:
+        if options.streaming_min_pixels is not None and \
+                pil_image.width * pil_image.height >= options.streaming_min_pixels:
+            pil_image.close()
+            return output_paths + _convert_streamed(
+                file_path, renditions, output_dir, file_root, options, fingerprints)
+        with metrics.stage("decode"):
+            pil_image.load()
+
+    if options.color_target:
+        pil_image = color.convert_to_profile(pil_image, options.color_target)
+    metadata_options = _metadata_options(pil_image.info, options.maintain_metadata)
+    return output_paths + _write_renditions(
+        pil_image, renditions, output_dir, file_root, metadata_options, options, fingerprints)
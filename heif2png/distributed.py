@@ -0,0 +1,340 @@
+import dataclasses
+import itertools
+import json
+import socket
+import threading
+import time
+import urllib.request
+from concurrent.futures import FIRST_COMPLETED, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from heif2png.conversion import ConversionOptions, options_from_json, options_to_json
+from heif2png.governor import ResourceLimits
+from heif2png.metrics import Measurement, conversion_metrics
+from heif2png.progress import ProgressTracker
+from heif2png.workers import Concurrency, ConversionPool
+
+
+# Coordinator/worker protocol: JSON bodies over HTTP.
+#   POST /lease     {"worker"}                              -> a unit, {"wait": s} or {"done": true}
+#   POST /renew     {"worker", "unit", "lease"}             -> {"ok": bool}
+#   POST /complete  {"worker", "unit", "lease", "results", "seconds"} -> {"ok": bool}
+#                   (results: {"outputs", "bytes", "output_bytes", "stages"} or {"error"}
+#                   per file; stages holds seconds per metrics.STAGES)
+#   GET  /status                                            -> progress and per-node throughput
+# Paths are sent as they are, so every node must see the sources and output
+# folders under the same paths (a shared or network file system).
+DEFAULT_PORT = 8765
+DEFAULT_UNIT_SIZE = 16  # Files per work unit
+DEFAULT_LEASE_SECONDS = 120.0  # A unit is re-issued when its lease is not renewed in time
+_RETRY_SECONDS = 2.0  # How long a worker waits when every remaining unit is leased
+_POLL_SECONDS = 0.5
+
+
+@dataclasses.dataclass
+class WorkUnit:
+    id: int
+    jobs: list  # (file_path, output_dir)
+    lease: int | None = None
+    worker: str | None = None
+    expires: float = 0.0
+    attempts: int = 0
+    results: list | None = None  # One {"outputs"} or {"error"} per job once complete
+
+
+@dataclasses.dataclass
+class NodeStats:
+    files: int = 0
+    errors: int = 0
+    units: int = 0
+    busy_seconds: float = 0.0
+    last_seen: float = 0.0
+
+    @property
+    def files_per_minute(self) -> float:
+        return self.files * 60 / self.busy_seconds if self.busy_seconds > 0 else 0.0
+
+
+class Coordinator:
+    # Splits (file_path, output_dir) jobs into work units and leases them to
+    # workers. A unit whose lease is neither renewed nor completed in time goes
+    # back to the queue; a late result for it is still accepted if the unit
+    # has not been completed by another worker in the meantime.
+
+    def __init__(self, jobs, options: ConversionOptions, unit_size: int = DEFAULT_UNIT_SIZE,
+                 lease_seconds: float = DEFAULT_LEASE_SECONDS, clock=time.monotonic):
+        jobs = list(jobs)
+        self.options = options
+        self.lease_seconds = lease_seconds
+        self.clock = clock
+        self.units = [WorkUnit(number, jobs[start:start + unit_size])
+                      for number, start in enumerate(range(0, len(jobs), unit_size))]
+        self.nodes: dict[str, NodeStats] = {}
+        self.progress = ProgressTracker(len(jobs))
+        self.reissued = 0
+        self._lock = threading.Lock()
+        self._leases = itertools.count(1)
+        self._finished = threading.Event()
+        self._server = None
+        if not self.units:
+            self._finished.set()
+
+    def _node(self, worker: str) -> NodeStats:
+        node = self.nodes.setdefault(worker, NodeStats())
+        node.last_seen = self.clock()
+        return node
+
+    def lease(self, worker: str) -> dict:
+        with self._lock:
+            self._node(worker)
+            now = self.clock()
+            pending = [unit for unit in self.units if unit.results is None]
+            if not pending:
+                return {"done": True}
+            for unit in pending:
+                if unit.lease is not None and unit.expires > now:
+                    continue
+                if unit.lease is not None:
+                    self.reissued += 1
+                unit.lease = next(self._leases)
+                unit.worker = worker
+                unit.expires = now + self.lease_seconds
+                unit.attempts += 1
+                return {"unit": unit.id, "lease": unit.lease, "jobs": unit.jobs,
+                        "lease_seconds": self.lease_seconds,
+                        "options": options_to_json(self.options)}
+            # Back as soon as the first lease runs out
+            return {"wait": min(_RETRY_SECONDS, min(unit.expires for unit in pending) - now)}
+
+    def _unit(self, unit_id):
+        if not isinstance(unit_id, int) or not 0 <= unit_id < len(self.units):
+            return None
+        return self.units[unit_id]
+
+    def renew(self, worker: str, unit_id: int, lease: int) -> bool:
+        with self._lock:
+            self._node(worker)
+            unit = self._unit(unit_id)
+            if unit is None or unit.results is not None or unit.lease != lease:
+                return False
+            unit.expires = self.clock() + self.lease_seconds
+            return True
+
+    def complete(self, worker: str, unit_id: int, lease: int, results: list,
+                 seconds: float) -> bool:
+        with self._lock:
+            node = self._node(worker)
+            unit = self._unit(unit_id)
+            if unit is None or unit.results is not None or len(results) != len(unit.jobs):
+                return False
+            unit.results = results
+            unit.lease = None
+            node.units += 1
+            node.files += len(results)
+            node.errors += sum(1 for result in results if "error" in result)
+            node.busy_seconds += max(0.0, seconds)
+            self.progress.advance(
+                len(results), sum(result.get("bytes", 0) for result in results),
+                sum(1 for result in results if "error" in result))
+            formats = [rendition.format for rendition in self.options.renditions]
+            for result in results:
+                if "error" in result:
+                    conversion_metrics.record(formats, failed=True)
+                else:
+                    conversion_metrics.record(formats, Measurement(
+                        dict(result.get("stages", {})), result.get("bytes", 0),
+                        result.get("output_bytes", 0)))
+            if all(unit.results is not None for unit in self.units):
+                self._finished.set()
+            return True
+
+    def status(self) -> dict:
+        with self._lock:
+            completed = [unit for unit in self.units if unit.results is not None]
+            return {
+                "units": len(self.units),
+                "completed_units": len(completed),
+                "leased_units": sum(1 for unit in self.units
+                                    if unit.results is None and unit.lease is not None),
+                "files": sum(len(unit.jobs) for unit in self.units),
+                "completed_files": sum(len(unit.jobs) for unit in completed),
+                "reissued": self.reissued,
+                "progress": dataclasses.asdict(self.progress.snapshot()),
+                "nodes": {name: {**dataclasses.asdict(node),
+                                 "files_per_minute": round(node.files_per_minute, 1)}
+                          for name, node in self.nodes.items()},
+            }
+
+    def waiting_files(self) -> int:
+        # Files in units that are neither complete nor under a valid lease
+        with self._lock:
+            now = self.clock()
+            return sum(len(unit.jobs) for unit in self.units
+                       if unit.results is None and (unit.lease is None or unit.expires <= now))
+
+    def results(self):
+        # Yields (file_path, output paths or None, error message or None) for
+        # every completed job
+        with self._lock:
+            units = [unit for unit in self.units if unit.results is not None]
+        for unit in units:
+            for (file_path, _), result in zip(unit.jobs, unit.results):
+                yield file_path, result.get("outputs"), result.get("error")
+
+    @property
+    def finished(self) -> bool:
+        return self._finished.is_set()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        return self._finished.wait(timeout)
+
+    def serve(self, host: str = "127.0.0.1", port: int = DEFAULT_PORT) -> tuple[str, int]:
+        # Starts the HTTP server on a background thread and returns its address;
+        # port 0 picks a free port
+        self._server = ThreadingHTTPServer((host, port), _CoordinatorHandler)
+        self._server.daemon_threads = True
+        self._server.coordinator = self
+        threading.Thread(target=self._server.serve_forever, name="coordinator",
+                         daemon=True).start()
+        return self._server.server_address[:2]
+
+    def shutdown(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class _CoordinatorHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass  # Workers poll constantly; per-request logging would drown the output
+
+    def _reply(self, status: int, body: dict) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/status":
+            self._reply(200, self.server.coordinator.status())
+        else:
+            self._reply(404, {"error": f"Unknown path '{self.path}'"})
+
+    def do_POST(self):
+        coordinator = self.server.coordinator
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            worker = str(request["worker"])
+            if self.path == "/lease":
+                body = coordinator.lease(worker)
+            elif self.path == "/renew":
+                body = {"ok": coordinator.renew(worker, request["unit"], request["lease"])}
+            elif self.path == "/complete":
+                body = {"ok": coordinator.complete(
+                    worker, request["unit"], request["lease"], request["results"],
+                    float(request.get("seconds", 0.0)))}
+            else:
+                self._reply(404, {"error": f"Unknown path '{self.path}'"})
+                return
+        except (ValueError, KeyError, TypeError) as e:
+            self._reply(400, {"error": f"Bad request: {type(e).__name__}: {e}"})
+            return
+        self._reply(200, body)
+
+
+def _post(url: str, path: str, body: dict, timeout: float = 30.0) -> dict:
+    request = urllib.request.Request(
+        url.rstrip("/") + path, data=json.dumps(body).encode(),
+        headers={"Content-Type": "application/json"}, method="POST")
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.load(response)
+
+
+def default_worker_name() -> str:
+    return f"{socket.gethostname()}:{threading.get_native_id()}"
+
+
+class Worker:
+    # Leases units from a coordinator, converts them with a ConversionPool and
+    # reports the results. The lease is renewed while a unit is converting, so
+    # only a worker that stopped responding loses its unit. limits sets the
+    # priority, cores and write rate of the node's pool.
+
+    def __init__(self, url: str, name: str | None = None,
+                 concurrency: Concurrency | None = None,
+                 limits: ResourceLimits = ResourceLimits()):
+        self.url = url
+        self.name = name or default_worker_name()
+        self.limits = limits
+        self.concurrency = limits.cap(concurrency or Concurrency())
+        self.files = 0
+        self.units = 0
+        self._stop = threading.Event()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _convert_unit(self, pool, unit: dict, options) -> list:
+        futures = {pool.submit(file_path, output_dir, options): index
+                   for index, (file_path, output_dir) in enumerate(unit["jobs"])}
+        results = [None] * len(futures)
+        renew_every = unit["lease_seconds"] / 3
+        renewed = time.monotonic()
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=_POLL_SECONDS, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    outputs = future.result()
+                    measurement = outputs.measurement
+                    results[futures[future]] = {
+                        "outputs": list(outputs), "bytes": measurement.bytes_read,
+                        "output_bytes": measurement.bytes_written, "stages": measurement.seconds}
+                except Exception as e:
+                    results[futures[future]] = {"error": f"{type(e).__name__}: {e}"}
+            if pending and time.monotonic() - renewed >= renew_every:
+                renewed = time.monotonic()
+                try:
+                    _post(self.url, "/renew",
+                          {"worker": self.name, "unit": unit["unit"], "lease": unit["lease"]})
+                except OSError as e:
+                    # A missed renewal only risks the unit being handed out
+                    # again; giving up would throw away the files done so far
+                    print(f"Warning: Could not renew the lease of unit {unit['unit']}: {e}")
+        return results
+
+    def run(self) -> int:
+        # Works until the coordinator has no units left or stop() is called;
+        # returns the number of files converted
+        pool = ConversionPool(self.concurrency, self.limits)
+        try:
+            pool.warm_up()
+            while not self._stop.is_set():
+                reply = _post(self.url, "/lease", {"worker": self.name})
+                if reply.get("done"):
+                    break
+                if "wait" in reply:
+                    self._stop.wait(max(0.1, reply["wait"]))
+                    continue
+                start = time.monotonic()
+                results = self._convert_unit(pool, reply, options_from_json(reply["options"]))
+                _post(self.url, "/complete", {
+                    "worker": self.name, "unit": reply["unit"], "lease": reply["lease"],
+                    "results": results, "seconds": time.monotonic() - start})
+                self.units += 1
+                self.files += len(results)
+        finally:
+            pool.shutdown()
+        return self.files
+
+
+def status(url: str) -> dict:
+    with urllib.request.urlopen(url.rstrip("/") + "/status", timeout=30.0) as response:
+        return json.load(response)
+
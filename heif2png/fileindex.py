@@ -0,0 +1,186 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import compress
+from typing import NamedTuple
+
+from PIL import ExifTags, Image
+
+from heif2png.archives import open_source, source_size
+
+
+DEFAULT_WORKERS = 4
+CHUNK_SIZE = 256  # Files read per background task
+NAME = "name"
+SIZE = "size"
+CAPTURE_DATE = "capture date"
+DIMENSIONS = "dimensions"
+SORT_KEYS = (NAME, SIZE, CAPTURE_DATE, DIMENSIONS)
+
+
+class FileInfo(NamedTuple):
+    # A named tuple rather than a frozen dataclass: a restored session
+    # creates one per file, and tuples are several times faster to create
+    size: int | None = None  # Bytes
+    capture_date: str | None = None  # EXIF "YYYY:MM:DD HH:MM:SS", which sorts as text
+    width: int | None = None
+    height: int | None = None
+
+    @property
+    def pixels(self) -> int | None:
+        return self.width * self.height if self.width is not None else None
+
+
+def _exif_date(exif) -> str | None:
+    value = exif.get_ifd(ExifTags.IFD.Exif).get(ExifTags.Base.DateTimeOriginal) or \
+        exif.get(ExifTags.Base.DateTime)
+    if isinstance(value, bytes):
+        value = value.decode("ascii", "replace")
+    value = str(value or "").strip("\0 ")
+    return value or None
+
+
+def read_info(path: str) -> FileInfo:
+    # Only the header is parsed; nothing is decoded. Whatever cannot be read
+    # stays None.
+    try:
+        size = source_size(path)
+    except (OSError, KeyError):
+        return FileInfo()
+    try:
+        with Image.open(open_source(path)) as pil_image:
+            return FileInfo(size, _exif_date(pil_image.getexif()), *pil_image.size)
+    except Exception:
+        return FileInfo(size)
+
+
+class FileIndex:
+    # Size, capture date and dimensions of the files in the list, read from
+    # their headers on background threads, and the list's order sorted by
+    # any of them and filtered by name. Each sort order is computed when it
+    # is first needed and cached until resort() is called, so typing in the
+    # filter only scans the lowercased names, even while headers are still
+    # being read; a query that extends the previous one only scans the
+    # previous matches. Files without the sort value yet come last, in name
+    # order. Facts already read are kept when the list changes.
+
+    def __init__(self, workers: int = DEFAULT_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="file-index")
+        self._lock = threading.Lock()
+        self._known = {}  # path -> FileInfo
+        self._generation = 0
+        self.paths = []
+        self._names = []  # Lowercased file names
+        self._infos = []  # FileInfo or None per path
+        self.indexed = 0  # Paths whose FileInfo is known
+        self._orders = {}  # (key, descending) -> (indexed when built, rows, their names)
+        self._filtered = None  # (query, rows it filtered, matching rows, their names)
+
+    def set_paths(self, paths) -> None:
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+            self.paths = list(paths)
+            self._names = [os.path.basename(path).lower() for path in self.paths]
+            self._infos = [self._known.get(path) for path in self.paths]
+            self.indexed = sum(1 for info in self._infos if info is not None)
+            self._orders = {}
+            self._filtered = None
+            missing = [index for index, info in enumerate(self._infos) if info is None]
+        for start in range(0, len(missing), CHUNK_SIZE):
+            self._executor.submit(self._read, generation, self.paths,
+                                  missing[start:start + CHUNK_SIZE])
+
+    def restore(self, paths, infos) -> None:
+        # Facts read in an earlier run (None where none were), so that
+        # set_paths does not read those files again
+        with self._lock:
+            # FileInfo tuples are never empty, so compress drops only the Nones
+            self._known.update(zip(compress(paths, infos), compress(infos, infos)))
+
+    def snapshot(self) -> tuple[list, list]:
+        # The paths and their FileInfo or None, as lists that do not change
+        with self._lock:
+            return self.paths, list(self._infos)
+
+    def _read(self, generation: int, paths: list, indexes: list) -> None:
+        for index in indexes:
+            if generation != self._generation:
+                return  # The list changed; its own tasks read what is missing
+            info = read_info(paths[index])
+            with self._lock:
+                self._known[paths[index]] = info
+                if generation == self._generation:
+                    self._infos[index] = info
+                    self.indexed += 1
+
+    @property
+    def complete(self) -> bool:
+        return self.indexed == len(self.paths)
+
+    def info(self, index: int) -> FileInfo | None:
+        return self._infos[index]
+
+    def _values(self, key: str) -> list:
+        infos = self._infos
+        if key == SIZE:
+            return [info.size if info else None for info in infos]
+        if key == CAPTURE_DATE:
+            return [info.capture_date if info else None for info in infos]
+        return [info.pixels if info else None for info in infos]
+
+    def order(self, key: str = NAME, descending: bool = False) -> list[int]:
+        # Indexes of all paths in sort order
+        return self._order(key, descending)[1]
+
+    def resort(self) -> None:
+        # Drops the orders built before the latest headers were read, so they
+        # are sorted again when next needed
+        with self._lock:
+            self._orders = {order_key: cached for order_key, cached in self._orders.items()
+                            if order_key[0] == NAME or cached[0] == self.indexed}
+
+    def _order(self, key: str, descending: bool) -> tuple:
+        cached = self._orders.get((key, descending))
+        if cached is not None:
+            return cached
+        indexed = self.indexed
+        if key == NAME:
+            names = self._names
+            rows = sorted(range(len(names)), key=names.__getitem__)
+            if descending:
+                rows.reverse()
+        else:
+            by_name = self.order(NAME)
+            # Sorting is stable, also reversed, so equal values stay in name order
+            values = self._values(key)
+            rows = [index for index in by_name if values[index] is not None]
+            rows.sort(key=values.__getitem__, reverse=descending)
+            rows += [index for index in by_name if values[index] is None]
+        names = self._names
+        # The names in the same order, so filtering needs no lookups
+        cached = self._orders[(key, descending)] = (indexed, rows, [names[index] for index in rows])
+        return cached
+
+    def rows(self, query: str = "", key: str = NAME, descending: bool = False) -> list[int]:
+        # Indexes of the paths whose file name contains query, in sort order
+        _, order, names = self._order(key, descending)
+        query = query.strip().lower()
+        if not query:
+            return order
+        if self._filtered is not None and self._filtered[1] is order and \
+                self._filtered[0] in query:
+            _, _, order, names = self._filtered
+        matches = [query in name for name in names]
+        if all(matches):
+            rows = order  # Nothing filtered out, as typing a common prefix
+        else:
+            rows = list(compress(order, matches))
+            names = list(compress(names, matches))
+        self._filtered = (query, self._order(key, descending)[1], rows, names)
+        return rows
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._generation += 1
+        self._executor.shutdown(wait=False, cancel_futures=True)
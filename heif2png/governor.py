@@ -0,0 +1,304 @@
+import ctypes
+import ctypes.util
+import os
+import platform
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass, fields, replace
+
+
+NORMAL = "normal"
+LOW = "low"  # Lowest level of the normal IO class
+IDLE = "idle"  # Disk access only when nothing else wants the disk
+IO_PRIORITIES = (NORMAL, LOW, IDLE)
+BACKGROUND_NICENESS = 10
+DEFAULT_MAX_LOAD = 1.0  # Load average per core
+DEFAULT_MIN_FREE_MEMORY = 10.0  # Percent of physical memory available
+SAMPLE_INTERVAL = 1.0  # Seconds between samples of the system load
+WRITE_BURST_SECONDS = 0.25  # Writes within this much of the limit go through at once
+LOAD = "load"  # Pressure of other work on the cores
+MEMORY = "memory"  # Pressure on physical memory
+
+
+@dataclass(frozen=True)
+class ResourceLimits:
+    # How much of the machine a job may take. niceness, io_priority and
+    # max_cores apply to the threads and processes converting its files and
+    # write_limit to the bytes they write; max_load and min_free_memory make
+    # the job hold back new files while the rest of the system is busy.
+    niceness: int = 0  # Added to the workers' niceness; 0 leaves it
+    io_priority: str = NORMAL
+    max_cores: int = 0  # 0 uses every core
+    write_limit: int = 0  # Bytes per second across all workers; 0 for no limit
+    max_load: float = 0.0  # Load average per core, not counting this job; 0 never backs off
+    min_free_memory: float = 0.0  # Percent available; 0 never backs off
+
+    @property
+    def backs_off(self) -> bool:
+        return self.max_load > 0 or self.min_free_memory > 0
+
+    def cap(self, concurrency):
+        # concurrency (a workers.Concurrency) within max_cores
+        if not self.max_cores:
+            return concurrency
+        return replace(concurrency, processes=min(concurrency.processes, self.max_cores),
+                       decode_threads=min(concurrency.decode_threads, self.max_cores))
+
+    def cap_options(self, options):
+        # conversion.ConversionOptions whose parallel PNG encoding stays within max_cores
+        if not self.max_cores:
+            return options
+        return replace(options, png_threads=min(options.png_threads or self.max_cores,
+                                                self.max_cores))
+
+
+BACKGROUND = ResourceLimits(niceness=BACKGROUND_NICENESS, io_priority=IDLE,
+                            max_load=DEFAULT_MAX_LOAD, min_free_memory=DEFAULT_MIN_FREE_MEMORY)
+
+
+def limits_to_json(limits: ResourceLimits) -> dict:
+    return asdict(limits)
+
+
+def limits_from_json(data: dict | None) -> ResourceLimits:
+    # Unknown keys, from a newer version, are ignored
+    names = {field.name for field in fields(ResourceLimits)}
+    return ResourceLimits(**{key: value for key, value in (data or {}).items() if key in names})
+
+
+def parse_rate(text: str) -> int:
+    # Bytes per second from "500K", "20M", "1.5G" or a plain number of bytes
+    text = text.strip().upper().removesuffix("/S").removesuffix("B")
+    scale = {"K": 2**10, "M": 2**20, "G": 2**30}.get(text[-1:], 1)
+    if scale > 1:
+        text = text[:-1]
+    try:
+        rate = float(text) * scale
+    except ValueError:
+        raise ValueError(f"Invalid rate '{text}'") from None
+    if rate < 0:
+        raise ValueError(f"Invalid rate '{text}'")
+    return int(rate)
+
+
+# ioprio_set(2) system call numbers; glibc has no wrapper
+_IOPRIO_SET = {"x86_64": 251, "amd64": 251, "aarch64": 30, "arm64": 30,
+               "i386": 289, "i686": 289, "armv7l": 314, "ppc64le": 273, "riscv64": 30}
+_IOPRIO_CLASS_BE = 2
+_IOPRIO_CLASS_IDLE = 3
+_IOPRIO_CLASS_SHIFT = 13
+_IOPRIO_WHO_PROCESS = 1
+# Windows priorities
+_BELOW_NORMAL_PRIORITY_CLASS = 0x4000
+_IDLE_PRIORITY_CLASS = 0x40
+_PROCESS_MODE_BACKGROUND_BEGIN = 0x100000
+_THREAD_PRIORITY_BELOW_NORMAL = -1
+_THREAD_PRIORITY_IDLE = -15
+_THREAD_MODE_BACKGROUND_BEGIN = 0x10000
+# macOS setiopolicy_np(3)
+_IOPOL_TYPE_DISK = 0
+_IOPOL_SCOPE_PROCESS = 0
+_IOPOL_SCOPE_THREAD = 1
+_IOPOL_THROTTLE = 3
+_IOPOL_UTILITY = 4
+
+
+def _libc():
+    return ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+
+
+def _check(result: int) -> None:
+    if result == -1:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+
+
+def _lower_windows(limits: ResourceLimits, whole_process: bool) -> None:
+    kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    if whole_process:
+        if limits.niceness:
+            kernel32.SetPriorityClass(kernel32.GetCurrentProcess(),
+                                      _IDLE_PRIORITY_CLASS if limits.niceness >= 15
+                                      else _BELOW_NORMAL_PRIORITY_CLASS)
+        if limits.io_priority != NORMAL:
+            # Also lowers the CPU and memory priority of the whole process
+            kernel32.SetPriorityClass(kernel32.GetCurrentProcess(), _PROCESS_MODE_BACKGROUND_BEGIN)
+    else:
+        if limits.io_priority != NORMAL:
+            kernel32.SetThreadPriority(kernel32.GetCurrentThread(), _THREAD_MODE_BACKGROUND_BEGIN)
+        if limits.niceness:
+            kernel32.SetThreadPriority(kernel32.GetCurrentThread(),
+                                       _THREAD_PRIORITY_IDLE if limits.niceness >= 15
+                                       else _THREAD_PRIORITY_BELOW_NORMAL)
+
+
+def _lower_linux(limits: ResourceLimits) -> None:
+    # Niceness, IO priority and CPU affinity all belong to the calling thread
+    # on Linux, and threads started from it afterwards (libheif's decoders,
+    # the PNG encoder's) inherit them
+    if limits.niceness:
+        os.nice(limits.niceness)
+    if limits.io_priority != NORMAL:
+        number = _IOPRIO_SET.get(platform.machine().lower())
+        if number is None:
+            raise OSError(f"IO priority is not supported on {platform.machine()}")
+        if limits.io_priority == IDLE:
+            value = _IOPRIO_CLASS_IDLE << _IOPRIO_CLASS_SHIFT
+        else:
+            value = _IOPRIO_CLASS_BE << _IOPRIO_CLASS_SHIFT | 7
+        _check(_libc().syscall(number, _IOPRIO_WHO_PROCESS, 0, value))
+    if limits.max_cores:
+        cores = sorted(os.sched_getaffinity(0))
+        os.sched_setaffinity(0, cores[:limits.max_cores])
+
+
+def lower_priority(limits: ResourceLimits, whole_process: bool = False) -> None:
+    # Applies the niceness, IO priority and (on Linux) core limit of limits to
+    # the calling thread, or to the whole process in a worker process. Where
+    # the platform only has them per process (macOS niceness), a thread is
+    # left as it is. Priorities cannot be raised again without privileges,
+    # so this runs in threads and processes that only convert.
+    try:
+        if sys.platform == "win32":
+            _lower_windows(limits, whole_process)
+        elif sys.platform.startswith("linux"):
+            _lower_linux(limits)
+        else:
+            if limits.niceness and whole_process:
+                os.nice(limits.niceness)
+            if limits.io_priority != NORMAL and sys.platform == "darwin":
+                policy = _IOPOL_THROTTLE if limits.io_priority == IDLE else _IOPOL_UTILITY
+                _check(_libc().setiopolicy_np(
+                    _IOPOL_TYPE_DISK, _IOPOL_SCOPE_PROCESS if whole_process else _IOPOL_SCOPE_THREAD,
+                    policy))
+    except (OSError, AttributeError) as e:
+        print(f"Warning: Could not lower the priority of conversion workers: {e}")
+
+
+class WriteThrottle:
+    # Paces the output writes of this process to a number of bytes per
+    # second; heif2png.metrics.MeteredWriter reports every write here, and
+    # the writing thread sleeps once it gets ahead of the rate. Threads
+    # writing at the same time share the rate.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.rate = 0  # Bytes per second; 0 for no limit
+        self._clear = 0.0  # time.monotonic() by which everything written so far is paid for
+
+    def set_rate(self, bytes_per_second: int) -> None:
+        with self._lock:
+            self.rate = max(0, int(bytes_per_second))
+            self._clear = time.monotonic()
+
+    def wrote(self, nbytes: int) -> None:
+        with self._lock:
+            if self.rate <= 0:
+                return
+            now = time.monotonic()
+            self._clear = max(self._clear, now) + nbytes / self.rate
+            delay = self._clear - now - WRITE_BURST_SECONDS
+        if delay > 0:
+            time.sleep(delay)
+
+
+write_throttle = WriteThrottle()
+
+
+def _meminfo_free() -> float | None:
+    values = {}
+    with open("/proc/meminfo", encoding="ascii") as f:
+        for line in f:
+            name, _, rest = line.partition(":")
+            if name in ("MemTotal", "MemAvailable"):
+                values[name] = int(rest.split()[0])
+    if len(values) < 2 or not values["MemTotal"]:
+        return None
+    return 100.0 * values["MemAvailable"] / values["MemTotal"]
+
+
+class _MemoryStatus(ctypes.Structure):
+    _fields_ = [("dwLength", ctypes.c_ulong), ("dwMemoryLoad", ctypes.c_ulong),
+                ("ullTotalPhys", ctypes.c_ulonglong), ("ullAvailPhys", ctypes.c_ulonglong),
+                ("ullTotalPageFile", ctypes.c_ulonglong), ("ullAvailPageFile", ctypes.c_ulonglong),
+                ("ullTotalVirtual", ctypes.c_ulonglong), ("ullAvailVirtual", ctypes.c_ulonglong),
+                ("ullAvailExtendedVirtual", ctypes.c_ulonglong)]
+
+
+def _windows_free() -> float | None:
+    status = _MemoryStatus()
+    status.dwLength = ctypes.sizeof(status)
+    if not ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+        return None
+    return 100.0 * status.ullAvailPhys / status.ullTotalPhys
+
+
+def free_memory() -> float | None:
+    # Percent of physical memory available without swapping, None where unknown
+    try:
+        if sys.platform.startswith("linux"):
+            return _meminfo_free()
+        if sys.platform == "win32":
+            return _windows_free()
+    except (OSError, ValueError, AttributeError):
+        pass
+    return None
+
+
+def load_per_core() -> float | None:
+    # One-minute load average over the machine's cores, None where unknown
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (OSError, AttributeError):
+        return None
+
+
+@dataclass(frozen=True)
+class Pressure:
+    # Why a job holds back new files: LOAD with the load average per core of
+    # everything but the job, or MEMORY with the percent of memory free.
+    # Front ends word it themselves; str() is the English wording.
+    reason: str
+    value: float
+
+    def __str__(self):
+        if self.reason == LOAD:
+            return f"system load {self.value:.1f} per core"
+        return f"{self.value:.0f}% memory free"
+
+
+class LoadMonitor:
+    # Tells a job to hold back new files while the system is under load or
+    # short of memory. The load average includes the job's own converting
+    # files, each running as many threads as its process decodes with; those
+    # are subtracted, so a job does not back off from itself.
+    # The system is sampled at most once per interval.
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self._sampled = None  # time.monotonic() of the last sample
+        self._load = None
+        self._free = None
+
+    def _sample(self) -> None:
+        now = time.monotonic()
+        if self._sampled is None or now - self._sampled >= self.interval:
+            self._sampled = now
+            self._load = load_per_core()
+            self._free = free_memory()
+
+    def pressure(self, limits: ResourceLimits, own_threads: int = 0) -> Pressure | None:
+        # Why the job should back off now, or None. own_threads is the number
+        # of threads the job's busy workers run: processes times decode threads.
+        if not limits.backs_off:
+            return None
+        self._sample()
+        if limits.max_load > 0 and self._load is not None:
+            others = self._load - own_threads / (os.cpu_count() or 1)
+            if others > limits.max_load:
+                return Pressure(LOAD, others)
+        if limits.min_free_memory > 0 and self._free is not None and \
+                self._free < limits.min_free_memory:
+            return Pressure(MEMORY, self._free)
+        return None
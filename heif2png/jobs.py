@@ -0,0 +1,494 @@
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from heif2png import verify
+
+from heif2png.archives import ZIP_EXTENSIONS, archive_outputs, is_member_path
+from heif2png.conversion import ConversionOptions, options_from_json, options_to_json
+from heif2png.governor import (
+    LoadMonitor, Pressure, ResourceLimits, limits_from_json, limits_to_json
+)
+from heif2png.staging import (
+    ALWAYS, NEVER, BulkMover, TransferStats, default_root, is_network_path, staging_directory
+)
+from heif2png.tuning import (TRIAL_FILES, Trial, candidates, image_megapixels, split_sample,
+                             trial_sizes)
+from heif2png.workers import Concurrency, ConversionPool
+
+
+QUEUED = "queued"
+RUNNING = "running"
+PAUSED = "paused"
+CANCELLED = "cancelled"
+DONE = "done"
+SAVE_INTERVAL = 2.0  # Seconds between saves of the queue while files complete
+
+
+def default_path() -> str:
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+        return os.path.join(base, "heif2png", "jobs.json")
+    base = os.environ.get("XDG_STATE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".local", "state")
+    return os.path.join(base, "heif2png", "jobs.json")
+
+
+@dataclass
+class Job:
+    # One batch of (file_path, output_dir) pairs converted with its own options
+    # and resource limits. results maps the index of every finished file to
+    # its error message, or None when it converted; files without an entry
+    # are still to do. staging is a heif2png.staging mode.
+    id: int
+    name: str
+    files: list
+    options: ConversionOptions
+    priority: int = 0
+    state: str = QUEUED
+    profile: str = ""  # tuning.WorkloadProfile key
+    output_folders: list = field(default_factory=list)
+    results: dict = field(default_factory=dict)
+    created: float = field(default_factory=time.time)
+    limits: ResourceLimits = field(default_factory=ResourceLimits)
+    staging: str = NEVER
+
+    @property
+    def remaining(self) -> list[int]:
+        return [index for index in range(len(self.files)) if index not in self.results]
+
+    @property
+    def finished(self) -> bool:
+        return self.state in (DONE, CANCELLED)
+
+    @property
+    def converted(self) -> int:
+        return sum(1 for error in self.results.values() if error is None)
+
+    @property
+    def errors(self) -> int:
+        return len(self.results) - self.converted
+
+    def to_json(self) -> dict:
+        return {
+            "id": self.id, "name": self.name, "files": self.files,
+            "options": options_to_json(self.options), "priority": self.priority,
+            "state": self.state, "profile": self.profile,
+            "output_folders": self.output_folders,
+            "results": {str(index): error for index, error in self.results.items()},
+            "created": self.created, "limits": limits_to_json(self.limits),
+            "staging": self.staging,
+        }
+
+    @classmethod
+    def from_json(cls, data: dict) -> "Job":
+        return cls(
+            id=data["id"], name=data["name"],
+            files=[tuple(pair) for pair in data["files"]],
+            options=options_from_json(data["options"]), priority=data.get("priority", 0),
+            state=data.get("state", QUEUED), profile=data.get("profile", ""),
+            output_folders=data.get("output_folders", []),
+            results={int(index): error for index, error in data.get("results", {}).items()},
+            created=data.get("created", 0.0), limits=limits_from_json(data.get("limits")),
+            staging=data.get("staging", NEVER))
+
+
+class JobQueue:
+    # The jobs of the app and their progress, saved to a JSON file so that
+    # finished work survives a restart. Jobs that were queued or running when
+    # the app closed come back paused and continue with their remaining files
+    # once resumed.
+
+    def __init__(self, path: str | None = None):
+        self.path = path
+        self.jobs: list[Job] = []
+        self._next_id = 1
+        self._saved = 0.0
+
+    def load(self) -> None:
+        if self.path is None:
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            jobs = [Job.from_json(job) for job in data.get("jobs", [])]
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Warning: Could not read job queue {self.path}: {e}")
+            return
+        for job in jobs:
+            if job.state in (QUEUED, RUNNING):
+                job.state = PAUSED
+        self.jobs = jobs
+        self._next_id = max((job.id for job in jobs), default=0) + 1
+
+    def save(self, force: bool = True) -> None:
+        # Unforced saves are skipped within SAVE_INTERVAL of the last one
+        if self.path is None or (not force and time.monotonic() - self._saved < SAVE_INTERVAL):
+            return
+        self._saved = time.monotonic()
+        temp_path = self.path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"jobs": [job.to_json() for job in self.jobs]}, f)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Warning: Could not save job queue {self.path}: {e}")
+
+    def add(self, name: str, files, options: ConversionOptions, priority: int = 0,
+            profile: str = "", output_folders=(), limits: ResourceLimits = ResourceLimits(),
+            staging: str = NEVER) -> Job:
+        job = Job(self._next_id, name, list(files), options, priority, profile=profile,
+                  output_folders=sorted(output_folders), limits=limits, staging=staging)
+        self._next_id += 1
+        self.jobs.append(job)
+        self.save()
+        return job
+
+    def get(self, job_id: int) -> Job | None:
+        return next((job for job in self.jobs if job.id == job_id), None)
+
+    def runnable(self) -> list[Job]:
+        # Highest priority first, then in the order they were added
+        return sorted((job for job in self.jobs if job.state in (QUEUED, RUNNING)),
+                      key=lambda job: (-job.priority, job.id))
+
+    def remove_finished(self) -> None:
+        self.jobs = [job for job in self.jobs if not job.finished]
+        self.save()
+
+
+@dataclass
+class JobEvent:
+    # A file of job finished (index and its output paths or exception), or,
+    # with index None, the job itself finished or was cancelled
+    job: Job
+    index: int | None = None
+    result: object = None
+
+
+class _Calibration:
+    # Trials of every candidate concurrency on a few files of one job, run
+    # one candidate at a time like tuning.BatchRunner does for a whole batch
+    def __init__(self, job: Job, configs, sizes):
+        self.job = job
+        self.configs = configs
+        self.samples = [[job.remaining[i] for i in indexes]
+                        for indexes in split_sample(len(job.remaining), sizes)]
+        self.trials: list[Trial] = []
+        self.started = 0.0
+        self.megapixels = 0.0
+
+    @property
+    def candidate(self) -> Concurrency:
+        return self.configs[len(self.trials)]
+
+    def best(self) -> Concurrency:
+        return max(self.trials, key=lambda trial: trial.throughput).concurrency
+
+
+class JobScheduler:
+    # Runs the files of the queue's jobs on one shared ConversionPool without
+    # blocking: poll() is called periodically (from a QTimer in the app),
+    # collects finished files, submits more and returns what happened. Files
+    # are taken from the highest priority runnable job, so a new urgent job
+    # starts as soon as a worker is free. Pausing or cancelling a job drops its
+    # files that have not started; files already converting finish and are
+    # kept.
+    #
+    # With verify_outputs, a converted file is read back on a verifier thread
+    # while the pool goes on with the next files, and only counts as done
+    # (and its original may only be replaced) once its outputs check out.
+    #
+    # A job's ResourceLimits set the priority, cores and write rate of the
+    # pool converting it (jobs with other limits wait until it is idle), and
+    # while the system is over the job's load or memory thresholds no new
+    # files of it start; backing_off says why.
+    #
+    # Files of a job that stages its outputs convert into a local staging
+    # folder (and are verified there), and a BulkMover takes them to their
+    # destination in batches; a file only counts as done, and its original
+    # may only be replaced, once its outputs have arrived.
+    #
+    # concurrency_for(profile) returns the remembered Concurrency for a
+    # workload profile or None; a job with an unknown profile and enough files
+    # is calibrated first and on_calibrated(profile, concurrency, trials) is
+    # called with the result.
+
+    def __init__(self, queue: JobQueue, concurrency_for=None, on_calibrated=None,
+                 candidate_configs=None, trial_files: int = TRIAL_FILES,
+                 staging_root: str | None = None):
+        self.queue = queue
+        self.concurrency_for = concurrency_for or (lambda profile: None)
+        self.on_calibrated = on_calibrated
+        self.candidates = candidate_configs
+        self.trial_files = trial_files
+        self._known: dict[str, Concurrency] = {}
+        self._pool: ConversionPool | None = None
+        self._in_flight = {}  # future -> (job, index)
+        self._verifier: ThreadPoolExecutor | None = None
+        self._verifying = {}  # verification future -> (job, index)
+        self.staging_root = staging_root
+        self._mover: BulkMover | None = None
+        self._moving = {}  # move future -> (job, index)
+        self._staged = {}  # (job id, index) -> destination of a file converting into staging
+        self._network = {}  # destination -> whether it is on a network file system
+        self._calibration: _Calibration | None = None
+        self._closing: list[Job] = []  # Cancelled jobs waiting for their running files
+        self.monitor = LoadMonitor()
+        self.backing_off: Pressure | None = None  # Why new files are held back, if they are
+
+    @property
+    def busy(self) -> bool:
+        return bool(self._in_flight or self._verifying or self._moving
+                    or self.queue.runnable() or self._closing)
+
+    @property
+    def concurrency(self) -> Concurrency | None:
+        return self._pool.concurrency if self._pool else None
+
+    def in_flight(self, job: Job) -> int:
+        # Files of job converting, being verified or moved
+        return sum(1 for flights in (self._in_flight, self._verifying, self._moving)
+                   for flight_job, _ in flights.values() if flight_job is job)
+
+    def _drop_pending(self, job: Job) -> None:
+        for future, (flight_job, index) in list(self._in_flight.items()):
+            if flight_job is job and future.cancel():
+                del self._in_flight[future]
+                self._staged.pop((job.id, index), None)
+        if self._calibration is not None and self._calibration.job is job:
+            self._calibration = None
+
+    def pause(self, job: Job) -> None:
+        if job.state in (QUEUED, RUNNING):
+            job.state = PAUSED
+            self._drop_pending(job)
+            self.queue.save()
+
+    def resume(self, job: Job) -> None:
+        if job.state == PAUSED:
+            job.state = QUEUED
+            if job.results:
+                # Keeps what a previous session wrote into the job's ZIP files
+                for folder in job.output_folders:
+                    if folder.lower().endswith(ZIP_EXTENSIONS):
+                        archive_outputs.continue_archive(folder)
+            self.queue.save()
+
+    def cancel(self, job: Job) -> None:
+        if not job.finished:
+            job.state = CANCELLED
+            self._drop_pending(job)
+            self._closing.append(job)
+            self.queue.save()
+
+    def set_priority(self, job: Job, priority: int) -> None:
+        job.priority = priority
+        self.queue.save()
+
+    def _use_pool(self, concurrency: Concurrency, limits: ResourceLimits) -> bool:
+        # Pools are only swapped while idle, so running files are never lost
+        if self._pool is not None and self._pool.concurrency == concurrency and \
+                self._pool.limits == limits:
+            return True
+        if self._in_flight:
+            return False
+        if self._pool is not None:
+            self._pool.shutdown()
+        self._pool = ConversionPool(concurrency, limits)
+        self._pool.warm_up()
+        return True
+
+    def transfer_stats(self, job: Job) -> TransferStats:
+        return self._mover.stats(job.id) if self._mover is not None else TransferStats()
+
+    def _stages(self, job: Job, output_dir: str) -> bool:
+        if job.staging == NEVER or is_member_path(output_dir):
+            return False
+        if job.staging == ALWAYS:
+            return True
+        if output_dir not in self._network:
+            self._network[output_dir] = is_network_path(output_dir)
+        return self._network[output_dir]
+
+    def _staging_directory(self, job: Job, output_dir: str) -> str | None:
+        if not self._stages(job, output_dir):
+            return None
+        if self.staging_root is None:
+            self.staging_root = default_root()
+        directory = staging_directory(self.staging_root, job.id, output_dir)
+        try:
+            os.makedirs(directory, exist_ok=True)
+        except OSError as e:
+            print(f"Warning: Could not create staging folder {directory}: {e}")
+            return None
+        return directory
+
+    def _submit(self, job: Job, index: int) -> None:
+        file_path, output_dir = job.files[index]
+        job.state = RUNNING
+        staging_dir = self._staging_directory(job, output_dir)
+        if staging_dir is not None:
+            self._staged[(job.id, index)] = output_dir
+            output_dir = staging_dir
+        self._in_flight[self._pool.submit(file_path, output_dir, job.options)] = (job, index)
+
+    def _verify(self, job: Job, index: int, result) -> None:
+        if self._verifier is None:
+            self._verifier = ThreadPoolExecutor(verify.DEFAULT_THREADS,
+                                                thread_name_prefix="verify")
+        self._verifying[self._verifier.submit(verify.verify_outputs, result)] = (job, index)
+
+    def _deliver(self, events: list, job: Job, index: int, future) -> None:
+        # A converted (and verified) file: staged outputs still have to move
+        destination = self._staged.pop((job.id, index), None)
+        if destination is None or future.cancelled() or future.exception() is not None:
+            self._record(events, job, index, future)
+            return
+        if self._mover is None:
+            self._mover = BulkMover()
+        self._moving[self._mover.move(future.result(), destination, job.id)] = (job, index)
+
+    def _collect(self, events: list) -> None:
+        for future in [future for future in self._in_flight if future.done()]:
+            job, index = self._in_flight.pop(future)
+            if job.options.verify_outputs and not future.cancelled() and \
+                    future.exception() is None:
+                self._verify(job, index, future.result())
+                continue
+            self._deliver(events, job, index, future)
+        for future in [future for future in self._verifying if future.done()]:
+            job, index = self._verifying.pop(future)
+            self._deliver(events, job, index, future)
+        for future in [future for future in self._moving if future.done()]:
+            job, index = self._moving.pop(future)
+            self._record(events, job, index, future)
+
+    def _clean_staging(self, job: Job) -> None:
+        # Outputs of files that failed, or were cancelled while converting
+        if job.staging != NEVER and self.staging_root is not None:
+            shutil.rmtree(os.path.join(self.staging_root, str(job.id)), ignore_errors=True)
+
+    def _record(self, events: list, job: Job, index: int, future) -> None:
+        self._staged.pop((job.id, index), None)
+        try:
+            result = future.result()
+            job.results[index] = None
+        except Exception as e:
+            result = e
+            job.results[index] = f"{type(e).__name__}: {e}"
+        events.append(JobEvent(job, index, result))
+
+    def _calibrate(self) -> None:
+        calibration = self._calibration
+        if self._in_flight or calibration is None:
+            return
+        if calibration.started:
+            calibration.trials.append(Trial(
+                calibration.candidate, len(calibration.samples[len(calibration.trials)]),
+                calibration.megapixels, time.perf_counter() - calibration.started))
+            if len(calibration.trials) == len(calibration.configs):
+                best = calibration.best()
+                self._known[calibration.job.profile] = best
+                self._calibration = None
+                if self.on_calibrated:
+                    self.on_calibrated(calibration.job.profile, best, calibration.trials)
+                return
+        indexes = [index for index in calibration.samples[len(calibration.trials)]
+                   if index not in calibration.job.results]
+        self._use_pool(calibration.candidate, calibration.job.limits)
+        calibration.megapixels = sum(
+            image_megapixels(calibration.job.files[index][0]) for index in indexes)
+        calibration.started = time.perf_counter()
+        for index in indexes:
+            self._submit(calibration.job, index)
+
+    def _concurrency(self, job: Job) -> Concurrency | None:
+        # None while the job's profile is being calibrated
+        concurrency = self._known.get(job.profile) or self.concurrency_for(job.profile)
+        if concurrency is not None:
+            return job.limits.cap(concurrency)
+        configs = self.candidates or candidates()
+        configs = list(dict.fromkeys(job.limits.cap(config) for config in configs))
+        sizes = trial_sizes(configs, self.trial_files)
+        if len(configs) > 1 and len(job.remaining) >= 2 * sum(sizes):
+            self._calibration = _Calibration(job, configs, sizes)
+            return None
+        self._known[job.profile] = Concurrency()
+        return job.limits.cap(self._known[job.profile])
+
+    def _fill(self) -> None:
+        if self._calibration is not None:
+            self.backing_off = None
+            self._calibrate()
+            return
+        for job in self.queue.runnable():
+            running = {index for flights in (self._in_flight, self._verifying, self._moving)
+                       for flight_job, index in flights.values() if flight_job is job}
+            todo = [index for index in job.remaining if index not in running]
+            if not todo:
+                continue
+            concurrency = self._concurrency(job)
+            if concurrency is None:
+                self._calibrate()
+                return
+            if not self._use_pool(concurrency, job.limits):
+                return  # Finishes the files running under another pool first
+            # One queued file per process keeps every worker busy while new
+            # work can still overtake; files being verified leave the pool free
+            capacity = concurrency.processes + 1 - len(self._in_flight)
+            if capacity > 0:
+                busy = min(len(self._in_flight), concurrency.processes)
+                self.backing_off = self.monitor.pressure(
+                    job.limits, busy * concurrency.decode_threads)
+                if self.backing_off is not None:
+                    return
+            for index in todo[:max(0, capacity)]:
+                self._submit(job, index)
+            return
+        self.backing_off = None
+
+    def poll(self) -> list[JobEvent]:
+        events = []
+        self._collect(events)
+        for job in self.queue.jobs:
+            if job.state in (QUEUED, RUNNING) and not job.remaining and not self.in_flight(job):
+                job.state = DONE
+                self._clean_staging(job)
+                events.append(JobEvent(job))
+        for job in [job for job in self._closing if not self.in_flight(job)]:
+            self._closing.remove(job)
+            self._clean_staging(job)
+            events.append(JobEvent(job))
+        self._fill()
+        if self._moving and not self._in_flight and not self._verifying:
+            self._mover.flush()  # Nothing else will fill the batch
+        if events:
+            self.queue.save(force=any(event.index is None for event in events))
+        return events
+
+    def shutdown(self) -> None:
+        for future in self._in_flight:
+            future.cancel()
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        if self._verifier is not None:
+            self._verifier.shutdown(cancel_futures=True)
+            self._verifier = None
+        if self._mover is not None:
+            # Files not moved yet are converted again when their job resumes
+            self._mover.shutdown(wait=False)
+            self._mover = None
+        self._in_flight.clear()
+        self._verifying.clear()
+        self._moving.clear()
+        self._staged.clear()
+        self.queue.save()
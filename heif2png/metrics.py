@@ -0,0 +1,382 @@
+import io
+import math
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import cache
+
+from heif2png.governor import write_throttle
+
+
+DEFAULT_PORT = 9464
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+STAGES = ("decode", "encode", "write")
+# Upper bounds in seconds of the stage latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+@dataclass
+class Measurement:
+    # What one conversion spent in each stage, and how much it read and wrote.
+    # Time in a nested stage (writing while a PNG is being encoded) counts
+    # for that stage only, so the stages add up to the whole conversion.
+    seconds: dict = field(default_factory=dict)
+    bytes_read: int = 0
+    bytes_written: int = 0
+
+
+class _StageClock:
+    def __init__(self, measurement: Measurement):
+        self.measurement = measurement
+        self._stack = []
+        self._mark = time.perf_counter()
+
+    def _charge(self) -> None:
+        now = time.perf_counter()
+        if self._stack:
+            seconds = self.measurement.seconds
+            seconds[self._stack[-1]] = seconds.get(self._stack[-1], 0.0) + now - self._mark
+        self._mark = now
+
+    def enter(self, name: str) -> None:
+        self._charge()
+        self._stack.append(name)
+
+    def exit(self) -> None:
+        self._charge()
+        name = self._stack.pop()
+        hook = getattr(_clocks, "hook", None)
+        if hook is not None:
+            hook(name)
+
+
+_clocks = threading.local()
+
+
+@contextmanager
+def stage_hook(callback):
+    # Calls callback(stage name) whenever a stage of a conversion on this
+    # thread ends, e.g. to sample memory use while the decoded image is alive
+    previous = getattr(_clocks, "hook", None)
+    _clocks.hook = callback
+    try:
+        yield
+    finally:
+        _clocks.hook = previous
+
+
+@contextmanager
+def measure(default_stage: str = "encode"):
+    # Measures the conversion running on this thread; time outside any
+    # stage() block is charged to default_stage
+    clock = _StageClock(Measurement())
+    previous = getattr(_clocks, "clock", None)
+    _clocks.clock = clock
+    clock.enter(default_stage)
+    try:
+        yield clock.measurement
+    finally:
+        clock.exit()
+        _clocks.clock = previous
+
+
+@contextmanager
+def stage(name: str):
+    clock = getattr(_clocks, "clock", None)
+    if clock is None:
+        yield
+        return
+    clock.enter(name)
+    try:
+        yield
+    finally:
+        clock.exit()
+
+
+class MeteredWriter(io.RawIOBase):
+    # Wraps a raw output stream so that time spent writing and closing it
+    # counts as the "write" stage, and the bytes written are measured. Writes
+    # are paced by heif2png.governor.write_throttle, and time spent waiting
+    # for it counts as writing too.
+
+    def __init__(self, raw):
+        super().__init__()
+        self._raw = raw
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        with stage("write"):
+            written = self._raw.write(data)
+            write_throttle.wrote(written or 0)
+        clock = getattr(_clocks, "clock", None)
+        if clock is not None:
+            clock.measurement.bytes_written += written
+        return written
+
+    def close(self) -> None:
+        if not self.closed:
+            with stage("write"):
+                self._raw.close()
+        super().close()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_number(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return str(value)
+
+
+class _Metric:
+    type = "unknown"
+
+    def __init__(self, name: str, documentation: str, unit: str = ""):
+        self.name = name
+        self.documentation = documentation
+        self.unit = unit
+        self._lock = threading.Lock()
+
+    def samples(self):
+        # (sample name, labels as a tuple of (name, value) pairs, value)
+        return []
+
+    def render(self) -> list[str]:
+        lines = [f"# TYPE {self.name} {self.type}"]
+        if self.unit:
+            lines.append(f"# UNIT {self.name} {self.unit}")
+        lines.append(f"# HELP {self.name} {_escape(self.documentation)}")
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_number(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    # Either inc() or read from a function that counts elsewhere each time it
+    # is scraped
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, unit: str = "", function=None):
+        super().__init__(name, documentation, unit)
+        self._values = {}
+        self._function = function
+
+    def set_function(self, function) -> None:
+        self._function = function
+
+    def inc(self, amount=1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def samples(self):
+        if self._function is not None:
+            return [(f"{self.name}_total", (), self._function())]
+        with self._lock:
+            values = dict(self._values) or {(): 0}
+        return [(f"{self.name}_total", labels, value) for labels, value in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, unit: str = "",
+                 buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, unit)
+        self.buckets = tuple(buckets) + (math.inf,)
+        self._series = {}  # labels -> [count per bucket, sum]
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.setdefault(key, [[0] * len(self.buckets), 0.0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            series = {labels: (list(counts), total)
+                      for labels, (counts, total) in self._series.items()}
+        samples = []
+        for labels, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", labels + (("le", _format_number(bound)),),
+                                cumulative))
+            samples.append((f"{self.name}_count", labels, cumulative))
+            samples.append((f"{self.name}_sum", labels, total))
+        return samples
+
+
+class Gauge(_Metric):
+    # Either set() or read from a function each time it is scraped
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, unit: str = "", function=None):
+        super().__init__(name, documentation, unit)
+        self._value = 0
+        self._function = function
+
+    def set(self, value) -> None:
+        self._value = value
+
+    def set_function(self, function) -> None:
+        self._function = function
+
+    def value(self):
+        return self._function() if self._function is not None else self._value
+
+    def samples(self):
+        return [(self.name, (), self.value())]
+
+
+class ConversionMetrics:
+    # The metrics of this process. ConversionPool reports every file it
+    # converts; the coordinator of a distributed batch reports the files its
+    # workers converted. Queue depth defaults to the files handed to the pool
+    # that have not started; whatever keeps a longer queue (the app's job
+    # queue, the coordinator) sets its own function.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._workers = 0
+        self.files = Counter(
+            "heif2png_files", "Converted and failed files per output format.")
+        self.input_bytes = Counter(
+            "heif2png_input_bytes", "Bytes of source images converted.", "bytes")
+        self.output_bytes = Counter(
+            "heif2png_output_bytes", "Bytes of images written.", "bytes")
+        self.stage_seconds = Histogram(
+            "heif2png_stage_duration_seconds",
+            "Time per file spent decoding, encoding (including resizing and color "
+            "conversion) and writing.", "seconds")
+        self.queue_depth = Gauge(
+            "heif2png_queue_depth", "Files waiting to be converted.",
+            function=lambda: max(0, self._pending - self._workers))
+        self.busy_workers = Gauge(
+            "heif2png_busy_workers", "Workers converting a file.",
+            function=lambda: min(self._pending, self._workers))
+        self.workers = Gauge(
+            "heif2png_workers", "Workers available for conversion.",
+            function=lambda: self._workers)
+        self.cache_bytes = Gauge(
+            "heif2png_cache_bytes", "Memory held by the decoded image cache.", "bytes")
+        self.cache_hits = Counter(
+            "heif2png_cache_hits", "Lookups answered by the decoded image cache.")
+        self.cache_misses = Counter(
+            "heif2png_cache_misses", "Lookups the decoded image cache could not answer.")
+        self.metrics = [self.files, self.input_bytes, self.output_bytes, self.stage_seconds,
+                        self.queue_depth, self.busy_workers, self.workers, self.cache_bytes,
+                        self.cache_hits, self.cache_misses]
+
+    def add_workers(self, count: int) -> None:
+        with self._lock:
+            self._workers += count
+
+    def submitted(self, formats, future) -> None:
+        # Counts the file as pending until future finishes, then records it
+        with self._lock:
+            self._pending += 1
+        future.add_done_callback(lambda future: self._finished(formats, future))
+
+    def _finished(self, formats, future) -> None:
+        with self._lock:
+            self._pending -= 1
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            self.record(formats, failed=True)
+        else:
+            self.record(formats, getattr(future.result(), "measurement", None))
+
+    def record(self, formats, measurement: Measurement | None = None,
+               failed: bool = False) -> None:
+        for output_format in sorted(set(formats)):
+            self.files.inc(format=output_format, result="failed" if failed else "converted")
+        if measurement is None:
+            return
+        self.input_bytes.inc(measurement.bytes_read)
+        self.output_bytes.inc(measurement.bytes_written)
+        for name in STAGES:
+            if name in measurement.seconds:
+                self.stage_seconds.observe(measurement.seconds[name], stage=name)
+
+    def exposition(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n# EOF\n"
+
+
+conversion_metrics = ConversionMetrics()
+
+
+@cache
+def _handler_class():
+    # Built on first use: http.server pulls in a good part of the email
+    # package, which the app would otherwise import on every start
+    from http.server import BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass  # Scraped every few seconds
+
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            data = self.server.metrics.exposition().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return MetricsHandler
+
+
+class MetricsServer:
+    # Serves the metrics in the OpenMetrics text format on /metrics for a
+    # Prometheus compatible scraper
+
+    def __init__(self, metrics: ConversionMetrics = conversion_metrics):
+        self.metrics = metrics
+        self._server = None
+
+    def serve(self, host: str = "127.0.0.1", port: int = DEFAULT_PORT) -> tuple[str, int]:
+        # Starts the HTTP server on a background thread and returns its address;
+        # port 0 picks a free port
+        from http.server import ThreadingHTTPServer
+
+        self._server = ThreadingHTTPServer((host, port), _handler_class())
+        self._server.daemon_threads = True
+        self._server.metrics = self.metrics
+        threading.Thread(target=self._server.serve_forever, name="metrics",
+                         daemon=True).start()
+        return self._server.server_address[:2]
+
+    def shutdown(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -0,0 +1,95 @@
+from PIL import Image
+
+
+DEFAULT_MATTE = (255, 255, 255)
+_HIGH_BIT_DEPTH_MODES = ("I", "I;16", "I;16L", "I;16B", "I;16N", "F")
+
+
+def _has_alpha(pil_image: Image.Image) -> bool:
+    return pil_image.mode in ("RGBA", "RGBa", "LA", "La", "PA") or (
+        pil_image.mode == "P" and "transparency" in pil_image.info)
+
+
+def _reduce_bit_depth(pil_image: Image.Image) -> Image.Image:
+    # 16-bit grayscale: scale into 8 bits instead of letting convert() clip.
+    # Float grayscale is taken to be on the 8-bit scale, as Pillow's own
+    # conversions to "F" leave it, and values outside 0-255 are clipped.
+    if pil_image.mode == "F":
+        return pil_image.convert("L")
+    return pil_image.point(lambda value: value * (1 / 256)).convert("L")
+
+
+def _flatten_palette(pil_image: Image.Image, matte) -> Image.Image:
+    # Blend every palette entry with the matte once, then expand the indices:
+    # the pixels are touched a single time, by the final P -> RGB conversion.
+    transparency = pil_image.info["transparency"]
+    palette = pil_image.getpalette("RGB")
+    entries = len(palette) // 3
+    if isinstance(transparency, int):
+        alphas = [0 if index == transparency else 255 for index in range(entries)]
+    else:
+        alphas = list(transparency) + [255] * (entries - len(transparency))
+    flattened = []
+    for index in range(entries):
+        alpha = alphas[index]
+        for channel in range(3):
+            flattened.append(
+                (palette[index * 3 + channel] * alpha + matte[channel] * (255 - alpha) + 127) // 255)
+    opaque = pil_image.copy()  # Indices only: one byte per pixel
+    opaque.putpalette(flattened, "RGB")
+    opaque.info.pop("transparency", None)
+    return opaque.convert("RGB")
+
+
+def composite_onto_matte(target: Image.Image, pil_image: Image.Image, offset=(0, 0)) -> None:
+    # Pastes pil_image into the RGB target at offset, blending by its alpha.
+    # paste() reads the alpha band in place as the mask, so no channel is split
+    # out and the blend happens in the same C loop that copies the pixels.
+    if not _has_alpha(pil_image):
+        target.paste(pil_image, offset)
+        return
+    if pil_image.mode == "La":
+        pil_image = pil_image.convert("LA")  # Pillow has no La -> RGBA conversion
+    elif pil_image.mode in ("RGBa", "PA", "P"):
+        pil_image = pil_image.convert("RGBA")
+    target.paste(pil_image, offset, pil_image)
+
+
+def prepare_pixels(pil_image: Image.Image, output_format: str,
+                   matte=DEFAULT_MATTE) -> Image.Image:
+    # Brings a decoded image into a mode the output format can store: alpha is
+    # flattened onto the matte for JPEG, palettes are expanded and high bit
+    # depth grayscale is reduced to 8 bits where the format needs it. Each case
+    # makes at most one full-size allocation and returns the source untouched
+    # when it is already suitable.
+    mode = pil_image.mode
+    if output_format == "png":
+        if mode == "La":
+            return pil_image.convert("LA")  # Pillow has no La -> RGBA conversion
+        if (mode == "P" and "transparency" in pil_image.info) or mode in ("RGBa", "PA"):
+            return pil_image.convert("RGBA")
+        return pil_image
+
+    if mode in _HIGH_BIT_DEPTH_MODES:
+        pil_image = _reduce_bit_depth(pil_image)
+        mode = pil_image.mode
+
+    if output_format == "jpeg":
+        if mode == "RGB":
+            return pil_image
+        if mode == "P" and "transparency" in pil_image.info:
+            return _flatten_palette(pil_image, matte)
+        if _has_alpha(pil_image):
+            flattened = Image.new("RGB", pil_image.size, matte)
+            composite_onto_matte(flattened, pil_image)
+            return flattened
+        return pil_image.convert("RGB")
+
+    if output_format == "webp":
+        if mode in ("RGB", "RGBA"):
+            return pil_image
+        if mode == "La":
+            pil_image = pil_image.convert("LA")
+        return pil_image.convert("RGBA" if _has_alpha(pil_image) else "RGB")
+
+    return pil_image
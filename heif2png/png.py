@@ -0,0 +1,284 @@
+import itertools
+import os
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageChops
+
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Pillow mode -> (PNG colour type, bytes per pixel), all at 8 bits per sample
+COLOR_TYPES = {"L": (0, 1), "RGB": (2, 3), "LA": (4, 2), "RGBA": (6, 4)}
+IDAT_CHUNK_SIZE = 1 << 16
+DEFAULT_COMPRESS_LEVEL = 6  # Same default as Pillow's PNG encoder
+DEFAULT_CHUNK_SIZE = 1 << 20  # Filtered bytes per independently compressed chunk
+_DEFLATE_WINDOW = 32 * 1024
+_ADLER_BASE = 65521
+_FILTER_UP = b"\x02"
+
+
+def png_mode(mode: str) -> str:
+    # Mode the writers store pixels in; anything else is converted strip by strip
+    if mode in COLOR_TYPES:
+        return mode
+    if mode in ("1", "I", "I;16", "F"):
+        return "L"
+    return "RGBA" if "A" in mode or mode == "PA" else "RGB"
+
+
+def _write_chunk(fp, tag: bytes, data: bytes = b"") -> None:
+    fp.write(struct.pack(">I", len(data)))
+    fp.write(tag)
+    fp.write(data)
+    fp.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(tag)) & 0xFFFFFFFF))
+
+
+def write_header(fp, size, mode, icc_profile=None, exif=None) -> None:
+    color_type, _ = COLOR_TYPES[mode]
+    fp.write(PNG_SIGNATURE)
+    _write_chunk(fp, b"IHDR", struct.pack(">IIBBBBB", size[0], size[1], 8, color_type, 0, 0, 0))
+    if icc_profile:
+        _write_chunk(fp, b"iCCP", b"ICC Profile\0\0" + zlib.compress(icc_profile))
+    if exif:
+        if exif.startswith(b"Exif\x00\x00"):
+            exif = exif[6:]
+        _write_chunk(fp, b"eXIf", exif)
+
+
+def filter_rows(strip: Image.Image, row_above: Image.Image | None) -> bytes:
+    # Applies the PNG "Up" filter to every row of the strip. The byte-wise
+    # difference to the previous row is exactly ImageChops.subtract_modulo of
+    # the strip and the strip shifted down by one row, so the whole strip is
+    # filtered in C without touching individual pixels from Python.
+    width, height = strip.size
+    above = Image.new(strip.mode, strip.size)
+    if row_above is not None:
+        above.paste(row_above, (0, 0))
+    if height > 1:
+        above.paste(strip.crop((0, 0, width, height - 1)), (0, 1))
+    raw = memoryview(ImageChops.subtract_modulo(strip, above).tobytes())
+    row_bytes = width * COLOR_TYPES[strip.mode][1]
+    rows = [raw[offset:offset + row_bytes] for offset in range(0, len(raw), row_bytes)]
+    return _FILTER_UP + _FILTER_UP.join(rows)
+
+
+class _IDATWriter:
+    # With a sequence counter the data goes into APNG fdAT chunks instead,
+    # each prefixed with its sequence number.
+
+    def __init__(self, fp, sequence=None):
+        self.fp = fp
+        self._sequence = sequence
+        self._pending = bytearray()
+
+    def write(self, data) -> None:
+        self._pending += data
+        while len(self._pending) >= IDAT_CHUNK_SIZE:
+            self._emit(IDAT_CHUNK_SIZE)
+
+    def flush(self) -> None:
+        while self._pending:
+            self._emit(IDAT_CHUNK_SIZE)
+
+    def close(self) -> None:
+        self.flush()
+        _write_chunk(self.fp, b"IEND")
+
+    def _emit(self, size: int) -> None:
+        chunk = bytes(self._pending[:size])
+        del self._pending[:size]
+        if self._sequence is None:
+            _write_chunk(self.fp, b"IDAT", chunk)
+        else:
+            _write_chunk(self.fp, b"fdAT", struct.pack(">I", next(self._sequence)) + chunk)
+
+
+class PNGStreamWriter:
+    # Writes a PNG from horizontal strips handed in top to bottom. Only the
+    # current strip and the last row of the previous one are held in memory,
+    # and compressed data leaves in IDAT chunks as soon as zlib produces it.
+
+    def __init__(self, fp, size, mode, icc_profile=None, exif=None,
+                 compress_level=DEFAULT_COMPRESS_LEVEL):
+        self.fp = fp
+        self.size = size
+        self.mode = png_mode(mode)
+        self.rows_written = 0
+        self._row_above = None
+        self._compressor = zlib.compressobj(compress_level)
+        write_header(fp, size, self.mode, icc_profile, exif)
+        self._idat = _IDATWriter(fp)
+
+    def write_strip(self, strip: Image.Image) -> None:
+        if strip.width != self.size[0]:
+            raise ValueError(
+                f"Strip width {strip.width} does not match image width {self.size[0]}")
+        if self.rows_written + strip.height > self.size[1]:
+            raise ValueError("More rows written than the image height")
+        if strip.mode != self.mode:
+            strip = strip.convert(self.mode)
+
+        self._idat.write(self._compressor.compress(filter_rows(strip, self._row_above)))
+        self._row_above = strip.crop((0, strip.height - 1, strip.width, strip.height))
+        self.rows_written += strip.height
+
+    def close(self) -> None:
+        if self.rows_written != self.size[1]:
+            raise ValueError(
+                f"Only {self.rows_written} of {self.size[1]} rows were written")
+        self._idat.write(self._compressor.flush())
+        self._idat.close()
+
+
+class APNGStreamWriter:
+    # Writes an animated PNG one frame at a time. The frame count goes into the
+    # acTL chunk ahead of any image data, so it has to be known up front, but
+    # no frame is kept once it has been compressed. Every frame covers the
+    # whole canvas and replaces the previous one.
+
+    def __init__(self, fp, size, mode, frame_count, loop=0, icc_profile=None, exif=None,
+                 compress_level=DEFAULT_COMPRESS_LEVEL):
+        self.fp = fp
+        self.size = size
+        self.mode = png_mode(mode)
+        self.frame_count = frame_count
+        self.frames_written = 0
+        self.compress_level = compress_level
+        self._sequence = itertools.count()
+        write_header(fp, size, self.mode, icc_profile, exif)
+        _write_chunk(fp, b"acTL", struct.pack(">II", frame_count, loop))
+
+    def write_frame(self, frame: Image.Image, duration: int) -> None:
+        # duration is in milliseconds
+        if frame.size != self.size:
+            raise ValueError(f"Frame size {frame.size} does not match image size {self.size}")
+        if self.frames_written >= self.frame_count:
+            raise ValueError("More frames written than announced")
+        if frame.mode != self.mode:
+            frame = frame.convert(self.mode)
+
+        _write_chunk(self.fp, b"fcTL", struct.pack(
+            ">IIIIIHHBB", next(self._sequence), self.size[0], self.size[1], 0, 0,
+            min(duration, 0xFFFF), 1000, 0, 0))
+        # The default image is the first frame; the rest go into fdAT chunks
+        data = _IDATWriter(self.fp, self._sequence if self.frames_written else None)
+        data.write(zlib.compress(filter_rows(frame, None), self.compress_level))
+        data.flush()
+        self.frames_written += 1
+
+    def close(self) -> None:
+        if self.frames_written != self.frame_count:
+            raise ValueError(
+                f"Only {self.frames_written} of {self.frame_count} frames were written")
+        _write_chunk(self.fp, b"IEND")
+
+
+def _zlib_header(compress_level: int) -> bytes:
+    # CMF for deflate with a 32K window, FLEVEL as zlib would pick it for this level
+    cmf = 0x78
+    if compress_level < 2:
+        flevel = 0
+    elif compress_level < 6:
+        flevel = 1
+    elif compress_level == 6 or compress_level == -1:
+        flevel = 2
+    else:
+        flevel = 3
+    flg = flevel << 6
+    flg += (31 - ((cmf << 8) + flg) % 31) % 31
+    return bytes((cmf, flg))
+
+
+def _adler32_combine(adler1: int, adler2: int, len2: int) -> int:
+    # Port of zlib's adler32_combine(), which the zlib module does not expose
+    rem = len2 % _ADLER_BASE
+    sum1 = adler1 & 0xFFFF
+    sum2 = (rem * sum1) % _ADLER_BASE
+    sum1 += (adler2 & 0xFFFF) + _ADLER_BASE - 1
+    sum2 += ((adler1 >> 16) & 0xFFFF) + ((adler2 >> 16) & 0xFFFF) + _ADLER_BASE - rem
+    if sum1 >= _ADLER_BASE:
+        sum1 -= _ADLER_BASE
+    if sum1 >= _ADLER_BASE:
+        sum1 -= _ADLER_BASE
+    if sum2 >= _ADLER_BASE << 1:
+        sum2 -= _ADLER_BASE << 1
+    if sum2 >= _ADLER_BASE:
+        sum2 -= _ADLER_BASE
+    return sum1 | (sum2 << 16)
+
+
+def write_png_parallel(fp, size, mode, read_rows, threads=None,
+                       chunk_size=DEFAULT_CHUNK_SIZE,
+                       compress_level=DEFAULT_COMPRESS_LEVEL,
+                       icc_profile=None, exif=None, on_rows=None) -> None:
+    # pigz-style PNG writer. The image is cut into bands of about chunk_size
+    # filtered bytes and every band is deflated on its own thread (zlib releases
+    # the GIL). Each band is primed with the last 32K of the band before it and
+    # ends on a sync flush, so the raw deflate outputs concatenate into one
+    # valid zlib stream; the Adler-32 checksums are combined at the end.
+    #
+    # read_rows(top, count) must return the rows [top, top + count) as an image
+    # of the full width, which lets callers feed either a Pillow image or a
+    # decoded buffer without materialising a second full-size copy.
+    # on_rows(top, rows), if given, sees the rows of every band once, from the
+    # compressing threads and in no particular order.
+    width, height = size
+    out_mode = png_mode(mode)
+    row_bytes = width * COLOR_TYPES[out_mode][1] + 1
+    band_rows = max(1, chunk_size // row_bytes)
+    dict_rows = -(-_DEFLATE_WINDOW // row_bytes)
+    threads = threads or os.cpu_count() or 1
+
+    def read(top, count):
+        rows = read_rows(top, count)
+        return rows if rows.mode == out_mode else rows.convert(out_mode)
+
+    def filtered(top, bottom, rows=None):
+        if rows is None:
+            rows = read(top, bottom - top)
+        return filter_rows(rows, read(top - 1, 1) if top > 0 else None)
+
+    def compress_band(top):
+        bottom = min(height, top + band_rows)
+        rows = read(top, bottom - top)
+        if on_rows is not None:
+            on_rows(top, rows)
+        data = filtered(top, bottom, rows)
+        del rows
+        if top > 0:
+            zdict = filtered(max(0, top - dict_rows), top)[-_DEFLATE_WINDOW:]
+            compressor = zlib.compressobj(compress_level, zlib.DEFLATED, -15, zdict=zdict)
+        else:
+            compressor = zlib.compressobj(compress_level, zlib.DEFLATED, -15)
+        flush_mode = zlib.Z_FINISH if bottom == height else zlib.Z_SYNC_FLUSH
+        compressed = compressor.compress(data) + compressor.flush(flush_mode)
+        return compressed, zlib.adler32(data), len(data)
+
+    write_header(fp, size, out_mode, icc_profile, exif)
+    idat = _IDATWriter(fp)
+    idat.write(_zlib_header(compress_level))
+    adler = 1
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        # Keep a bounded window of bands in flight so memory stays proportional
+        # to the thread count rather than the image size
+        tops = iter(range(0, height, band_rows))
+        in_flight = deque(
+            executor.submit(compress_band, top) for _, top in zip(range(threads * 2), tops))
+        while in_flight:
+            compressed, band_adler, band_length = in_flight.popleft().result()
+            idat.write(compressed)
+            adler = _adler32_combine(adler, band_adler, band_length)
+            top = next(tops, None)
+            if top is not None:
+                in_flight.append(executor.submit(compress_band, top))
+    idat.write(struct.pack(">I", adler))
+    idat.close()
+
+
+def save_png_parallel(image: Image.Image, fp, **kwargs) -> None:
+    def read_rows(top, count):
+        return image.crop((0, top, image.width, top + count))
+
+    write_png_parallel(fp, image.size, image.mode, read_rows, **kwargs)
@@ -0,0 +1,136 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from heif2png.cache import decoded_images
+from heif2png.thumbnails import SIZES, bucket_for, thumbnail_cache
+
+
+DEFAULT_DEPTH = 2
+DEFAULT_WORKERS = 2
+
+
+class PreviewPrefetcher:
+    # Decodes the neighbors of the selected file list row in the background so
+    # arrow-key browsing finds its preview ready. The direction of the last
+    # one-row step is assumed to continue: those rows are queued first and get
+    # the full depth, the rows behind get one. Any other jump starts a new
+    # generation, cancelling queued work and discarding results still running.
+
+    def __init__(self, depth: int = DEFAULT_DEPTH, workers: int = DEFAULT_WORKERS):
+        self.depth = depth
+        self._executor = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix="preview-prefetch")
+        self._lock = threading.RLock()  # Cancelling runs done callbacks in place
+        self._generation = 0
+        self._last_row = None
+        self._direction = 1
+        self._futures = {}  # (path, bucket) -> Future of a preview-sized image
+        self._ready = OrderedDict()  # (path, bucket) -> preview-sized image
+        self.hits = 0
+        self.misses = 0
+
+    def _capacity(self) -> int:
+        return 2 * self.depth + 2
+
+    def _neighbors(self, row: int, count: int) -> list[int]:
+        ahead = [row + self._direction * step for step in range(1, self.depth + 1)]
+        behind = [row - self._direction]
+        rows = []
+        for index in ahead[:1] + behind + ahead[1:]:
+            if 0 <= index < count and index not in rows:
+                rows.append(index)
+        return rows
+
+    def navigate(self, paths: list[str], row: int, size: int) -> None:
+        # Called when the selection moves to row; queues the predicted neighbors
+        # at the preview size.
+        step = None if self._last_row is None else row - self._last_row
+        jumped = step is None or abs(step) > 1
+        if step in (-1, 1):
+            self._direction = step
+        self._last_row = row
+        bucket = bucket_for(size)
+        wanted = [(paths[index], bucket) for index in self._neighbors(row, len(paths))]
+
+        with self._lock:
+            if jumped:
+                self._generation += 1
+            generation = self._generation
+            for key, future in list(self._futures.items()):
+                if jumped or key not in wanted:
+                    # A decode already running cannot be stopped; its result
+                    # is dropped by the generation check instead
+                    future.cancel()
+                    if jumped or future.cancelled():
+                        self._futures.pop(key, None)
+            for key in wanted:
+                if key in self._ready or key in self._futures:
+                    continue
+                future = self._executor.submit(self._decode, key, generation)
+                self._futures[key] = future
+                future.add_done_callback(lambda _, key=key: self._finished(key))
+
+    def _decode(self, key, generation):
+        path, bucket = key
+        if generation != self._generation:
+            return None
+        preview = thumbnail_cache.load(path, SIZES[bucket])
+        if preview is None:
+            # Through the decoded image cache, like the preview itself, so
+            # the two never decode the same file twice
+            pil_image = decoded_images.get_or_decode(path)
+            if generation != self._generation:
+                return None
+            preview = thumbnail_cache.store(path, pil_image, SIZES[bucket])
+            if preview is None:
+                return None
+            thumbnail_cache.store(path, preview, SIZES["normal"])
+        with self._lock:
+            if generation != self._generation:
+                return None
+            self._ready[key] = preview
+            while len(self._ready) > self._capacity():
+                self._ready.popitem(last=False)
+        return preview
+
+    def _finished(self, key) -> None:
+        with self._lock:
+            future = self._futures.get(key)
+            if future is not None and future.done():
+                del self._futures[key]
+
+    def get(self, path: str, size: int) -> Image.Image | None:
+        # Returns the prefetched preview of path, waiting for it when its decode
+        # is already running rather than starting a second one.
+        key = (path, bucket_for(size))
+        with self._lock:
+            preview = self._ready.get(key)
+            if preview is not None:
+                self._ready.move_to_end(key)
+            future = self._futures.get(key) if preview is None else None
+        if preview is None and future is not None and future.running():
+            try:
+                preview = future.result()
+            except Exception:  # Unreadable files are reported by the caller's own decode
+                preview = None
+        if preview is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return preview
+
+    def cancel(self) -> None:
+        with self._lock:
+            self._generation += 1
+            for future in list(self._futures.values()):  # Callbacks remove them
+                future.cancel()
+            self._futures.clear()
+            self._ready.clear()
+        self._last_row = None
+
+    def shutdown(self) -> None:
+        self.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,199 @@
+import cProfile
+import io
+import json
+import linecache
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+
+from heif2png.metrics import stage_hook
+
+
+PROFILE_FILE = "profile.prof"  # Merged cProfile stats of every profiled thread
+SUMMARY_FILE = "summary.txt"
+SUMMARY_FUNCTIONS = 25  # Functions listed per ranking in the summary
+SUMMARY_ALLOCATIONS = 15  # Allocation sites listed in the summary
+_SAVED_SITES = 50  # Allocation sites kept per process
+# Allocation sites are sampled again only once traced memory grows this much
+# past the last sample, since every sample walks all traced blocks
+_SAMPLE_GROWTH = 1.25
+# The profiler's own bookkeeping is left out of the allocation sites
+_IGNORED_FILES = (__file__, cProfile.__file__, pstats.__file__, tracemalloc.__file__,
+                  "<frozen importlib._bootstrap>", "<frozen importlib._bootstrap_external>",
+                  "<unknown>")
+
+_directory = None  # Folder of the session recording in this process
+_lock = threading.Lock()
+_profilers = {}  # (folder, thread id) -> cProfile.Profile
+_memory = {}  # folder -> {"peak", "sampled", "sites"} of this process
+
+
+def active_directory() -> str | None:
+    return _directory
+
+
+def _sample_memory(directory: str, profiler=None) -> None:
+    # Keeps the largest allocation sites at the fullest moment seen so far.
+    # Called at the end of every conversion stage, so the decoded image and
+    # the encoder buffers are still alive when it counts. The sample itself
+    # is kept out of the thread's profile.
+    current, peak = tracemalloc.get_traced_memory()
+    with _lock:
+        memory = _memory.setdefault(directory, {"peak": 0, "sampled": 0, "sites": []})
+        memory["peak"] = max(memory["peak"], peak)
+        if current <= memory["sampled"] * _SAMPLE_GROWTH:
+            return
+        memory["sampled"] = current
+    if profiler is not None:
+        profiler.disable()
+    try:
+        statistics = tracemalloc.take_snapshot().statistics("lineno")
+        sites = [[stat.traceback[0].filename, stat.traceback[0].lineno, stat.size, stat.count]
+                 for stat in statistics
+                 if stat.traceback[0].filename not in _IGNORED_FILES][:_SAVED_SITES]
+        del statistics
+    finally:
+        if profiler is not None:
+            profiler.enable()
+    with _lock:
+        if memory["sampled"] == current:
+            memory["sites"] = sites
+
+
+def _save_memory(directory: str) -> None:
+    with _lock:
+        memory = _memory.get(directory)
+        if memory is None:
+            return
+        data = json.dumps(memory)
+    with open(os.path.join(directory, f"{os.getpid()}-memory.json"), "w",
+              encoding="utf-8") as f:
+        f.write(data)
+
+
+def profiled(directory: str, function, *args):
+    # Runs function(*args) under this thread's profiler for the session
+    # recording into directory, and saves this thread's stats right after,
+    # so worker processes leave complete files behind however they end.
+    # Worker processes trace allocations only while a file converts; in the
+    # process that started the session, tracing runs for the whole session.
+    key = (directory, threading.get_ident())
+    with _lock:
+        profiler = _profilers.get(key)
+        if profiler is None:
+            profiler = _profilers[key] = cProfile.Profile()
+    tracing = not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Python 3.12+ runs one profiler per process; the session's, started
+        # in this process, sees this thread too
+        profiler = None
+    try:
+        with stage_hook(lambda name: _sample_memory(directory, profiler)):
+            return function(*args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(os.path.join(
+                directory, f"{os.getpid()}-{threading.get_native_id()}.prof"))
+        if tracing:
+            tracemalloc.stop()
+        _save_memory(directory)
+
+
+def _source_line(filename: str, lineno: int) -> str:
+    return linecache.getline(filename, lineno).strip()
+
+
+def write_summary(directory: str) -> str:
+    # Merges the stats of every profiled thread into PROFILE_FILE and writes
+    # the hottest functions and largest allocation sites to SUMMARY_FILE;
+    # returns the summary's path
+    names = sorted(os.listdir(directory))
+    stats_paths = [os.path.join(directory, name) for name in names
+                   if name.endswith(".prof") and name != PROFILE_FILE]
+    memory = []
+    for name in names:
+        if name.endswith("-memory.json"):
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                memory.append(json.load(f))
+
+    out = io.StringIO()
+    out.write(f"Profile of {len(stats_paths)} thread(s) in "
+              f"{len({name.split('-')[0] for name in names if name.endswith('.prof')})} "
+              f"process(es). {PROFILE_FILE} holds the merged stats for pstats, snakeviz or "
+              f"flameprof.\n")
+    if stats_paths:
+        stats = pstats.Stats(*stats_paths, stream=out)
+        stats.dump_stats(os.path.join(directory, PROFILE_FILE))
+        for sort_key, title in (("cumulative", "cumulative time"), ("tottime", "own time")):
+            out.write(f"\nHottest functions by {title}:\n")
+            stats.sort_stats(sort_key).print_stats(SUMMARY_FUNCTIONS)
+
+    sites = {}
+    for process in memory:
+        for filename, lineno, size, count in process["sites"]:
+            total = sites.setdefault((filename, lineno), [0, 0])
+            total[0] += size
+            total[1] += count
+    out.write(f"\nLargest allocation sites at each process's fullest moment "
+              f"(Python allocations only; peak "
+              f"{sum(process['peak'] for process in memory) / 2**20:.1f} MB over all "
+              f"processes):\n")
+    ranked = sorted(sites.items(), key=lambda item: -item[1][0])[:SUMMARY_ALLOCATIONS]
+    for (filename, lineno), (size, count) in ranked:
+        out.write(f"{size / 2**20:9.2f} MB {count:8d} block(s)  {filename}:{lineno}\n")
+        line = _source_line(filename, lineno)
+        if line:
+            out.write(f"{'':28}{line}\n")
+
+    summary_path = os.path.join(directory, SUMMARY_FILE)
+    with open(summary_path, "w", encoding="utf-8") as f:
+        f.write(out.getvalue())
+    return summary_path
+
+
+class ProfileSession:
+    # Records cProfile stats and tracemalloc allocation sites for every file
+    # converted while it runs, on the thread that started it, on
+    # ConversionPool's conversion thread and in worker processes. stop()
+    # writes everything into a timestamped folder under root.
+
+    def __init__(self, root: str):
+        self.directory = os.path.join(
+            os.path.abspath(root), time.strftime("heif2png-profile-%Y%m%d-%H%M%S"))
+        self._profiler = None
+        self._tracing = False
+
+    def start(self) -> "ProfileSession":
+        global _directory
+        if _directory is not None:
+            raise RuntimeError(f"Already profiling into {_directory}")
+        os.makedirs(self.directory, exist_ok=True)
+        self._tracing = not tracemalloc.is_tracing()
+        if self._tracing:
+            tracemalloc.start()
+        self._profiler = cProfile.Profile()
+        self._profiler.enable()
+        _directory = self.directory
+        return self
+
+    def stop(self) -> str:
+        # Returns the path of the summary
+        global _directory
+        _directory = None
+        self._profiler.disable()
+        self._profiler.dump_stats(os.path.join(self.directory, f"{os.getpid()}-main.prof"))
+        if self._tracing:
+            tracemalloc.stop()
+        _save_memory(self.directory)
+        with _lock:
+            for key in [key for key in _profilers if key[0] == self.directory]:
+                del _profilers[key]
+            _memory.pop(self.directory, None)
+        return write_summary(self.directory)
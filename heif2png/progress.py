@@ -0,0 +1,145 @@
+import sys
+import threading
+import time
+from dataclasses import dataclass
+
+from heif2png.archives import source_size
+
+
+PROGRESS_INTERVAL = 0.1  # Seconds between progress updates shown to the user (10 Hz)
+SMOOTHING = 0.3  # Weight of the newest throughput sample in the moving average
+SAMPLE_SECONDS = 1.0  # Shortest span of one throughput sample
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+def file_bytes(file_path: str) -> int:
+    # Input size for MB/s; a file that has since been replaced counts as 0
+    try:
+        return source_size(file_path)
+    except (OSError, KeyError):
+        return 0
+
+
+@dataclass(frozen=True)
+class ProgressSnapshot:
+    done: int
+    total: int
+    failed: int
+    bytes_done: int
+    elapsed: float
+    files_per_second: float
+    bytes_per_second: float
+
+    @property
+    def eta(self) -> float | None:
+        # Seconds left at the smoothed throughput, None until it is known
+        remaining = self.total - self.done
+        if remaining <= 0:
+            return 0.0
+        if self.files_per_second <= 0:
+            return None
+        return remaining / self.files_per_second
+
+    def status_line(self) -> str:
+        eta = self.eta
+        line = (f"{self.done}/{self.total} files, {self.files_per_second:.1f} files/s, "
+                f"{self.bytes_per_second / 2**20:.1f} MB/s, "
+                f"elapsed {format_duration(self.elapsed)}, "
+                f"ETA {format_duration(eta) if eta is not None else '--:--'}")
+        if self.failed:
+            line += f", {self.failed} failed"
+        return line
+
+
+class ProgressTracker:
+    # Counts finished files from any thread; the display reads snapshot() at
+    # its own pace (PROGRESS_INTERVAL), so any number of files finishing
+    # between two reads costs one update. Throughput is an exponentially
+    # weighted moving average over samples of at least SAMPLE_SECONDS, so the
+    # ETA follows changes in speed without jumping with every file.
+
+    def __init__(self, total: int, done: int = 0, clock=time.monotonic):
+        self.total = total
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._done = done
+        self._failed = 0
+        self._bytes = 0
+        self._started = clock()
+        self._sample_start = self._started
+        self._sample_files = 0
+        self._sample_bytes = 0
+        self._files_rate = None  # Smoothed files per second, None before the first sample
+        self._bytes_rate = 0.0
+
+    def advance(self, files: int = 1, nbytes: int = 0, failed: int = 0) -> None:
+        with self._lock:
+            self._done += files
+            self._failed += failed
+            self._bytes += nbytes
+            self._sample_files += files
+            self._sample_bytes += nbytes
+            now = self.clock()
+            if now - self._sample_start >= SAMPLE_SECONDS:
+                self._files_rate, self._bytes_rate = self._rates(now)
+                self._sample_start = now
+                self._sample_files = 0
+                self._sample_bytes = 0
+
+    def _rates(self, now: float) -> tuple[float, float]:
+        span = now - self._sample_start
+        files_rate = self._sample_files / span if span > 0 else 0.0
+        bytes_rate = self._sample_bytes / span if span > 0 else 0.0
+        if self._files_rate is None:
+            return files_rate, bytes_rate
+        return (SMOOTHING * files_rate + (1 - SMOOTHING) * self._files_rate,
+                SMOOTHING * bytes_rate + (1 - SMOOTHING) * self._bytes_rate)
+
+    def snapshot(self) -> ProgressSnapshot:
+        with self._lock:
+            now = self.clock()
+            if self._files_rate is None or now - self._sample_start >= SAMPLE_SECONDS:
+                # The open sample counts once it is long enough, so a stall
+                # lowers the estimate instead of freezing it
+                files_rate, bytes_rate = self._rates(now)
+            else:
+                files_rate, bytes_rate = self._files_rate, self._bytes_rate
+            return ProgressSnapshot(self._done, self.total, self._failed, self._bytes,
+                                    now - self._started, files_rate, bytes_rate)
+
+
+class StatusPrinter:
+    # Writes a tracker's status line every interval seconds on a background
+    # thread, for the command line tools
+
+    def __init__(self, tracker: ProgressTracker, interval: float, stream=None, prefix: str = ""):
+        self.tracker = tracker
+        self.interval = interval
+        self.stream = stream or sys.stderr
+        self.prefix = prefix
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            print(self.prefix + self.tracker.snapshot().status_line(), file=self.stream,
+                  flush=True)
+
+    def __enter__(self):
+        if self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name="status", daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            print(self.prefix + self.tracker.snapshot().status_line(), file=self.stream,
+                  flush=True)
@@ -0,0 +1,149 @@
+import json
+import os
+import sqlite3
+import sys
+import time
+
+
+# A directory whose mtime is this close to the moment it was listed may have
+# changed again within the same mtime tick, so its entry is not trusted
+RACY_NANOSECONDS = 2_000_000_000
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    listed_ns INTEGER NOT NULL,
+    extensions TEXT NOT NULL,
+    subdirs TEXT NOT NULL,
+    matching TEXT NOT NULL,
+    others TEXT NOT NULL
+)
+"""
+
+
+def default_path() -> str:
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+        return os.path.join(base, "heif2png", "scan-index.sqlite3")
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "heif2png", "scan-index.sqlite3")
+
+
+def _list(root: str, extensions: tuple) -> tuple[list, list, list]:
+    # The subdirectories os.walk would descend into, the files matching
+    # extensions and the other files, in directory order
+    subdirs, matching, others = [], [], []
+    with os.scandir(root) as entries:
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                if not entry.is_symlink():
+                    subdirs.append(entry.name)
+            elif entry.name.lower().endswith(extensions):
+                matching.append(entry.name)
+            else:
+                others.append(entry.name)
+    return subdirs, matching, others
+
+
+class ScanIndex:
+    # Remembers the listing of every directory walked, keyed by the
+    # directory's mtime, in an SQLite file. Adding, removing or renaming an
+    # entry changes the mtime of the directory holding it, so on a re-scan an
+    # unchanged directory costs one stat instead of a listing and an
+    # extension check of every file; only changed directories are listed
+    # again. Without a usable index file, walk() lists everything.
+
+    def __init__(self, path: str | None = None):
+        self.path = path or default_path()
+        self._connection = None
+        self._failed = False
+
+    def _connect(self) -> sqlite3.Connection | None:
+        if self._connection is None and not self._failed:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self._connection = sqlite3.connect(self.path)
+                self._connection.execute(_SCHEMA)
+            except (OSError, sqlite3.Error) as e:
+                print(f"Warning: Could not open scan index {self.path}: {e}")
+                self._failed = True
+                self._connection = None
+        return self._connection
+
+    def _lookup(self, connection, root: str, mtime_ns: int, key: str):
+        try:
+            row = connection.execute(
+                "SELECT mtime_ns, listed_ns, extensions, subdirs, matching, others "
+                "FROM directories WHERE path = ?", (root,)).fetchone()
+        except sqlite3.Error:
+            return None, None
+        if row is None:
+            return None, None
+        old_subdirs = json.loads(row[3])
+        if row[0] != mtime_ns or row[2] != key or mtime_ns + RACY_NANOSECONDS > row[1]:
+            return None, old_subdirs
+        return (old_subdirs, json.loads(row[4]), json.loads(row[5])), old_subdirs
+
+    def walk(self, top: str, extensions: tuple):
+        # Yields (directory, paths of the files matching extensions, names of
+        # the other files) top-down in the order os.walk(top) would, skipping
+        # unreadable directories the same way
+        connection = self._connect()
+        key = json.dumps(sorted(extension.lower() for extension in extensions))
+        extensions = tuple(extension.lower() for extension in extensions)
+        updates = []
+        removed = []
+        stack = [top]
+        try:
+            while stack:
+                root = stack.pop()
+                try:
+                    mtime_ns = os.stat(root).st_mtime_ns
+                except OSError:
+                    continue
+                listing, old_subdirs = (None, None) if connection is None else \
+                    self._lookup(connection, root, mtime_ns, key)
+                if listing is None:
+                    listed_ns = time.time_ns()
+                    try:
+                        listing = _list(root, extensions)
+                    except OSError:
+                        continue
+                    updates.append((root, mtime_ns, listed_ns, key,
+                                    *(json.dumps(names) for names in listing)))
+                    if old_subdirs:
+                        removed += [os.path.join(root, name)
+                                    for name in set(old_subdirs) - set(listing[0])]
+                subdirs, matching, others = listing
+                prefix = os.path.join(root, "")
+                yield root, [prefix + name for name in matching], others
+                stack += [os.path.join(root, name) for name in reversed(subdirs)]
+        finally:
+            if connection is not None and (updates or removed):
+                self._save(connection, updates, removed)
+
+    def _save(self, connection, updates: list, removed: list) -> None:
+        try:
+            with connection:
+                for path in removed:
+                    # The directory and everything recorded below it
+                    prefix = os.path.join(path, "")
+                    connection.execute(
+                        "DELETE FROM directories WHERE path = ? OR (path >= ? AND path < ?)",
+                        (path, prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)))
+                connection.executemany(
+                    "INSERT OR REPLACE INTO directories VALUES (?, ?, ?, ?, ?, ?, ?)", updates)
+        except sqlite3.Error as e:
+            print(f"Warning: Could not update scan index {self.path}: {e}")
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+scan_index = ScanIndex()
@@ -0,0 +1,183 @@
+import gc
+import json
+import os
+import sqlite3
+import sys
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from itertools import compress, repeat
+
+from heif2png.fileindex import FileInfo
+
+
+CONVERTED = "converted"
+FAILED = "failed"
+SAVE_INTERVAL = 30.0  # Seconds between saves of the session while the app runs
+SCHEMA_VERSION = 1
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS session (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL
+)
+"""
+_STATUS_CODES = {None: 0, CONVERTED: 1, FAILED: 2}
+_STATUSES = (None, CONVERTED, FAILED)
+_SEPARATOR = "\0"  # Cannot occur in a path
+_UNKNOWN = -1  # A size, width or height the header did not give
+
+
+def default_path() -> str:
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+        return os.path.join(base, "heif2png", "session.sqlite3")
+    base = os.environ.get("XDG_STATE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".local", "state")
+    return os.path.join(base, "heif2png", "session.sqlite3")
+
+
+@dataclass
+class Session:
+    # The file list of the app and how it was looked at. infos holds the
+    # fileindex.FileInfo of each path, or None where it was not read yet;
+    # statuses maps paths to CONVERTED or FAILED; view holds the filter,
+    # sort order and previewed file, as JSON values.
+    paths: list = field(default_factory=list)
+    infos: list = field(default_factory=list)
+    statuses: dict = field(default_factory=dict)
+    view: dict = field(default_factory=dict)
+
+
+def _join(texts) -> bytes:
+    return _SEPARATOR.join(texts).encode("utf-8", "surrogateescape")
+
+
+def _split(data: bytes, count: int | None = None) -> list[str]:
+    # count, where known, tells an empty blob of one empty text from no texts
+    if not data:
+        return [""] * (count or 0)
+    return data.decode("utf-8", "surrogateescape").split(_SEPARATOR)
+
+
+def _numbers(values) -> bytes:
+    return array("q", [_UNKNOWN if value is None else value for value in values]).tobytes()
+
+
+def _encode(session: Session) -> dict:
+    # One blob per column instead of a row per file: a 200k-file list is a
+    # handful of values that load with a few splits, not 200k row fetches
+    infos = session.infos
+    read = bytes(info is not None for info in infos)
+    infos = [info or FileInfo() for info in infos]
+    statuses = session.statuses
+    return {
+        "version": str(SCHEMA_VERSION).encode("ascii"),
+        "paths": _join(session.paths),
+        "read": read,
+        "sizes": _numbers(info.size for info in infos),
+        "capture_dates": _join(info.capture_date or "" for info in infos),
+        "widths": _numbers(info.width for info in infos),
+        "heights": _numbers(info.height for info in infos),
+        "statuses": bytes(_STATUS_CODES[statuses.get(path)] for path in session.paths),
+        "view": json.dumps(session.view).encode("utf-8"),
+    }
+
+
+def _decode(values: dict) -> Session:
+    paths = _split(values["paths"])  # Paths are never empty
+    count = len(paths)
+    read = values["read"]
+    columns = []
+    for key in ("sizes", "widths", "heights"):
+        numbers = array("q")
+        numbers.frombytes(values[key])
+        columns.append(numbers)
+    dates = _split(values["capture_dates"], count)
+    if not len(read) == len(dates) == len(values["statuses"]) == count or \
+            any(len(numbers) != count for numbers in columns):
+        raise ValueError("columns of different lengths")
+    sizes, widths, heights = ([None if value == _UNKNOWN else value for value in numbers]
+                              for numbers in columns)
+    # tuple.__new__ straight from map, as no Python code runs per file
+    infos = list(map(tuple.__new__, repeat(FileInfo),
+                     zip(sizes, [date or None for date in dates], widths, heights)))
+    for index in compress(range(count), [not flag for flag in read]):
+        infos[index] = None
+    statuses = {path: _STATUSES[code]
+                for path, code in zip(paths, values["statuses"]) if code}
+    return Session(paths, infos, statuses, json.loads(values["view"]))
+
+
+class SessionStore:
+    # Keeps the last Session in an SQLite file. Saves are written on a
+    # background thread; a save requested while one is being written
+    # replaces any save still waiting, so only the newest is written next.
+    # Loading reads only this file, never the listed files.
+
+    def __init__(self, path: str | None = None):
+        self.path = path or default_path()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session")
+        self._lock = threading.Lock()
+        self._waiting = None  # Session to write once the current write is done
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        connection = sqlite3.connect(self.path)
+        connection.execute(_SCHEMA)
+        return connection
+
+    def load(self) -> Session | None:
+        # None without a saved session, or with one that cannot be read
+        if not os.path.exists(self.path):
+            return None
+        try:
+            connection = self._connect()
+            try:
+                values = dict(connection.execute("SELECT key, value FROM session").fetchall())
+            finally:
+                connection.close()
+            if not values:
+                return None
+            if values.get("version") != str(SCHEMA_VERSION).encode("ascii"):
+                return None  # From another version; the list is dropped again
+            # Hundreds of thousands of new tuples would set off full garbage
+            # collections of the whole app; none of them can be in a cycle
+            collecting = gc.isenabled()
+            gc.disable()
+            try:
+                return _decode(values)
+            finally:
+                if collecting:
+                    gc.enable()
+        except (OSError, sqlite3.Error, ValueError, KeyError, TypeError) as e:
+            print(f"Warning: Could not read session {self.path}: {e}")
+            return None
+
+    def _write(self) -> None:
+        with self._lock:
+            session, self._waiting = self._waiting, None
+        if session is None:
+            return
+        try:
+            values = _encode(session)
+            connection = self._connect()
+            try:
+                with connection:
+                    connection.execute("DELETE FROM session")
+                    connection.executemany("INSERT INTO session VALUES (?, ?)", values.items())
+            finally:
+                connection.close()
+        except (OSError, sqlite3.Error) as e:
+            print(f"Warning: Could not save session {self.path}: {e}")
+
+    def save(self, session: Session, wait: bool = False) -> None:
+        # session must not change afterwards; pass copies of the app's lists
+        with self._lock:
+            self._waiting = session
+            writing = self._executor.submit(self._write)
+        if wait:
+            writing.result()
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,240 @@
+import ctypes
+import hashlib
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+
+
+NEVER = "never"
+NETWORK = "network"  # Only outputs whose destination is on a network file system
+ALWAYS = "always"
+STAGING_MODES = (NEVER, NETWORK, ALWAYS)
+BATCH_BYTES = 64 * 2**20  # A batch is moved once this much is waiting...
+BATCH_SECONDS = 2.0  # ...or once its first file has waited this long
+# Linux file system types whose every operation is a round trip to a server
+NETWORK_FILESYSTEMS = frozenset((
+    "nfs", "nfs4", "cifs", "smb3", "smbfs", "ncpfs", "afs", "9p", "ceph", "glusterfs",
+    "lustre", "gpfs", "davfs", "fuse.sshfs", "fuse.rclone", "fuse.glusterfs", "fuse.s3fs",
+))
+_DRIVE_REMOTE = 4  # GetDriveTypeW
+
+
+def default_root() -> str:
+    # A local folder; a home folder on a network share would defeat staging
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    root = os.path.join(base, "heif2png", "staging")
+    if is_network_path(root):
+        root = os.path.join(tempfile.gettempdir(), "heif2png-staging")
+    return root
+
+
+def _linux_mounts() -> list[tuple[str, str]]:
+    # (mount point, file system type), longest mount points first
+    mounts = []
+    with open("/proc/self/mountinfo", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            fields = line.split()
+            separator = fields.index("-")
+            # Mount points escape spaces and other special characters as octal
+            mount_point = re.sub(r"\\([0-7]{3})", lambda match: chr(int(match[1], 8)), fields[4])
+            mounts.append((mount_point, fields[separator + 1]))
+    return sorted(mounts, key=lambda mount: len(mount[0]), reverse=True)
+
+
+def is_network_path(path: str) -> bool:
+    # Whether path, or the nearest of its parents that exists, is on a
+    # network file system. False where this cannot be told (macOS).
+    path = os.path.abspath(path)
+    if sys.platform == "win32":
+        if path.startswith("\\\\"):
+            return True  # UNC path
+        try:
+            drive = os.path.splitdrive(path)[0] + "\\"
+            return ctypes.windll.kernel32.GetDriveTypeW(drive) == _DRIVE_REMOTE
+        except (OSError, AttributeError):
+            return False
+    if not sys.platform.startswith("linux"):
+        return False
+    path = os.path.realpath(path)
+    try:
+        mounts = _linux_mounts()
+    except (OSError, ValueError):
+        return False
+    for mount_point, fs_type in mounts:
+        if path == mount_point or path.startswith(os.path.join(mount_point, "")):
+            return fs_type in NETWORK_FILESYSTEMS
+    return False
+
+
+def staging_directory(root: str, key, destination: str) -> str:
+    # The local folder that stands in for destination while key (a job)
+    # converts; every destination gets its own, so equal file names from
+    # different folders never meet
+    digest = hashlib.sha1(os.path.abspath(destination).encode("utf-8", "surrogateescape"))
+    return os.path.join(root, str(key), digest.hexdigest()[:16])
+
+
+@dataclass
+class TransferStats:
+    files: int = 0
+    bytes: int = 0
+    seconds: float = 0.0  # Spent moving, not waiting for a batch to fill
+    batches: int = 0
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.bytes / self.seconds if self.seconds > 0 else 0.0
+
+    def summary(self) -> str:
+        return (f"Moved {self.files} file(s), {self.bytes / 2**20:.1f} MB in {self.batches} "
+                f"batch(es) at {self.bytes_per_second / 2**20:.1f} MB/s")
+
+
+def _move_file(path: str, destination: str) -> tuple[str, int]:
+    target = os.path.join(destination, os.path.basename(path))
+    size = os.path.getsize(path)
+    try:
+        os.replace(path, target)  # Same file system
+    except OSError:
+        try:
+            shutil.copyfile(path, target)
+        except BaseException:
+            try:
+                os.remove(target)
+            except OSError:
+                pass
+            raise
+        os.remove(path)
+    return target, size
+
+
+class BulkMover:
+    # Moves staged output files to their destination folders on one
+    # background thread. Files wait until BATCH_BYTES are waiting, the first
+    # of them has waited BATCH_SECONDS, or flush() is called, and are then
+    # moved in one go, grouped by destination, so converting never waits on
+    # the network and the network sees long sequential copies instead of
+    # the encoders' small writes. Each destination folder is created (or
+    # checked) once per batch.
+
+    def __init__(self, batch_bytes: int = BATCH_BYTES, batch_seconds: float = BATCH_SECONDS):
+        self.batch_bytes = batch_bytes
+        self.batch_seconds = batch_seconds
+        self._condition = threading.Condition()
+        self._pending = []  # (future, paths, destination, key)
+        self._pending_bytes = 0
+        self._first_queued = 0.0
+        self._flushing = False
+        self._closed = False
+        self._stats = {}  # key -> TransferStats
+        self._thread = None
+
+    def move(self, paths: list, destination: str, key=None) -> Future:
+        # Moves the files into destination. The list is updated in place to
+        # the moved paths and is the Future's result.
+        future = Future()
+        size = 0
+        for path in paths:
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass  # Reported when it is moved
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("BulkMover is shut down")
+            if not self._pending:
+                self._first_queued = time.monotonic()
+            self._pending.append((future, paths, destination, key))
+            self._pending_bytes += size
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="bulk-mover", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return future
+
+    def flush(self) -> None:
+        # Moves what is waiting without waiting for the batch to fill
+        with self._condition:
+            if self._pending:
+                self._flushing = True
+                self._condition.notify()
+
+    def stats(self, key=None) -> TransferStats:
+        with self._condition:
+            stats = self._stats.get(key)
+            return TransferStats() if stats is None else TransferStats(**vars(stats))
+
+    def _ready(self) -> float | None:
+        # Seconds until the waiting files are due, 0 when they are
+        if not self._pending:
+            return None
+        if self._flushing or self._closed or self._pending_bytes >= self.batch_bytes:
+            return 0.0
+        return max(0.0, self._first_queued + self.batch_seconds - time.monotonic())
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while True:
+                    due = self._ready()
+                    if due == 0.0 or (due is None and self._closed):
+                        break
+                    self._condition.wait(due)
+                if not self._pending:
+                    return
+                batch, self._pending = self._pending, []
+                self._pending_bytes = 0
+                self._flushing = False
+            self._move_batch(sorted(batch, key=lambda item: item[2]))
+
+    def _move_batch(self, batch: list) -> None:
+        checked = set()
+        keys = set()
+        for future, paths, destination, key in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            start = time.perf_counter()
+            moved_bytes = 0
+            try:
+                if destination not in checked:
+                    os.makedirs(destination, exist_ok=True)
+                    checked.add(destination)
+                for number, path in enumerate(paths):
+                    paths[number], size = _move_file(path, destination)
+                    moved_bytes += size
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            with self._condition:
+                stats = self._stats.setdefault(key, TransferStats())
+                stats.files += len(paths)
+                stats.bytes += moved_bytes
+                stats.seconds += time.perf_counter() - start
+                if key not in keys:
+                    stats.batches += 1
+                    keys.add(key)
+            future.set_result(paths)
+
+    def shutdown(self, wait: bool = True) -> None:
+        # With wait, moves everything still waiting first; otherwise it is
+        # cancelled and stays in the staging folder
+        with self._condition:
+            self._closed = True
+            if not wait:
+                for future, *_ in self._pending:
+                    future.cancel()
+                self._pending = []
+                self._pending_bytes = 0
+            self._condition.notify()
+            thread = self._thread
+        if wait and thread is not None:
+            thread.join()
@@ -0,0 +1,92 @@
+import json
+import sys
+import threading
+import time
+from concurrent.futures import Future
+
+
+LAUNCHED = time.perf_counter()  # Import of this module, the first thing the app does
+REPORT_FLAG = "--startup-report"
+
+
+class StartupTimer:
+    # Seconds from launch to each startup milestone, recorded the first time
+    # it is reached. The codecs only start loading, in the background, once
+    # the window has been painted.
+
+    def __init__(self, launched: float = LAUNCHED):
+        self.launched = launched
+        self.marks = {}
+        self._lock = threading.Lock()
+
+    def mark(self, name: str) -> None:
+        with self._lock:
+            self.marks.setdefault(name, time.perf_counter() - self.launched)
+
+    def report(self) -> str:
+        with self._lock:
+            marks = sorted(self.marks.items(), key=lambda item: item[1])
+        lines = ["Startup times since launch:"]
+        previous = 0.0
+        for name, seconds in marks:
+            lines.append(f"  {name:<14}{seconds * 1000:8.1f} ms  "
+                         f"(+{(seconds - previous) * 1000:.1f} ms)")
+            previous = seconds
+        return "\n".join(lines)
+
+    def to_json(self) -> dict:
+        with self._lock:
+            marks = dict(self.marks)
+        return {"time": time.time(), "python": sys.version.split()[0], "platform": sys.platform,
+                "frozen": bool(getattr(sys, "frozen", False)), "marks": marks}
+
+    def save(self, path: str) -> None:
+        # Appends one JSON line, so runs of different releases can be compared
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(self.to_json()) + "\n")
+
+
+startup_timer = StartupTimer()
+
+
+def report_target(argv) -> tuple[bool, str | None]:
+    # Whether --startup-report was given, and the file of --startup-report=FILE
+    for arg in argv[1:]:
+        if arg == REPORT_FLAG:
+            return True, None
+        if arg.startswith(REPORT_FLAG + "="):
+            return True, arg.split("=", 1)[1] or None
+    return False, None
+
+
+_codecs: Future | None = None
+_codecs_lock = threading.Lock()
+
+
+def _load_codecs(future: Future) -> None:
+    future.set_running_or_notify_cancel()
+    try:
+        from pillow_heif import register_heif_opener
+        from PIL import Image
+
+        register_heif_opener()
+        Image.init()  # Pillow would import its format plugins on the first open otherwise
+    except Exception as e:
+        future.set_exception(e)
+        return
+    startup_timer.mark("codecs")
+    future.set_result(None)
+
+
+def load_codecs() -> Future:
+    # Imports pillow_heif (libheif and its codecs), registers the HEIF opener
+    # with Pillow and loads Pillow's plugins on a background thread, once;
+    # the returned Future fails with ImportError if pillow_heif is missing.
+    # Anything that opens a HEIF file in this process waits for it first.
+    global _codecs
+    with _codecs_lock:
+        if _codecs is None:
+            _codecs = Future()
+            threading.Thread(target=_load_codecs, args=(_codecs,), name="codecs",
+                             daemon=True).start()
+        return _codecs
@@ -0,0 +1,86 @@
+from PIL import Image
+
+from heif2png import archives
+from heif2png.pixels import DEFAULT_MATTE, composite_onto_matte
+from heif2png.png import DEFAULT_CHUNK_SIZE, PNGStreamWriter, write_png_parallel
+
+
+STRIP_BYTES = 8 * 1024 * 1024  # Decoded bytes handed to the encoder per strip
+
+
+class DecodedCanvas:
+    # The primary image of a HEIF file, decoded by libheif into a single
+    # buffer. Strips are cut straight out of that buffer, so encoders that can
+    # consume rows never need a second full-size copy of the pixels.
+
+    def __init__(self, file_path: str):
+        import pillow_heif
+
+        heif_file = pillow_heif.open_heif(
+            archives.open_source(file_path), convert_hdr_to_8bit=True)
+        heif_image = heif_file[heif_file.primary_index]
+        self.mode = heif_image.mode
+        self.info = dict(heif_image.info)
+        pillow_heif.set_orientation(self.info)  # libheif already applied the rotation
+        self._heif_file = heif_file
+        self._data = memoryview(heif_image.data)
+        self.stride = heif_image.stride
+        self.size = heif_image.size
+        self.pixel_transform = None  # Applied to every strip and to to_pillow()
+
+    @property
+    def strip_rows(self) -> int:
+        return max(1, STRIP_BYTES // self.stride)
+
+    def strip(self, top: int, rows: int) -> Image.Image:
+        start = top * self.stride
+        strip = Image.frombytes(
+            self.mode, (self.size[0], rows),
+            self._data[start:start + rows * self.stride], "raw", self.mode, self.stride)
+        return self.pixel_transform(strip) if self.pixel_transform else strip
+
+    def strips(self):
+        rows = self.strip_rows
+        for top in range(0, self.size[1], rows):
+            yield top, self.strip(top, min(rows, self.size[1] - top))
+
+    def to_pillow(self) -> Image.Image:
+        pil_image = Image.frombytes(
+            self.mode, self.size, self._data, "raw", self.mode, self.stride)
+        if self.pixel_transform:
+            pil_image = self.pixel_transform(pil_image)
+        pil_image.info = dict(self.info)
+        return pil_image
+
+    def release(self) -> None:
+        self._data.release()
+        self._heif_file = None
+
+
+def write_png(canvas: DecodedCanvas, output_path: str, icc_profile=None, exif=None,
+              threads=1, chunk_size=DEFAULT_CHUNK_SIZE, on_strip=None) -> None:
+    # on_strip(top, strip), if given, sees every strip once as it is written
+    with archives.open_output(output_path) as fp:
+        if threads == 1:
+            writer = PNGStreamWriter(fp, canvas.size, canvas.mode, icc_profile, exif)
+            for top, strip in canvas.strips():
+                if on_strip is not None:
+                    on_strip(top, strip)
+                writer.write_strip(strip)
+            writer.close()
+        else:
+            write_png_parallel(
+                fp, canvas.size, canvas.mode, canvas.strip, threads=threads,
+                chunk_size=chunk_size, icc_profile=icc_profile, exif=exif, on_rows=on_strip)
+
+
+def flatten_for_jpeg(canvas: DecodedCanvas, matte=DEFAULT_MATTE) -> Image.Image:
+    # The JPEG encoder needs the whole image, but it never needs the alpha
+    # channel: composite each strip onto the matte as it is cut from the canvas
+    # instead of splitting channels and pasting onto a full-size background.
+    if canvas.mode == "RGB":
+        return canvas.to_pillow()
+    flattened = Image.new("RGB", canvas.size, matte)
+    for top, strip in canvas.strips():
+        composite_onto_matte(flattened, strip, (0, top))
+    return flattened
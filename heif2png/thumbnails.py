@@ -0,0 +1,237 @@
+import hashlib
+import os
+import struct
+import sys
+import tempfile
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from urllib.parse import unquote, urlparse
+
+from PIL import Image, PngImagePlugin
+
+from heif2png.archives import source_stat
+from heif2png.png import PNG_SIGNATURE
+
+
+# Buckets from the freedesktop.org thumbnail specification, smallest first
+SIZES = {"normal": 128, "large": 256, "x-large": 512, "xx-large": 1024}
+SOFTWARE = "heif2png"
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+def default_root() -> str:
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+        return os.path.join(base, "heif2png", "thumbnails")
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "thumbnails")
+
+
+def file_uri(path: str) -> str:
+    return Path(os.path.abspath(path)).as_uri()
+
+
+def bucket_for(size: int) -> str:
+    for name, bucket_size in SIZES.items():
+        if bucket_size >= size:
+            return name
+    return "xx-large"
+
+
+def _text_chunks(thumbnail_path: str) -> dict:
+    # Reads the tEXt chunks ahead of the image data without decoding pixels
+    text = {}
+    with open(thumbnail_path, "rb") as f:
+        if f.read(8) != PNG_SIGNATURE:
+            return text
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                break
+            length, tag = struct.unpack(">I4s", header)
+            if tag == b"IDAT" or tag == b"IEND":
+                break
+            data = f.read(length)
+            f.seek(4, os.SEEK_CUR)
+            if tag == b"tEXt" and b"\0" in data:
+                key, value = data.split(b"\0", 1)
+                text[key.decode("latin-1")] = value.decode("latin-1")
+    return text
+
+
+@dataclass(frozen=True)
+class PruneResult:
+    removed: int
+    freed_bytes: int
+    kept: int
+    kept_bytes: int
+
+
+class ThumbnailCache:
+    # On-disk thumbnails laid out as in the freedesktop.org thumbnail spec:
+    # <root>/<bucket>/<md5 of the file URI>.png, tagged with Thumb::URI and
+    # Thumb::MTime so a modified source is detected. The directory is shared
+    # with file managers, so size-based eviction and pruning only ever touch
+    # thumbnails written by this application. max_bytes is enforced as
+    # thumbnails are stored: the first store, and every store that takes the
+    # cache over the limit, evicts the least recently used on a background
+    # thread.
+
+    def __init__(self, root: str | None = None, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.root = root or default_root()
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._cached_bytes = None  # Bytes of own thumbnails as of the last prune, plus stores
+        self._evicting = False
+
+    def thumbnail_path(self, path: str, bucket: str) -> str:
+        digest = hashlib.md5(file_uri(path).encode("utf-8")).hexdigest()
+        return os.path.join(self.root, bucket, f"{digest}.png")
+
+    def load(self, path: str, size: int) -> Image.Image | None:
+        bucket = bucket_for(size)
+        thumbnail_path = self.thumbnail_path(path, bucket)
+        try:
+            stat = source_stat(path)
+            text = _text_chunks(thumbnail_path)
+            if text.get("Thumb::URI") != file_uri(path) or \
+                    text.get("Thumb::MTime") != str(int(stat.st_mtime)):
+                return None
+            thumbnail = Image.open(thumbnail_path)
+            thumbnail.load()
+            os.utime(thumbnail_path)  # Recency for eviction; atime is often not kept
+            return thumbnail
+        except (OSError, SyntaxError, ValueError):
+            return None
+
+    def store(self, path: str, pil_image: Image.Image, size: int) -> Image.Image | None:
+        # Writes the thumbnail for the bucket covering size and returns it, or
+        # None when the source or the cache directory is unavailable.
+        bucket = bucket_for(size)
+        bucket_size = SIZES[bucket]
+        try:
+            stat = source_stat(path)
+        except OSError:
+            return None
+
+        scale = min(1.0, bucket_size / max(pil_image.size))
+        target = (max(1, round(pil_image.width * scale)), max(1, round(pil_image.height * scale)))
+        if pil_image.mode not in ("RGB", "RGBA"):
+            pil_image = pil_image.convert("RGBA" if "A" in pil_image.mode else "RGB")
+        thumbnail = pil_image.resize(target, Image.Resampling.LANCZOS, reducing_gap=2.0) \
+            if target != pil_image.size else pil_image.copy()
+
+        info = PngImagePlugin.PngInfo()
+        info.add_text("Thumb::URI", file_uri(path))
+        info.add_text("Thumb::MTime", str(int(stat.st_mtime)))
+        info.add_text("Thumb::Size", str(stat.st_size))
+        info.add_text("Thumb::Image::Width", str(pil_image.width))
+        info.add_text("Thumb::Image::Height", str(pil_image.height))
+        info.add_text("Software", SOFTWARE)
+
+        thumbnail_path = self.thumbnail_path(path, bucket)
+        try:
+            os.makedirs(os.path.dirname(thumbnail_path), mode=0o700, exist_ok=True)
+            # Write to a temporary file first so readers never see a partial PNG
+            fd, temp_path = tempfile.mkstemp(
+                suffix=".png", dir=os.path.dirname(thumbnail_path))
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    thumbnail.save(f, "PNG", pnginfo=info)
+                os.chmod(temp_path, 0o600)
+                os.replace(temp_path, thumbnail_path)
+                written = os.path.getsize(thumbnail_path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+        except OSError:
+            return None
+        self._stored(written)
+        return thumbnail
+
+    def _stored(self, nbytes: int) -> None:
+        with self._lock:
+            if self._cached_bytes is not None:
+                self._cached_bytes += nbytes
+                if self._cached_bytes <= self.max_bytes:
+                    return
+            if self._evicting:
+                return
+            self._evicting = True
+        threading.Thread(target=self._evict, name="thumbnail-eviction", daemon=True).start()
+
+    def _evict(self) -> None:
+        try:
+            self.prune(remove_stale=False)
+        finally:
+            with self._lock:
+                self._evicting = False
+
+    def _own_entries(self):
+        for bucket in SIZES:
+            bucket_dir = os.path.join(self.root, bucket)
+            try:
+                entries = list(os.scandir(bucket_dir))
+            except OSError:
+                continue
+            for entry in entries:
+                if not entry.name.endswith(".png"):
+                    continue
+                try:
+                    text = _text_chunks(entry.path)
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                if text.get("Software") == SOFTWARE:
+                    yield entry.path, text, stat
+
+    def prune(self, remove_stale: bool = True) -> PruneResult:
+        # Removes thumbnails whose source is gone or changed, then evicts the
+        # least recently used ones until the cache fits in max_bytes.
+        removed = 0
+        freed = 0
+        kept = []
+        for thumbnail_path, text, stat in self._own_entries():
+            if remove_stale and self._is_stale(text):
+                if self._remove(thumbnail_path):
+                    removed += 1
+                    freed += stat.st_size
+                continue
+            kept.append((stat.st_mtime, stat.st_size, thumbnail_path))
+
+        kept_bytes = sum(size for _, size, _ in kept)
+        kept.sort(reverse=True)  # Most recently used first, evicted from the end
+        while kept and kept_bytes > self.max_bytes:
+            _, size, thumbnail_path = kept.pop()
+            if self._remove(thumbnail_path):
+                removed += 1
+                freed += size
+                kept_bytes -= size
+        with self._lock:
+            self._cached_bytes = kept_bytes
+        return PruneResult(removed, freed, len(kept), kept_bytes)
+
+    @staticmethod
+    def _is_stale(text: dict) -> bool:
+        uri = text.get("Thumb::URI", "")
+        if not uri.startswith("file://"):
+            return False
+        path = unquote(urlparse(uri).path)
+        if sys.platform == "win32" and path.startswith("/"):
+            path = path[1:]
+        try:
+            return str(int(source_stat(path).st_mtime)) != text.get("Thumb::MTime")
+        except OSError:
+            return True
+
+    @staticmethod
+    def _remove(thumbnail_path: str) -> bool:
+        try:
+            os.remove(thumbnail_path)
+            return True
+        except OSError:
+            return False
+
+
+thumbnail_cache = ThumbnailCache()
@@ -0,0 +1,192 @@
+import statistics
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from dataclasses import dataclass
+
+from PIL import Image
+
+from heif2png.archives import open_source
+from heif2png.governor import LoadMonitor, Pressure, ResourceLimits
+from heif2png.workers import Concurrency, ConversionPool, cpu_count
+
+
+TRIAL_FILES = 3  # Fewest files converted under each candidate while calibrating
+PROFILE_SAMPLE_FILES = 16  # Files whose headers are read to classify a batch
+# Upper bounds in megapixels of the size classes; anything larger is "64MP+"
+SIZE_CLASSES = ((4, "<4MP"), (16, "4-16MP"), (64, "16-64MP"))
+_POLL_SECONDS = 0.05
+
+
+@dataclass(frozen=True)
+class WorkloadProfile:
+    # What the best concurrency depends on. A batch with a different profile
+    # is calibrated again instead of reusing another profile's result.
+    cpu_count: int
+    size_class: str
+    formats: tuple[str, ...]
+
+    @property
+    def key(self) -> str:
+        return f"{self.cpu_count}cpu/{self.size_class}/{'+'.join(self.formats)}"
+
+
+def image_megapixels(file_path: str) -> float:
+    # Only the header is parsed; nothing is decoded
+    try:
+        with Image.open(open_source(file_path)) as pil_image:
+            return pil_image.width * pil_image.height / 1e6
+    except Exception:
+        return 0.0
+
+
+def spread_indexes(count: int, wanted: int) -> list[int]:
+    # Indexes of up to wanted items evenly spaced over range(count)
+    if count <= wanted:
+        return list(range(count))
+    return sorted({round(i * (count - 1) / (wanted - 1)) for i in range(wanted)})
+
+
+def trial_sizes(configs, trial_files: int = TRIAL_FILES) -> list[int]:
+    # Files converted under each candidate: at least two per process, so a
+    # candidate with many processes is timed with all of them busy instead of
+    # mostly starting up and draining
+    return [max(trial_files, 2 * config.processes) for config in configs]
+
+
+def split_sample(count: int, sizes) -> list[list[int]]:
+    # Evenly spaced indexes of range(count) dealt out so that each candidate
+    # gets its size spread over the whole list, however the sizes differ
+    turns = [number for _, number in sorted(
+        ((turn + 0.5) / size, number)
+        for number, size in enumerate(sizes) for turn in range(size))]
+    shares = [[] for _ in sizes]
+    for number, index in zip(turns, spread_indexes(count, sum(sizes))):
+        shares[number].append(index)
+    return shares
+
+
+def workload_profile(file_paths, options) -> WorkloadProfile:
+    sizes = [image_megapixels(file_paths[i]) for i in spread_indexes(len(file_paths), PROFILE_SAMPLE_FILES)]
+    median = statistics.median(sizes) if sizes else 0.0
+    size_class = next((name for limit, name in SIZE_CLASSES if median < limit), "64MP+")
+    formats = sorted({rendition.format for rendition in options.renditions})
+    if options.animate_sequences:
+        formats.append("animated")
+    return WorkloadProfile(cpu_count(), size_class, tuple(formats))
+
+
+def candidates(cores: int | None = None) -> list[Concurrency]:
+    # From one process using every core for decoding to one process per core
+    cores = cores or cpu_count()
+    configs = []
+    processes = 1
+    while processes <= cores:
+        config = Concurrency(processes, max(1, cores // processes))
+        if config not in configs:
+            configs.append(config)
+        processes *= 2
+    if Concurrency(cores, 1) not in configs:
+        configs.append(Concurrency(cores, 1))
+    return configs
+
+
+@dataclass(frozen=True)
+class Trial:
+    concurrency: Concurrency
+    files: int
+    megapixels: float
+    seconds: float
+
+    @property
+    def throughput(self) -> float:
+        # Megapixels per second
+        return self.megapixels / self.seconds if self.seconds > 0 else 0.0
+
+
+class BatchRunner:
+    # Converts (file_path, output_dir) jobs and yields (index, output paths or
+    # the exception raised) as files complete. Without a known concurrency the
+    # batch calibrates itself: a few evenly spaced files are converted under
+    # each candidate in turn, so the trial is real work rather than a separate
+    # benchmark, and the rest of the batch runs with the fastest candidate.
+    # Batches too small to repay the trials keep the single-process default.
+    # Files are handed to the pool one more than it has processes at a time,
+    # so that, like JobScheduler, the runner can hold back new files while
+    # the system is over the load or memory thresholds of limits.
+
+    def __init__(self, jobs, options, concurrency: Concurrency | None = None,
+                 candidate_configs=None, trial_files: int = TRIAL_FILES, idle=None,
+                 limits: ResourceLimits = ResourceLimits()):
+        self.jobs = list(jobs)
+        self.options = options
+        self.limits = limits
+        self.concurrency = limits.cap(concurrency) if concurrency is not None else None
+        self.candidates = list(dict.fromkeys(
+            limits.cap(config) for config in candidate_configs or candidates()))
+        self.trial_files = trial_files
+        self.trial_sizes = trial_sizes(self.candidates, trial_files)
+        self.idle = idle  # Called while waiting, e.g. to keep a GUI responsive
+        self.trials: list[Trial] = []
+        self.monitor = LoadMonitor()
+        self.backing_off: Pressure | None = None  # Why new files are held back, if they are
+
+    @property
+    def calibrating(self) -> bool:
+        return self.concurrency is None and len(self.candidates) > 1 and \
+            len(self.jobs) >= 2 * sum(self.trial_sizes)
+
+    def _run(self, pool, indexes):
+        todo = list(reversed(indexes))
+        futures = {}
+        capacity = pool.concurrency.processes + 1
+        while todo or futures:
+            if todo and len(futures) < capacity:
+                busy = min(len(futures), pool.concurrency.processes)
+                self.backing_off = self.monitor.pressure(
+                    self.limits, busy * pool.concurrency.decode_threads)
+                while todo and len(futures) < capacity and self.backing_off is None:
+                    file_path, output_dir = self.jobs[todo[-1]]
+                    futures[pool.submit(file_path, output_dir, self.options)] = todo.pop()
+            if futures:
+                done, _ = wait(futures, timeout=_POLL_SECONDS, return_when=FIRST_COMPLETED)
+            else:
+                done = ()
+                time.sleep(_POLL_SECONDS)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = e
+                yield futures.pop(future), result
+            if not done and self.idle:
+                self.idle()
+
+    def __iter__(self):
+        remaining = list(range(len(self.jobs)))
+        if self.calibrating:
+            samples = split_sample(len(self.jobs), self.trial_sizes)
+            sampled = {index for indexes in samples for index in indexes}
+            remaining = [index for index in remaining if index not in sampled]
+            for concurrency, indexes in zip(self.candidates, samples):
+                pool = ConversionPool(concurrency, self.limits)
+                try:
+                    pool.warm_up()
+                    megapixels = sum(image_megapixels(self.jobs[i][0]) for i in indexes)
+                    start = time.perf_counter()
+                    results = list(self._run(pool, indexes))
+                    self.trials.append(Trial(
+                        concurrency, len(indexes), megapixels, time.perf_counter() - start))
+                finally:
+                    pool.shutdown()
+                if len(self.trials) == len(self.candidates):
+                    self.concurrency = max(
+                        self.trials, key=lambda trial: trial.throughput).concurrency
+                yield from results
+        elif self.concurrency is None:
+            self.concurrency = self.limits.cap(Concurrency())
+
+        pool = ConversionPool(self.concurrency, self.limits)
+        try:
+            yield from self._run(pool, remaining)
+        finally:
+            pool.shutdown()
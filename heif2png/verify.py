@@ -0,0 +1,124 @@
+import threading
+from dataclasses import dataclass
+
+from PIL import Image, ImageChops, ImageStat
+
+from heif2png.archives import is_member_path
+
+
+DEFAULT_THREADS = 2  # Outputs verified at once while conversion goes on
+THUMBNAIL_SIZE = (16, 16)
+# Largest mean difference per channel (0-255) between the thumbnails of what
+# was encoded and what was read back; lossy formats need some room
+LOSSLESS_TOLERANCE = 1.0
+LOSSY_TOLERANCE = 6.0
+_THUMBNAIL_MODES = ("L", "LA", "RGB", "RGBA")
+
+
+class VerificationError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class Fingerprint:
+    # What an output should read back as: taken from the image that was
+    # handed to the encoder, so verifying never decodes the source again
+    format: str
+    size: tuple[int, int]
+    mode: str | None = None  # None skips the mode check (animations)
+    frames: int = 1
+    pixels: bytes | None = None  # RGBA thumbnail; None skips the pixel check
+
+
+def _thumbnail(pil_image: Image.Image) -> Image.Image | None:
+    if pil_image.mode not in _THUMBNAIL_MODES:
+        return None
+    return pil_image.resize(THUMBNAIL_SIZE, Image.Resampling.BOX).convert("RGBA")
+
+
+def fingerprint(pil_image: Image.Image, output_format: str) -> Fingerprint:
+    thumbnail = _thumbnail(pil_image)
+    return Fingerprint(output_format, pil_image.size, pil_image.mode,
+                       pixels=thumbnail.tobytes() if thumbnail is not None else None)
+
+
+class StripThumbnail:
+    # The fingerprint of an image that only ever exists as strips. A BOX
+    # resize narrows the rows first and shrinks the columns after, so each
+    # strip is narrowed to the thumbnail width as it is written, and the tall
+    # column of narrowed rows is shrunk at the end. Alpha is premultiplied
+    # throughout, as Image.resize does, so the result matches fingerprint()
+    # of the whole image.
+
+    def __init__(self, size: tuple[int, int], mode: str):
+        self.size = size
+        self.mode = mode
+        self._working_mode = {"LA": "La", "RGBA": "RGBa"}.get(mode, mode)
+        self._column = None
+        if mode in _THUMBNAIL_MODES:
+            self._column = Image.new(self._working_mode, (THUMBNAIL_SIZE[0], size[1]))
+        self._lock = threading.Lock()  # Parallel PNG bands arrive from many threads
+
+    def add(self, top: int, strip: Image.Image) -> None:
+        if self._column is None:
+            return
+        if strip.mode != self.mode:
+            strip = strip.convert(self.mode)
+        if self._working_mode != self.mode:
+            strip = strip.convert(self._working_mode)
+        narrowed = strip.resize((THUMBNAIL_SIZE[0], strip.height), Image.Resampling.BOX)
+        with self._lock:
+            self._column.paste(narrowed, (0, top))
+
+    def fingerprint(self, output_format: str) -> Fingerprint:
+        pixels = None
+        if self._column is not None:
+            thumbnail = self._column.resize(THUMBNAIL_SIZE, Image.Resampling.BOX)
+            pixels = thumbnail.convert(self.mode).convert("RGBA").tobytes()
+        return Fingerprint(output_format, self.size, self.mode, pixels=pixels)
+
+
+def verify_output(path: str, expected: Fingerprint) -> None:
+    # Decodes the whole output and compares it with expected; raises
+    # VerificationError on any mismatch and the decoder's error if the file
+    # cannot be read
+    name = path.replace("\\", "/").rsplit("/", 1)[-1]
+    with Image.open(path) as output:
+        if output.size != expected.size:
+            raise VerificationError(
+                f"{name} is {output.size[0]}x{output.size[1]} instead of "
+                f"{expected.size[0]}x{expected.size[1]}")
+        frames = getattr(output, "n_frames", 1)
+        if frames != expected.frames:
+            raise VerificationError(f"{name} has {frames} frame(s) instead of {expected.frames}")
+        # The grayscale or color base has to match; alpha is compared with
+        # the pixels, since an encoder may drop a fully opaque alpha channel
+        if expected.mode is not None and \
+                Image.getmodebase(output.mode) != Image.getmodebase(expected.mode):
+            raise VerificationError(f"{name} is {output.mode} instead of {expected.mode}")
+        for index in range(frames):
+            output.seek(index)
+            output.load()
+        if expected.pixels is None:
+            return
+        thumbnail = _thumbnail(output if output.mode in _THUMBNAIL_MODES
+                               else output.convert("RGBA"))
+    reference = Image.frombytes("RGBA", THUMBNAIL_SIZE, expected.pixels)
+    difference = sum(ImageStat.Stat(ImageChops.difference(thumbnail, reference)).mean) / 4
+    tolerance = LOSSLESS_TOLERANCE if expected.format == "png" else LOSSY_TOLERANCE
+    if difference > tolerance:
+        raise VerificationError(
+            f"{name} differs from the converted image (mean difference {difference:.1f})")
+
+
+def verify_outputs(output_paths):
+    # Verifies every output of a convert_file result that carries
+    # fingerprints and returns the result unchanged. Outputs inside a ZIP are
+    # skipped: the archive is still being written, and reading it back checks
+    # each member's CRC anyway.
+    fingerprints = getattr(output_paths, "fingerprints", None)
+    if fingerprints:
+        for path, expected in zip(output_paths, fingerprints):
+            if not is_member_path(path):
+                verify_output(path, expected)
+    return output_paths
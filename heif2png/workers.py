@@ -0,0 +1,148 @@
+import ctypes
+import ctypes.util
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+
+from heif2png.archives import is_member_path
+from heif2png.conversion import ConversionOptions, convert_file
+from heif2png.governor import ResourceLimits, lower_priority, write_throttle
+from heif2png.metrics import conversion_metrics
+from heif2png.profiling import active_directory, profiled
+
+
+# pillow_heif.options.DECODE_THREADS out of the box. pillow_heif loads libheif
+# and its codecs, so it is only imported once something converts.
+DEFAULT_DECODE_THREADS = 4
+
+
+@dataclass(frozen=True)
+class Concurrency:
+    processes: int = 1
+    decode_threads: int = DEFAULT_DECODE_THREADS
+
+    def __str__(self):
+        return f"{self.processes} process(es) x {self.decode_threads} decode thread(s)"
+
+    def to_setting(self) -> str:
+        return f"{self.processes}x{self.decode_threads}"
+
+    @classmethod
+    def from_setting(cls, value) -> "Concurrency | None":
+        try:
+            processes, decode_threads = (int(part) for part in str(value).split("x"))
+        except ValueError:
+            return None
+        if processes < 1 or decode_threads < 1:
+            return None
+        return cls(processes, decode_threads)
+
+
+def cpu_count() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _load_malloc_trim():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        return ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6").malloc_trim
+    except (OSError, AttributeError):
+        return None  # Not glibc
+
+
+_malloc_trim = _load_malloc_trim()
+
+
+def release_memory() -> None:
+    # libheif and the encoders allocate and free tens of megabytes per file,
+    # and glibc keeps most of it in the heap, so a worker's resident memory
+    # would sit near the high-water mark of every file it has converted.
+    # Trimming hands it back to the system between files. Other allocators
+    # return freed memory on their own.
+    if _malloc_trim is not None:
+        _malloc_trim(0)
+
+
+def convert_and_release(file_path: str, output_dir: str, options: ConversionOptions) -> list[str]:
+    try:
+        return convert_file(file_path, output_dir, options)
+    finally:
+        release_memory()
+
+
+def _init_worker(decode_threads: int, limits: ResourceLimits, write_limit: int) -> None:
+    import pillow_heif
+
+    lower_priority(limits, whole_process=True)
+    write_throttle.set_rate(write_limit)
+    pillow_heif.register_heif_opener()
+    pillow_heif.options.DECODE_THREADS = decode_threads
+
+
+class ConversionPool:
+    # Runs convert_file with a given mix of worker processes and libheif
+    # decode threads. With a single process the work stays in this process on
+    # a background thread, which keeps the decoded image cache useful. Files
+    # written into a ZIP output always stay here as well: the archive being
+    # written is only open in this process. Files submitted while a
+    # profiling.ProfileSession runs are profiled wherever they convert.
+    #
+    # The priorities and core limit of limits apply to the worker processes
+    # and the local conversion thread, never to the rest of this process;
+    # its write limit is split evenly between them.
+
+    def __init__(self, concurrency: Concurrency, limits: ResourceLimits = ResourceLimits()):
+        import pillow_heif
+
+        self.concurrency = concurrency
+        self.limits = limits
+        self._previous_threads = pillow_heif.options.DECODE_THREADS
+        pillow_heif.options.DECODE_THREADS = concurrency.decode_threads
+        write_limit = limits.write_limit // concurrency.processes
+        self._previous_write_limit = write_throttle.rate
+        write_throttle.set_rate(write_limit)
+        self._local = ThreadPoolExecutor(max_workers=1, thread_name_prefix="conversion",
+                                         initializer=lower_priority, initargs=(limits,))
+        self._processes = None
+        if concurrency.processes > 1:
+            self._processes = ProcessPoolExecutor(
+                max_workers=concurrency.processes, initializer=_init_worker,
+                initargs=(concurrency.decode_threads, limits, write_limit))
+        conversion_metrics.add_workers(concurrency.processes)
+
+    def warm_up(self) -> None:
+        # Starts every worker process, so trials do not time process start-up
+        if self._processes is not None:
+            for future in [self._processes.submit(cpu_count)
+                           for _ in range(self.concurrency.processes)]:
+                future.result()
+
+    def submit(self, file_path: str, output_dir: str, options: ConversionOptions):
+        executor = self._local
+        if self._processes is not None and not is_member_path(output_dir):
+            executor = self._processes
+        options = self.limits.cap_options(options)
+        profile_directory = active_directory()
+        if profile_directory is None:
+            future = executor.submit(convert_and_release, file_path, output_dir, options)
+        else:
+            future = executor.submit(profiled, profile_directory, convert_and_release,
+                                     file_path, output_dir, options)
+        conversion_metrics.submitted([rendition.format for rendition in options.renditions],
+                                     future)
+        return future
+
+    def shutdown(self) -> None:
+        import pillow_heif
+
+        conversion_metrics.add_workers(-self.concurrency.processes)
+        if self._processes is not None:
+            self._processes.shutdown(cancel_futures=True)
+        self._local.shutdown(cancel_futures=True)
+        pillow_heif.options.DECODE_THREADS = self._previous_threads
+        write_throttle.set_rate(self._previous_write_limit)